@@ -2,17 +2,179 @@
 """
 Apply named courts from progress cache to mock_courts_data.dart.
 This allows loading partial results while the main script is still running.
+
+With --incremental, names are read from the naming journal that
+name_courts_resumable appends to, starting where the previous apply
+stopped. Only those courts are patched, by id, and the batch is written
+as a delta for downstream sync, so publishing every few minutes during a
+long naming run costs time in proportion to the new names.
 """
 
+import argparse
 import json
+import os
 import re
 import sys
 
+from dart_emitter import DART_STRING, dart_string, is_dart_columns, read_dart_columns
+from name_courts_resumable import JOURNAL_FILE
+from pipeline_metrics import instrument, record_counts
+from staged_output import STATE_DIR, replace_if_changed, write_json_atomic
+
 PROGRESS_FILE = "/tmp/court_naming_progress.json"
 INPUT_FILE = "/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/mock_courts_data.dart"
 OUTPUT_FILE = "/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/mock_courts_data.dart"
 
+# Journal position of the last incremental apply, and the delta it wrote
+APPLY_STATE_FILE = os.path.join(STATE_DIR, "apply_named_courts.json")
+DELTA_FILE = os.path.join(STATE_DIR, "named_courts_delta.json")
+
+ID_RE = re.compile(r"'id':\s*" + DART_STRING)
+NAME_RE = re.compile(r"'name':\s*" + DART_STRING)
+
+
+def load_apply_state() -> dict:
+    try:
+        with open(APPLY_STATE_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def read_journal(path: str, state: dict):
+    """
+    Names journaled since the last apply: ({id: name}, start offset, end
+    offset, inode). Starts over if the journal was replaced or truncated
+    (--reset), and stops before a partly written last line.
+    """
+    stat = os.stat(path)
+    offset = state.get("offset", 0)
+    if state.get("inode") != stat.st_ino or offset > stat.st_size:
+        offset = 0
+    start = offset
+    names = {}
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            entry = json.loads(line)
+            names[entry["id"]] = entry["name"]
+    return names, start, offset, stat.st_ino
+
+
+def patch_names(content: str, names: dict):
+    """
+    Set the name of every court in `names` (by id, whatever the entry's
+    layout). Returns (new content, [{"id", "name"}] of courts that changed).
+    """
+    pieces = []
+    changed = []
+    last = 0
+    for match in ID_RE.finditer(content):
+        court_id = match.group(1)
+        if court_id not in names:
+            continue
+        # The name belongs to this entry if it comes before the entry closes
+        end = content.find("}", match.end())
+        name_match = NAME_RE.search(content, match.end(), end if end != -1 else len(content))
+        if name_match is None:
+            # 'name' listed before 'id'
+            start = content.rfind("{", 0, match.start())
+            name_match = NAME_RE.search(content, start, match.start())
+        if name_match is None or name_match.start() < last:
+            continue
+        literal = dart_string(names[court_id])
+        if content[name_match.start(1) - 1:name_match.end(1) + 1] == literal:
+            continue
+        pieces.append(content[last:name_match.start(1) - 1])
+        pieces.append(literal)
+        last = name_match.end(1) + 1
+        changed.append({"id": court_id, "name": names[court_id]})
+    pieces.append(content[last:])
+    return "".join(pieces), changed
+
+
+def rename_columnar(source: str, output: str, rename) -> list:
+    """
+    Rename courts in a fetch_osm_courts --columnar file, which the patterns
+    here can't edit: rename(court) returns the new name or None. Writes
+    `output` in the same layout and returns [{"id", "name"}] of courts that
+    changed.
+    """
+    from fetch_osm_courts import generate_dart_file
+    courts = read_dart_columns(source)
+    changed = []
+    for court in courts:
+        name = rename(court)
+        if name is not None and name != court["name"]:
+            court["name"] = name
+            changed.append({"id": court["id"], "name": name})
+    generate_dart_file(courts, output, columnar=True)
+    return changed
+
+
+def apply_incremental(args):
+    if not os.path.exists(args.journal):
+        print(f"No naming journal at {args.journal} (run name_courts_resumable.py first)")
+        return
+
+    state = load_apply_state()
+    if state.get("output") != os.path.abspath(args.output):
+        state = {}
+    names, start, offset, inode = read_journal(args.journal, state)
+    print(f"{len(names):,} new names in {args.journal} since offset {start:,}")
+    if not names:
+        print("Nothing to apply")
+        return
+
+    # Keep patching our own output; the input is only read the first time
+    source = args.output if state and os.path.exists(args.output) else args.input
+    print(f"Reading {source}...")
+    if is_dart_columns(source):
+        changed = rename_columnar(source, args.output, lambda court: names.get(court["id"]))
+    else:
+        with open(source, "r") as f:
+            content = f.read()
+        new_content, changed = patch_names(content, names)
+        tmp_path = f"{args.output}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            f.write(new_content)
+        replace_if_changed(tmp_path, args.output)
+    record_counts(records_in=len(names), records_out=len(changed))
+    print(f"Renamed {len(changed):,} courts")
+
+    write_json_atomic(args.delta, {
+        "journal": os.path.abspath(args.journal),
+        "from_offset": start,
+        "to_offset": offset,
+        "courts": changed,
+    })
+    write_json_atomic(APPLY_STATE_FILE, {
+        "output": os.path.abspath(args.output),
+        "inode": inode,
+        "offset": offset,
+        "applied": state.get("applied", 0) + len(changed),
+    })
+    print(f"Wrote {args.output} and delta {args.delta}")
+
+
+@instrument("apply_named_courts")
 def main():
+    parser = argparse.ArgumentParser(description="Apply court names to the Dart courts file")
+    parser.add_argument("--input", default=INPUT_FILE, help="Dart courts file to read")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="Dart courts file to write")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Apply only names journaled since the last run, patching courts by id")
+    parser.add_argument("--journal", default=JOURNAL_FILE, help="Naming journal for --incremental")
+    parser.add_argument("--delta", default=DELTA_FILE, help="Where --incremental writes the applied names")
+    args = parser.parse_args()
+
+    if args.incremental:
+        apply_incremental(args)
+        return
+
     # Load progress
     print(f"Loading progress from {PROGRESS_FILE}...")
     with open(PROGRESS_FILE, "r") as f:
@@ -25,9 +187,25 @@ def main():
         print("No named courts to apply")
         return
     
+    if is_dart_columns(args.input):
+        generic = []
+        
+        def rename(court):
+            if court["name"] != "Basketball Court":
+                return None
+            generic.append(court["id"])
+            return coord_cache.get(f"{round(court['lat'], 3)},{round(court['lng'], 3)}")
+        
+        print(f"Reading {args.input} (columnar)...")
+        changed = rename_columnar(args.input, args.output, rename)
+        record_counts(records_in=len(generic), records_out=len(changed))
+        print(f"Renamed {len(changed):,} of {len(generic):,} generic 'Basketball Court' entries")
+        print("Done!")
+        return
+    
     # Load input file
-    print(f"Reading {INPUT_FILE}...")
-    with open(INPUT_FILE, "r") as f:
+    print(f"Reading {args.input}...")
+    with open(args.input, "r") as f:
         content = f.read()
     
     # Count generic courts before
@@ -45,15 +223,14 @@ def main():
         # Check cache with rounded coords
         cache_key = f"{round(lat, 3)},{round(lng, 3)}"
         if cache_key in coord_cache:
-            new_name = coord_cache[cache_key]
-            # Escape single quotes in name
-            new_name = new_name.replace("'", "\\'")
-            return f"{{'id': '{court_id}', 'name': '{new_name}', 'lat': {lat}, 'lng': {lng}"
+            new_name = dart_string(coord_cache[cache_key])
+            return f"{{'id': '{court_id}', 'name': {new_name}, 'lat': {lat}, 'lng': {lng}"
         return match.group(0)
     
     # Apply replacements
     print("Applying named courts...")
     new_content = re.sub(pattern, replace_name, content)
+    record_counts(records_in=before_count, records_out=before_count - new_content.count("'name': 'Basketball Court'"))
     
     # Count generic courts after
     after_count = new_content.count("'name': 'Basketball Court'")
@@ -62,8 +239,8 @@ def main():
     print(f"Generic 'Basketball Court' entries after: {after_count:,}")
     
     # Write output
-    print(f"Writing to {OUTPUT_FILE}...")
-    with open(OUTPUT_FILE, "w") as f:
+    print(f"Writing to {args.output}...")
+    with open(args.output, "w") as f:
         f.write(new_content)
     
     print("Done!")
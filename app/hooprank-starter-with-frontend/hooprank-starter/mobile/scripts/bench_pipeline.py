@@ -0,0 +1,566 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the court data pipeline.
+
+Generates synthetic national-scale datasets and times the pipeline's hot
+paths on them: Dart/JSON parsing, venue classification, every dedupe pass,
+court naming (with a stubbed geocoder, no network or rate limit) and Dart/JSON
+generation.
+
+The generator is seeded, so the same --seed and size always produce the same
+records. Courts are concentrated around real metro areas (with a thinner rural
+background), names follow a skewed distribution with a large share of generic
+"Basketball Court" entries as in real OSM data, and a fixed share of records
+are planted duplicates (same name, a few metres apart) plus indoor gyms that
+duplicate an outdoor court.
+
+Each benchmark runs in its own process so one slow or runaway pass can be cut
+off by --timeout without losing the rest, and so peak RSS is per benchmark.
+Results are appended as JSON lines to .pipeline/bench/results.jsonl; use
+--compare to diff the last two runs.
+
+Usage:
+  python bench_pipeline.py                          # 10k and 100k records
+  python bench_pipeline.py --sizes 10000 100000 1000000 --timeout 1800
+  python bench_pipeline.py --only dedupe_ --sizes 100000
+  python bench_pipeline.py --compare
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from json_stream import JsonArrayWriter, iter_json_array
+from mock_osm_server import synthetic_reverse_geocode
+from staged_output import STATE_DIR
+
+BENCH_DIR = os.path.join(STATE_DIR, "bench")
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_FILE = os.path.join(BENCH_DIR, "results.jsonl")
+
+DEFAULT_SIZES = [10_000, 100_000]
+
+# Metro centers (lat, lng, relative weight, spread in km)
+METROS = [
+    ("New York", 40.71, -74.01, 10, 25), ("Los Angeles", 34.05, -118.24, 8, 40),
+    ("Chicago", 41.88, -87.63, 6, 25), ("Houston", 29.76, -95.37, 5, 35),
+    ("Phoenix", 33.45, -112.07, 4, 30), ("Philadelphia", 39.95, -75.17, 4, 20),
+    ("San Antonio", 29.42, -98.49, 3, 25), ("San Diego", 32.72, -117.16, 3, 25),
+    ("Dallas", 32.78, -96.80, 4, 35), ("San Francisco", 37.77, -122.42, 4, 30),
+    ("Seattle", 47.61, -122.33, 3, 25), ("Denver", 39.74, -104.99, 3, 25),
+    ("Washington", 38.91, -77.04, 4, 25), ("Boston", 42.36, -71.06, 3, 20),
+    ("Atlanta", 33.75, -84.39, 3, 30), ("Miami", 25.76, -80.19, 3, 25),
+    ("Minneapolis", 44.98, -93.27, 2, 20), ("Portland", 45.52, -122.68, 2, 20),
+    ("Detroit", 42.33, -83.05, 2, 25), ("Las Vegas", 36.17, -115.14, 2, 20),
+]
+CONUS_BBOX = (24.5, -124.5, 49.0, -67.0)
+URBAN_SHARE = 0.85
+
+# Name templates with weights; "{park}" etc. are filled from the pools below
+OUTDOOR_NAMES = [
+    ("Basketball Court", 25),
+    ("{park} Park", 15),
+    ("{park} Park Basketball Court", 10),
+    ("{park} Playground", 8),
+    ("{school} Elementary School", 6),
+    ("{school} High School", 4),
+    ("{park} Recreation Center", 4),
+    ("{street} Courts", 5),
+    ("{park} Community Center", 3),
+]
+INDOOR_NAMES = [
+    ("{school} High School", 20),
+    ("{school} Middle School", 12),
+    ("{park} Recreation Center", 14),
+    ("{park} Community Center", 12),
+    ("YMCA {city}", 8),
+    ("24 Hour Fitness {city}", 6),
+    ("{school} University", 5),
+    ("{city} Yoga Studio", 4),
+    ("{city} Gymnastics Academy", 3),
+    ("{park} Tennis Club", 3),
+    ("{city} Athletic Club", 6),
+    ("{school} College Gym", 4),
+    ("Unknown Sports Centre", 3),
+]
+INDOOR_CATEGORIES = ["high_school", "middle_school", "school", "college", "athletic_club",
+                     "recreation_center", "gym", "other"]
+PARKS = ["Lincoln", "Washington", "Jefferson", "Franklin", "Riverside", "Lakeview", "Oak",
+         "Maple", "Cedar", "Sunset", "Highland", "Mission", "Golden Gate", "Central", "Memorial",
+         "Veterans", "Martin Luther King", "Roosevelt", "Garfield", "Hillcrest", "Fairview",
+         "Willow", "Pine", "Madison", "Jackson", "Kennedy", "Eastside", "Westside", "Greenwood"]
+SCHOOLS = PARKS + ["St. Mary's", "O'Connor", "Ronald Reagan", "Cesar Chavez", "Thurgood Marshall"]
+STREETS = ["Main St", "2nd Ave", "Broadway", "Market St", "Elm St", "Park Ave", "Oak St", "MLK Blvd"]
+
+DUPLICATE_SHARE = 0.05          # same-name copies a few metres from the original
+CROSS_SOURCE_SHARE = 0.03       # indoor gyms planted next to a same-named outdoor court
+DUPLICATE_JITTER_M = 60
+
+
+def _weighted(templates: List[Tuple[str, int]]) -> Tuple[List[str], List[int]]:
+    return [t for t, _ in templates], [w for _, w in templates]
+
+
+def _point(rng: random.Random, metros_weights: List[int]) -> Tuple[float, float, str]:
+    if rng.random() < URBAN_SHARE:
+        city, lat, lng, _, spread_km = rng.choices(METROS, weights=metros_weights)[0]
+        lat += rng.gauss(0, spread_km / 3) / 111.0
+        lng += rng.gauss(0, spread_km / 3) / (111.0 * math.cos(math.radians(lat)))
+    else:
+        city = "Rural"
+        lat = rng.uniform(CONUS_BBOX[0], CONUS_BBOX[2])
+        lng = rng.uniform(CONUS_BBOX[1], CONUS_BBOX[3])
+    return round(lat, 7), round(lng, 7), city
+
+
+def _jitter(rng: random.Random, lat: float, lng: float, metres: float) -> Tuple[float, float]:
+    dlat = rng.uniform(-metres, metres) / 111_000 / math.sqrt(2)
+    dlng = rng.uniform(-metres, metres) / (111_000 * math.cos(math.radians(lat))) / math.sqrt(2)
+    return round(lat + dlat, 7), round(lng + dlng, 7)
+
+
+def _name(rng: random.Random, template: str, city: str) -> str:
+    return template.format(park=rng.choice(PARKS), school=rng.choice(SCHOOLS),
+                           street=rng.choice(STREETS), city=city)
+
+
+def generate_courts(n: int, seed: int) -> List[Dict]:
+    """`n` outdoor courts, about DUPLICATE_SHARE of them planted duplicates."""
+    rng = random.Random(f"courts:{seed}")
+    templates, weights = _weighted(OUTDOOR_NAMES)
+    metro_weights = [m[3] for m in METROS]
+    courts = []
+    for i in range(n):
+        if courts and rng.random() < DUPLICATE_SHARE:
+            orig = rng.choice(courts)
+            lat, lng = _jitter(rng, orig["lat"], orig["lng"], DUPLICATE_JITTER_M)
+            name = orig["name"] if rng.random() < 0.8 else orig["name"].upper()
+        else:
+            lat, lng, city = _point(rng, metro_weights)
+            name = _name(rng, rng.choices(templates, weights=weights)[0], city)
+        courts.append({"id": f"osm_{1_000_000 + i}", "name": name, "lat": lat, "lng": lng})
+    return courts
+
+
+def generate_gyms(n: int, seed: int, courts: List[Dict]) -> List[Dict]:
+    """`n` indoor gyms with planted same-name and cross-source duplicates."""
+    rng = random.Random(f"gyms:{seed}")
+    templates, weights = _weighted(INDOOR_NAMES)
+    metro_weights = [m[3] for m in METROS]
+    named_courts = [c for c in courts if c["name"] != "Basketball Court"]
+    gyms = []
+    for i in range(n):
+        roll = rng.random()
+        if gyms and roll < DUPLICATE_SHARE:
+            orig = rng.choice(gyms)
+            lat, lng = _jitter(rng, orig["lat"], orig["lng"], DUPLICATE_JITTER_M)
+            name, category = orig["name"], orig["category"]
+        elif named_courts and roll < DUPLICATE_SHARE + CROSS_SOURCE_SHARE:
+            court = rng.choice(named_courts)
+            lat, lng = _jitter(rng, court["lat"], court["lng"], 150)
+            name, category = court["name"] + " Gym", "recreation_center"
+        else:
+            lat, lng, city = _point(rng, metro_weights)
+            name = _name(rng, rng.choices(templates, weights=weights)[0], city)
+            category = rng.choice(INDOOR_CATEGORIES)
+        gyms.append({"id": f"gym_{2_000_000 + i}", "name": name, "lat": lat, "lng": lng, "category": category})
+    return gyms
+
+
+def osm_elements(gyms: List[Dict]) -> List[Tuple[Dict, str, str]]:
+    """Overpass-style (element, key, value) triples for the classifiers."""
+    tag_for = {
+        "high_school": ("amenity", "school"), "middle_school": ("amenity", "school"),
+        "school": ("amenity", "school"), "college": ("amenity", "university"),
+        "athletic_club": ("leisure", "sports_centre"), "recreation_center": ("amenity", "community_centre"),
+        "gym": ("building", "gymnasium"), "other": ("leisure", "recreation_ground"),
+    }
+    elements = []
+    for i, gym in enumerate(gyms):
+        key, value = tag_for[gym["category"]]
+        tags = {key: value, "name": gym["name"], "addr:city": "Springfield"}
+        if i % 3:
+            element = {"type": "node", "id": i, "lat": gym["lat"], "lon": gym["lng"], "tags": tags}
+        else:
+            element = {"type": "way", "id": i, "center": {"lat": gym["lat"], "lon": gym["lng"]}, "tags": tags}
+        elements.append((element, key, value))
+    return elements
+
+
+def dataset_paths(n: int, seed: int) -> Dict[str, str]:
+    base = os.path.join(DATA_DIR, f"seed{seed}_{n}")
+    return {
+        "dir": base,
+        "courts_json": os.path.join(base, "courts_named.json"),
+        "courts_dart": os.path.join(base, "mock_courts_data.dart"),
+        "gyms_dart": os.path.join(base, "indoor_gyms_data.dart"),
+        "gyms_json": os.path.join(base, "indoor_gyms_data.json"),
+        "out": os.path.join(base, "out"),
+    }
+
+
+def prepare_dataset(n: int, seed: int) -> Dict[str, str]:
+    """Generate (or reuse) the dataset files for size `n`."""
+    from dart_emitter import write_dart_list
+
+    paths = dataset_paths(n, seed)
+    if os.path.exists(paths["gyms_json"]):
+        return paths
+    os.makedirs(paths["out"], exist_ok=True)
+    start = time.time()
+    courts = generate_courts(n, seed)
+    gyms = generate_gyms(max(n // 4, 1), seed, courts)
+
+    with JsonArrayWriter(paths["courts_json"]) as writer:
+        writer.write_all(courts)
+    write_dart_list(paths["courts_dart"],
+                    ["final List<Map<String, dynamic>> mockCourtsData = ["], courts,
+                    fields=("id", "name", "lat", "lng"))
+    write_dart_list(paths["gyms_dart"],
+                    ["final List<Map<String, dynamic>> indoorGymsData = ["], gyms,
+                    fields=("id", "name", "lat", "lng", "category"), constants={"indoor": True})
+    # Written last: its presence marks the dataset complete
+    with JsonArrayWriter(paths["gyms_json"]) as writer:
+        writer.write_all(gyms)
+    print(f"  generated {n:,} courts + {len(gyms):,} gyms in {time.time() - start:.1f}s -> {paths['dir']}")
+    return paths
+
+
+def load_courts(paths: Dict) -> List[Dict]:
+    return list(iter_json_array(paths["courts_json"]))
+
+
+def load_gyms(paths: Dict) -> List[Dict]:
+    return list(iter_json_array(paths["gyms_json"]))
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks. Each entry is (setup, run): setup(paths) loads what the run
+# needs outside the timed region; run(data, paths) returns records processed.
+# ---------------------------------------------------------------------------
+
+def _bench_parse_json_stream():
+    return None, lambda _, p: sum(1 for _ in iter_json_array(p["courts_json"]))
+
+
+def _bench_parse_json_load():
+    def run(_, p):
+        with open(p["courts_json"], "r") as f:
+            return len(json.load(f))
+    return None, run
+
+
+def _bench_parse_dart_indoor():
+    from deduplicate_indoor_gyms import parse_dart_file
+    return None, lambda _, p: len(parse_dart_file(p["gyms_dart"]))
+
+
+def _bench_parse_dart_filter():
+    from filter_false_positives import parse_indoor_gyms
+    return None, lambda _, p: len(parse_indoor_gyms(p["gyms_dart"]))
+
+
+def _bench_parse_dart_courts():
+    from name_courts import parse_dart_courts
+
+    def setup(p):
+        with open(p["courts_dart"], "r") as f:
+            return f.read()
+    return setup, lambda content, _: len(parse_dart_courts(content))
+
+
+def _bench_classify_false_positives():
+    from filter_false_positives import is_false_positive
+
+    def run(gyms, _):
+        for g in gyms:
+            is_false_positive(g["name"], g["category"])
+        return len(gyms)
+    return load_gyms, run
+
+
+def _bench_classify_osm_venues():
+    from fetch_indoor_gyms import process_element
+
+    def run(elements, _):
+        for element, key, value in elements:
+            process_element(element, key, value)
+        return len(elements)
+    return lambda p: osm_elements(load_gyms(p)), run
+
+
+def _bench_classify_signature():
+    from hooprank_osm_signature_builder import classify_element
+
+    def run(elements, _):
+        for element, _key, _value in elements:
+            classify_element(element["tags"])
+        return len(elements)
+    return lambda p: osm_elements(load_gyms(p)), run
+
+
+def _bench_dedupe_courts():
+    from deduplicate_courts import iter_duplicates
+
+    def run(_, p):
+        return sum(1 for _ in iter_duplicates(iter_json_array(p["courts_json"])))
+    return None, run
+
+
+def _bench_dedupe_indoor():
+    from deduplicate_indoor_gyms import find_duplicates
+
+    def run(gyms, _):
+        find_duplicates(gyms)
+        return len(gyms)
+    return load_gyms, run
+
+
+def _bench_dedupe_cross_source():
+    from cross_source_dedupe import find_cross_source_duplicates
+
+    def run(data, _):
+        gyms, courts = data
+        find_cross_source_duplicates(gyms, courts)
+        return len(gyms) + len(courts)
+    return lambda p: (load_gyms(p), load_courts(p)), run
+
+
+def _bench_dedupe_comprehensive():
+    from comprehensive_dedupe import iter_outdoor_courts, stream_dedupe
+
+    def run(gyms, p):
+        return sum(1 for _ in stream_dedupe(iter_outdoor_courts(p["courts_json"]), gyms))
+    return load_gyms, run
+
+
+def _bench_name_courts():
+    import name_courts
+    name_courts.RATE_LIMIT_SECONDS = 0
+    name_courts.reverse_geocode = synthetic_reverse_geocode
+
+    def run(courts, _):
+        name_courts.coord_cache.clear()
+        generic = [c for c in courts if c["name"] == "Basketball Court"]
+        for c in generic:
+            name_courts.generate_court_name(c["lat"], c["lng"])
+        return len(generic)
+    return load_courts, run
+
+
+def _bench_name_courts_resumable():
+    import name_courts_resumable
+    name_courts_resumable.RATE_LIMIT_SECONDS = 0
+    name_courts_resumable.reverse_geocode = synthetic_reverse_geocode
+
+    def run(courts, _):
+        cache = {}
+        generic = [c for c in courts if c["name"] == "Basketball Court"]
+        for c in generic:
+            name_courts_resumable.generate_court_name(c["lat"], c["lng"], cache)
+        return len(generic)
+    return load_courts, run
+
+
+def _bench_emit_dart_courts():
+    from fetch_osm_courts import generate_dart_file
+
+    def run(courts, p):
+        generate_dart_file(courts, os.path.join(p["out"], "courts.dart"))
+        return len(courts)
+    return load_courts, run
+
+
+def _bench_emit_dart_gyms():
+    from deduplicate_indoor_gyms import generate_dart_file
+
+    def run(gyms, p):
+        generate_dart_file(gyms, os.path.join(p["out"], "gyms.dart"))
+        return len(gyms)
+    return load_gyms, run
+
+
+def _bench_emit_json_stream():
+    def run(courts, p):
+        with JsonArrayWriter(os.path.join(p["out"], "courts.json")) as writer:
+            writer.write_all(courts)
+        return len(courts)
+    return load_courts, run
+
+
+def _bench_emit_json_dump():
+    def run(courts, p):
+        with open(os.path.join(p["out"], "courts_dump.json"), "w") as f:
+            json.dump(courts, f)
+        return len(courts)
+    return load_courts, run
+
+
+BENCHMARKS: Dict[str, Callable] = {
+    "parse_json_stream": _bench_parse_json_stream,
+    "parse_json_load": _bench_parse_json_load,
+    "parse_dart_indoor": _bench_parse_dart_indoor,
+    "parse_dart_filter": _bench_parse_dart_filter,
+    "parse_dart_courts": _bench_parse_dart_courts,
+    "classify_false_positives": _bench_classify_false_positives,
+    "classify_osm_venues": _bench_classify_osm_venues,
+    "classify_signature": _bench_classify_signature,
+    "dedupe_courts": _bench_dedupe_courts,
+    "dedupe_indoor": _bench_dedupe_indoor,
+    "dedupe_cross_source": _bench_dedupe_cross_source,
+    "dedupe_comprehensive": _bench_dedupe_comprehensive,
+    "name_courts": _bench_name_courts,
+    "name_courts_resumable": _bench_name_courts_resumable,
+    "emit_dart_courts": _bench_emit_dart_courts,
+    "emit_dart_gyms": _bench_emit_dart_gyms,
+    "emit_json_stream": _bench_emit_json_stream,
+    "emit_json_dump": _bench_emit_json_dump,
+}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def _child(name: str, paths: Dict, repeat: int, queue):
+    """Run one benchmark in a fresh process and report its timings."""
+    try:
+        with open(os.devnull, "w") as devnull:
+            stdout = sys.stdout
+            sys.stdout = devnull  # the scripts print progress
+            try:
+                setup, run = BENCHMARKS[name]()
+                data = setup(paths) if setup else None
+                times, cpu_times = [], []
+                for _ in range(repeat):
+                    start, cpu_start = time.perf_counter(), time.process_time()
+                    records = run(data, paths)
+                    times.append(time.perf_counter() - start)
+                    cpu_times.append(time.process_time() - cpu_start)
+            finally:
+                sys.stdout = stdout
+        queue.put({"status": "ok", "seconds": min(times), "cpu_seconds": min(cpu_times),
+                   "runs": [round(t, 4) for t in times], "records": records, "peak_rss_mb": _peak_rss_mb()})
+    except ImportError as e:
+        queue.put({"status": "skipped", "error": f"missing dependency: {e.name}"})
+    except Exception as e:
+        queue.put({"status": "error", "error": f"{type(e).__name__}: {e}"})
+
+
+def run_benchmark(name: str, paths: Dict, repeat: int, timeout: float) -> Dict:
+    ctx = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(name, paths, repeat, queue))
+    proc.start()
+    proc.join(timeout)
+    if proc.is_alive():
+        proc.terminate()
+        proc.join()
+        return {"status": "timeout", "seconds": timeout}
+    if queue.empty():
+        return {"status": "error", "error": f"benchmark process exited with code {proc.exitcode}"}
+    return queue.get()
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def load_results(path: str = RESULTS_FILE) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(path: str = RESULTS_FILE, threshold: float = 1.25):
+    """Print the last two runs side by side, flagging slowdowns past `threshold`."""
+    results = load_results(path)
+    run_ids = list(dict.fromkeys(r["run_id"] for r in results))
+    if len(run_ids) < 2:
+        print("Need at least two recorded runs to compare")
+        return
+    prev_id, last_id = run_ids[-2], run_ids[-1]
+    prev = {(r["bench"], r["size"]): r for r in results if r["run_id"] == prev_id}
+    last = [r for r in results if r["run_id"] == last_id]
+    print(f"Comparing {prev_id} -> {last_id}\n")
+    print(f"  {'benchmark':<26} {'size':>9} {'before':>9} {'after':>9} {'ratio':>7}")
+    for r in last:
+        p = prev.get((r["bench"], r["size"]))
+        if not p or p["status"] != "ok" or r["status"] != "ok":
+            continue
+        ratio = r["seconds"] / p["seconds"] if p["seconds"] else float("inf")
+        flag = "  <-- slower" if ratio > threshold else ""
+        print(f"  {r['bench']:<26} {r['size']:>9,} {p['seconds']:>8.3f}s {r['seconds']:>8.3f}s {ratio:>6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the court pipeline on synthetic datasets")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Record counts (default: 10000 100000)")
+    parser.add_argument("--seed", type=int, default=42, help="Generator seed (default: 42)")
+    parser.add_argument("--only", nargs="+", default=[], help="Run benchmarks whose name starts with any of these")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per benchmark; the fastest is recorded")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-benchmark timeout in seconds (default: 600)")
+    parser.add_argument("--output", default=RESULTS_FILE, help="JSON lines file results are appended to")
+    parser.add_argument("--compare", action="store_true", help="Compare the last two recorded runs and exit")
+    parser.add_argument("--list", action="store_true", help="List benchmark names and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return
+    if args.compare:
+        compare(args.output)
+        return
+
+    names = [n for n in BENCHMARKS if not args.only or any(n.startswith(o) for o in args.only)]
+    run_id = time.strftime("%Y%m%dT%H%M%S")
+    meta = {
+        "run_id": run_id,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    print(f"Benchmark run {run_id} ({meta['commit'] or 'no git'}, Python {meta['python']})")
+
+    for size in args.sizes:
+        print(f"\n{size:,} records")
+        paths = prepare_dataset(size, args.seed)
+        for name in names:
+            result = run_benchmark(name, paths, args.repeat, args.timeout)
+            row = dict(meta, bench=name, size=size, **result)
+            if result["status"] == "ok" and result["seconds"] > 0:
+                row["records_per_s"] = round(result["records"] / result["seconds"])
+            with open(args.output, "a") as f:
+                f.write(json.dumps(row) + "\n")
+
+            if result["status"] == "ok":
+                print(f"  {name:<26} {result['seconds']:>9.3f}s  {row.get('records_per_s', 0):>12,}/s  "
+                      f"{result['peak_rss_mb']:>8.1f} MB")
+            else:
+                print(f"  {name:<26} {result['status']}: {result.get('error', '')}")
+
+    print(f"\nResults appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
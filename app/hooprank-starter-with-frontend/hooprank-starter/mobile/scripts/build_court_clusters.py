@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Precompute the map's marker clusters for every zoom level.
+
+With 100k+ courts, clustering on the device on every pan is the slowest
+thing the map does. This stage runs the same greedy algorithm as
+supercluster once, over the final courts_named.json, and writes the whole
+hierarchy to a compact file the app ships as an asset:
+
+  - zoom MAX_ZOOM + 1 is the courts themselves; each zoom z from MAX_ZOOM
+    down to 0 merges every cluster of zoom z + 1 with the unmerged
+    clusters within RADIUS pixels of it (at a EXTENT-pixel tile size),
+    into one cluster at their count-weighted Web Mercator centroid
+  - seeds are taken in spatial_order (Hilbert curve, then id), so the
+    result doesn't depend on the order of the input file
+
+Clusters are then numbered top-down: zoom 0 in seed order, and each
+cluster's children are consecutive at the next zoom. A cluster is therefore
+a range at every level below it, down to a range of courts, and rendering
+a zoom is a range lookup:
+
+  - the clusters of zoom z are records [offset(z), offset(z) + count(z))
+  - the children of record i are [first_child(i), first_child(i + 1)) at
+    zoom z + 1; at MAX_ZOOM they index the leaf table instead
+  - a cluster's courts are within (max_dlat(z), max_dlng(z)) of its
+    centroid, so a viewport query can descend from zoom 0 and skip every
+    cluster whose box misses the viewport
+
+Layout (little endian):
+    header                  HEADER
+    zoom table              ZOOM x (MAX_ZOOM + 1)
+    cluster records         CLUSTER x clusters, zoom 0 first
+    leaf table              uint32 x courts, index into the courts file
+
+A record with count 1 is a single court; its first_child leads to it.
+
+Usage:
+    python build_court_clusters.py
+    python build_court_clusters.py --input courts_named.json --output court_clusters.bin
+    python build_court_clusters.py --summary
+"""
+
+import argparse
+import math
+import os
+import struct
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from json_stream import iter_json_array
+from pipeline_metrics import instrument, phase, record_counts
+from spatial_order import spatial_key
+from staged_output import StagedOutputs, replace_if_changed
+
+INPUT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "assets", "data", "courts_named.json")
+OUTPUT_FILE = os.path.join(os.path.dirname(INPUT_FILE), "court_clusters.bin")
+
+MAGIC = b"HRCL"
+VERSION = 1
+
+# supercluster's defaults
+MAX_ZOOM = 16
+RADIUS = 40
+EXTENT = 512
+
+# Centroids are stored like the columnar Dart files' coordinates
+COORD_SCALE = 10_000_000
+
+# magic, version, zoom count, cluster count, leaf count, radius, extent
+HEADER = struct.Struct("<4sIIIIII")
+
+# first record, record count, max |lat - court lat|, max |lng - court lng|
+ZOOM = struct.Struct("<IIdd")
+
+# lat, lng (1e-7 degrees), courts in the cluster, first child
+CLUSTER = struct.Struct("<iiII")
+
+
+def mercator(lat: float, lng: float) -> Tuple[float, float]:
+    """Web Mercator x, y in [0, 1] (y down), as map tiles use."""
+    sin = math.sin(math.radians(lat))
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi if abs(sin) < 1 else (0.0 if sin > 0 else 1.0)
+    return lng / 360 + 0.5, min(max(y, 0.0), 1.0)
+
+
+def unmercator(x: float, y: float) -> Tuple[float, float]:
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return lat, (x - 0.5) * 360
+
+
+class Level:
+    """Clusters of one zoom in creation order; parent maps the level below into it."""
+
+    def __init__(self):
+        self.xs = array("d")
+        self.ys = array("d")
+        self.counts = array("I")
+        self.parent: Optional[array] = None
+
+
+def cluster_level(below: Level, zoom: int) -> Level:
+    """Greedily merge the clusters of zoom + 1 into the clusters of `zoom`."""
+    radius = RADIUS / (EXTENT * 2 ** zoom)
+    r2 = radius * radius
+    xs, ys, counts = below.xs, below.ys, below.counts
+    n = len(xs)
+
+    # Grid of radius-sized cells, keyed by (column << 32) | row
+    columns = [int(x / radius) for x in xs]
+    rows = [int(y / radius) for y in ys]
+    grid: Dict[int, List[int]] = {}
+    for i in range(n):
+        grid.setdefault((columns[i] << 32) | rows[i], []).append(i)
+
+    level = Level()
+    parent = array("i", [-1]) * n
+    for i in range(n):
+        if parent[i] != -1:
+            continue
+        k = len(level.counts)
+        parent[i] = k
+        x, y = xs[i], ys[i]
+        members = None
+        column, row = columns[i], rows[i]
+        for cell_column in (column - 1, column, column + 1):
+            for cell_row in (row - 1, row, row + 1):
+                cell = grid.get((cell_column << 32) | cell_row)
+                if cell is None:
+                    continue
+                for j in cell:
+                    if parent[j] == -1:
+                        dx, dy = xs[j] - x, ys[j] - y
+                        if dx * dx + dy * dy <= r2:
+                            parent[j] = k
+                            if members is None:
+                                members = [i]
+                            members.append(j)
+        if members is None:
+            level.xs.append(x)
+            level.ys.append(y)
+            level.counts.append(counts[i])
+            continue
+        total = sum(counts[j] for j in members)
+        level.xs.append(sum(xs[j] * counts[j] for j in members) / total)
+        level.ys.append(sum(ys[j] * counts[j] for j in members) / total)
+        level.counts.append(total)
+    level.parent = parent
+    return level
+
+
+def load_points(path: str) -> Tuple[Level, array]:
+    """Courts with coordinates as the leaf level, in spatial_order, and their file indices."""
+    keyed = []
+    for index, court in enumerate(iter_json_array(path)):
+        lat, lng = court.get("lat"), court.get("lng")
+        if lat is None or lng is None:
+            continue
+        keyed.append((spatial_key(court), index, lat, lng))
+    keyed.sort()
+    leaves = Level()
+    indices = array("I")
+    for _, index, lat, lng in keyed:
+        x, y = mercator(lat, lng)
+        leaves.xs.append(x)
+        leaves.ys.append(y)
+        leaves.counts.append(1)
+        indices.append(index)
+    return leaves, indices
+
+
+def build_levels(leaves: Level) -> List[Level]:
+    """levels[z] for z in 0..MAX_ZOOM + 1, the last being the courts."""
+    levels = [leaves]
+    for zoom in range(MAX_ZOOM, -1, -1):
+        levels.append(cluster_level(levels[-1], zoom))
+        print(f"  zoom {zoom:2}: {len(levels[-1].counts):,} clusters")
+    levels.reverse()
+    return levels
+
+
+def number_top_down(levels: List[Level]) -> List[array]:
+    """
+    order[z]: creation indices of zoom z's clusters in file order, where
+    zoom 0 keeps creation order and the children of each cluster follow
+    their parent's position.
+    """
+    order = [array("I", range(len(levels[0].counts)))]
+    for zoom in range(1, len(levels)):
+        rank = array("I", bytes(4 * len(order[-1])))
+        for position, k in enumerate(order[-1]):
+            rank[k] = position
+        parent = levels[zoom - 1].parent
+        order.append(array("I", sorted(range(len(parent)), key=lambda j: (rank[parent[j]], j))))
+    return order
+
+
+def write_tree(path: str, levels: List[Level], order: List[array], leaf_index: array):
+    zooms = MAX_ZOOM + 1
+    records = bytearray()
+    zoom_table = []
+    # Box around each cluster's centroid holding its courts, built bottom-up
+    below_lat, below_lng = array("d", bytes(8 * len(leaf_index))), array("d", bytes(8 * len(leaf_index)))
+    boxes = [None] * zooms
+    for zoom in range(zooms - 1, -1, -1):
+        level, child = levels[zoom], levels[zoom + 1]
+        lat_lng = [unmercator(x, y) for x, y in zip(level.xs, level.ys)]
+        child_lat_lng = [unmercator(x, y) for x, y in zip(child.xs, child.ys)]
+        dlat, dlng = array("d", bytes(8 * len(lat_lng))), array("d", bytes(8 * len(lat_lng)))
+        for j, k in enumerate(level.parent):
+            (lat, lng), (child_lat, child_lng) = lat_lng[k], child_lat_lng[j]
+            dlat[k] = max(dlat[k], abs(child_lat - lat) + below_lat[j])
+            dlng[k] = max(dlng[k], abs(child_lng - lng) + below_lng[j])
+        boxes[zoom] = (lat_lng, dlat, dlng)
+        below_lat, below_lng = dlat, dlng
+
+    for zoom in range(zooms):
+        lat_lng, dlat, dlng = boxes[zoom]
+        counts = levels[zoom].counts
+        # Children per cluster, to turn child ranges into first-child offsets
+        children = array("I", bytes(4 * len(counts)))
+        for k in levels[zoom].parent:
+            children[k] += 1
+        zoom_table.append(ZOOM.pack(len(records) // CLUSTER.size, len(counts),
+                                    max(dlat, default=0.0), max(dlng, default=0.0)))
+        first_child = 0
+        for k in order[zoom]:
+            lat, lng = lat_lng[k]
+            records += CLUSTER.pack(round(lat * COORD_SCALE), round(lng * COORD_SCALE), counts[k], first_child)
+            first_child += children[k]
+
+    leaves = array("I", (leaf_index[j] for j in order[zooms]))
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, zooms, len(records) // CLUSTER.size, len(leaves), RADIUS, EXTENT))
+        f.write(b"".join(zoom_table))
+        f.write(records)
+        f.write(struct.pack(f"<{len(leaves)}I", *leaves))
+    replace_if_changed(tmp_path, path)
+
+
+class ClusterTree:
+    """Reader for a build_court_clusters file, mirroring what the app does with it."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        magic, version, zooms, self.cluster_count, self.leaf_count, _, _ = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} court cluster file")
+        self.zooms = [ZOOM.unpack_from(self.data, HEADER.size + z * ZOOM.size) for z in range(zooms)]
+        self.records_at = HEADER.size + zooms * ZOOM.size
+        self.leaves_at = self.records_at + self.cluster_count * CLUSTER.size
+
+    def record(self, index: int) -> Tuple[float, float, int, int]:
+        lat, lng, count, first_child = CLUSTER.unpack_from(self.data, self.records_at + index * CLUSTER.size)
+        return lat / COORD_SCALE, lng / COORD_SCALE, count, first_child
+
+    def children(self, zoom: int, position: int) -> range:
+        """Positions at zoom + 1 (leaf positions at MAX_ZOOM) of a cluster's children."""
+        offset, count, _, _ = self.zooms[zoom]
+        start = self.record(offset + position)[3]
+        if position + 1 < count:
+            return range(start, self.record(offset + position + 1)[3])
+        below = self.zooms[zoom + 1][1] if zoom + 1 < len(self.zooms) else self.leaf_count
+        return range(start, below)
+
+    def leaf(self, position: int) -> int:
+        return struct.unpack_from("<I", self.data, self.leaves_at + 4 * position)[0]
+
+    def clusters(self, zoom: int, bbox: Tuple[float, float, float, float]) -> Iterator[Tuple[float, float, int, int]]:
+        """(lat, lng, count, position) of zoom's clusters with a centroid in (south, west, north, east)."""
+        south, west, north, east = bbox
+        stack = [(0, p) for p in range(self.zooms[0][1])]
+        while stack:
+            z, position = stack.pop()
+            lat, lng, count, _ = self.record(self.zooms[z][0] + position)
+            _, _, dlat, dlng = self.zooms[z]
+            if z == zoom:
+                if south <= lat <= north and west <= lng <= east:
+                    yield lat, lng, count, position
+                continue
+            if lat + dlat < south or lat - dlat > north or lng + dlng < west or lng - dlng > east:
+                continue
+            stack.extend((z + 1, p) for p in self.children(z, position))
+
+
+def summarize(path: str):
+    tree = ClusterTree(path)
+    print(f"{path}: {tree.leaf_count:,} courts, {tree.cluster_count:,} cluster records, "
+          f"{os.path.getsize(path):,} bytes")
+    for zoom, (_, count, dlat, dlng) in enumerate(tree.zooms):
+        print(f"  zoom {zoom:2}: {count:,} clusters, within {dlat:.4f} x {dlng:.4f} degrees")
+
+
+@instrument("build_court_clusters")
+def main():
+    parser = argparse.ArgumentParser(description="Precompute map marker clusters for zooms 0-16")
+    parser.add_argument("--input", default=INPUT_FILE, help="Final courts JSON (courts_named.json)")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="Cluster tree file to write")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the input is unchanged since the last run")
+    parser.add_argument("--summary", action="store_true", help="Print the per-zoom counts of --output and exit")
+    args = parser.parse_args()
+
+    if args.summary:
+        summarize(args.output)
+        return
+
+    params = {"max_zoom": MAX_ZOOM, "radius": RADIUS, "extent": EXTENT}
+    stage = StagedOutputs("build_court_clusters", inputs=[args.input], params=params)
+    if not args.force and stage.up_to_date([args.output]):
+        print(f"{args.input} is unchanged since the last cluster build, nothing to do (use --force to rerun)")
+        return
+
+    print(f"Loading courts from {args.input}...")
+    with phase("load"):
+        leaves, leaf_index = load_points(args.input)
+    print(f"  {len(leaf_index):,} courts with coordinates")
+
+    print("Clustering...")
+    with phase("cluster"):
+        levels = build_levels(leaves)
+        order = number_top_down(levels)
+
+    with phase("write"), stage:
+        write_tree(stage.path(args.output), levels, order, leaf_index)
+    record_counts(records_in=len(leaf_index), records_out=sum(len(level.counts) for level in levels[:-1]))
+    summarize(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,38 @@ Comprehensive court deduplication:
 3. Priority: Indoor gyms > Outdoor courts
 """
 
+import argparse
 import json
+import os
 import re
 import math
+import time
+from array import array
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from dart_emitter import DART_STRING, GYM_FIELDS, dart_unescape, read_dart_columns
+from dedupe_index import DedupeIndex, write_snapshot
+from dedupe_report import DedupeReport, default_report_path
+from geo_shards import SharedFloats, geohash, halo_cells, plan_tasks
+from json_stream import JsonArrayWriter, append_json_array, iter_json_array, json_array_end, link_or_copy
+from pipeline_metrics import instrument, phase, record_counts
+from staged_output import STATE_DIR, StagedOutputs, write_json_atomic
+
+OUTDOOR_COURTS_FILE = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/assets/data/courts_named.json'
+COURTS_FILE = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/assets/data/courts.json'
+INDOOR_GYMS_FILE = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/indoor_gyms_data.dart'
+
+# Geohash length of a --workers shard (~4.9 km cells); at 4 (~39 km) one
+# metro can hold 8% of all courts and caps the speedup
+SHARD_PRECISION = 5
+
+# Shard batches per worker, so one dense metro doesn't leave the rest idle
+TASKS_PER_WORKER = 8
+
+# Index snapshot for --add, and the rollback point of an --add in progress
+INDEX_FILE = os.path.join(STATE_DIR, 'dedupe_index.bin')
+PENDING_ADD_FILE = os.path.join(STATE_DIR, 'dedupe_index_add.json')
 
 def haversine_distance(lat1, lng1, lat2, lng2):
     """Calculate distance between two points in meters."""
@@ -44,29 +72,40 @@ def get_name_tokens(name):
     tokens = set(name.split()) - stopwords
     return tokens
 
-def names_are_similar(name1, name2, threshold=0.6):
-    """Check if two names are similar using token overlap."""
+def name_similarity(name1, name2):
+    """Jaccard similarity of the significant name tokens (0.0 - 1.0)."""
     tokens1 = get_name_tokens(name1)
     tokens2 = get_name_tokens(name2)
     
     if not tokens1 or not tokens2:
-        return False
+        return 0.0
     
     intersection = tokens1 & tokens2
     union = tokens1 | tokens2
     
     if not union:
-        return False
+        return 0.0
     
-    return len(intersection) / len(union) >= threshold
+    return len(intersection) / len(union)
+
+def names_are_similar(name1, name2, threshold=0.6):
+    """Check if two names are similar using token overlap."""
+    return name_similarity(name1, name2) >= threshold
 
 def load_outdoor_courts(filepath):
     """Load outdoor courts from JSON file."""
     with open(filepath, 'r') as f:
         return json.load(f)
 
+def iter_outdoor_courts(filepath):
+    """Stream outdoor courts from JSON file one at a time."""
+    return iter_json_array(filepath)
+
 def parse_indoor_gyms(filepath):
     """Parse the Dart file to extract gym entries."""
+    gyms = read_dart_columns(filepath, GYM_FIELDS)
+    if gyms is not None:
+        return gyms
     with open(filepath, 'r') as f:
         content = f.read()
     
@@ -74,7 +113,7 @@ def parse_indoor_gyms(filepath):
     entry_pattern = re.compile(
         r"\{\s*\n"
         r"\s*'id':\s*'([^']+)',\s*\n"
-        r"\s*'name':\s*'([^']*)',\s*\n"
+        r"\s*'name':\s*" + DART_STRING + r",\s*\n"
         r"\s*'lat':\s*([\d.-]+),\s*\n"
         r"\s*'lng':\s*([\d.-]+),\s*\n"
         r"\s*'category':\s*'([^']+)',\s*\n"
@@ -86,17 +125,18 @@ def parse_indoor_gyms(filepath):
     for match in entry_pattern.finditer(content):
         gyms.append({
             'id': match.group(1),
-            'name': match.group(2),
+            'name': dart_unescape(match.group(2)),
             'lat': float(match.group(3)),
             'lng': float(match.group(4)),
             'category': match.group(5),
         })
     return gyms
 
-def dedupe_outdoor_courts(courts, distance_threshold=500):
+def dedupe_outdoor_courts(courts, distance_threshold=500, decisions=None):
     """
     Dedupe outdoor courts with EXACT same name within distance_threshold.
     This catches multiple court surfaces at the same school.
+    If `decisions` is a list, (removed_idx, kept_idx, distance) is appended for each removal.
     """
     # Group by exact name
     name_groups = defaultdict(list)
@@ -123,15 +163,13 @@ def dedupe_outdoor_courts(courts, distance_threshold=500):
                 
                 if dist < distance_threshold:
                     indices_to_remove.add(idx)
+                    if decisions is not None:
+                        decisions.append((idx, kept_idx, dist))
     
     return indices_to_remove
 
-def remove_outdoor_if_indoor_exists(outdoor_courts, indoor_gyms, distance_threshold=300):
-    """
-    Remove outdoor courts where an indoor gym exists for the same location.
-    Uses fuzzy name matching.
-    """
-    # Build spatial index for indoor gyms
+def build_indoor_buckets(indoor_gyms):
+    """Spatial index for indoor gyms (0.01 degree buckets, each gym in its 3x3 neighbourhood)."""
     indoor_buckets = defaultdict(list)
     for gym in indoor_gyms:
         bucket_lat = int(gym['lat'] * 100)
@@ -139,108 +177,447 @@ def remove_outdoor_if_indoor_exists(outdoor_courts, indoor_gyms, distance_thresh
         for dlat in [-1, 0, 1]:
             for dlng in [-1, 0, 1]:
                 indoor_buckets[(bucket_lat + dlat, bucket_lng + dlng)].append(gym)
+    return indoor_buckets
+
+def find_indoor_match(court, indoor_buckets, distance_threshold=300):
+    """Return (gym, distance) for the first nearby indoor gym with a similar name, or None."""
+    bucket_lat = int(court['lat'] * 100)
+    bucket_lng = int(court['lng'] * 100)
+    
+    for gym in indoor_buckets.get((bucket_lat, bucket_lng), []):
+        dist = haversine_distance(court['lat'], court['lng'], gym['lat'], gym['lng'])
+        if dist < distance_threshold:
+            # Check name similarity
+            if names_are_similar(court['name'], gym['name'], threshold=0.5):
+                return gym, dist
+    return None
+
+def remove_outdoor_if_indoor_exists(outdoor_courts, indoor_gyms, distance_threshold=300, decisions=None):
+    """
+    Remove outdoor courts where an indoor gym exists for the same location.
+    Uses fuzzy name matching.
+    If `decisions` is a list, (removed_idx, gym, distance, similarity) is appended for each removal.
+    """
+    indoor_buckets = build_indoor_buckets(indoor_gyms)
     
     indices_to_remove = set()
     removed_examples = []
     
     for idx, court in enumerate(outdoor_courts):
-        if idx in indices_to_remove:
-            continue
+        match = find_indoor_match(court, indoor_buckets, distance_threshold)
+        if match:
+            gym, dist = match
+            indices_to_remove.add(idx)
+            if decisions is not None:
+                decisions.append((idx, gym, dist, name_similarity(court['name'], gym['name'])))
+            if len(removed_examples) < 20:
+                removed_examples.append({
+                    'outdoor': court['name'],
+                    'indoor': gym['name'],
+                    'distance': dist
+                })
+    
+    return indices_to_remove, removed_examples
+
+def stream_dedupe(courts, indoor_gyms, same_name_threshold=500, indoor_threshold=300):
+    """
+    Apply both rules in a single pass over `courts` (any iterable, e.g. streamed
+    from disk), with the same results as dedupe_outdoor_courts and
+    remove_outdoor_if_indoor_exists.
+    
+    Yields (idx, court, same_name, indoor) where same_name is (kept, distance)
+    and indoor is (gym, distance), or None when that rule keeps the court.
+    Only the first court of each name is remembered, as a small dict.
+    """
+    indoor_buckets = build_indoor_buckets(indoor_gyms)
+    first_by_name = {}
+    
+    for idx, court in enumerate(courts):
+        same_name = None
+        name = court.get('name', '')
+        if name:
+            kept = first_by_name.get(name)
+            if kept is None:
+                first_by_name[name] = {'id': court.get('id'), 'lat': court['lat'], 'lng': court['lng']}
+            else:
+                dist = haversine_distance(kept['lat'], kept['lng'], court['lat'], court['lng'])
+                if dist < same_name_threshold:
+                    same_name = (kept, dist)
         
-        bucket_lat = int(court['lat'] * 100)
-        bucket_lng = int(court['lng'] * 100)
+        yield idx, court, same_name, find_indoor_match(court, indoor_buckets, indoor_threshold)
+
+def _dedupe_shard(task):
+    """
+    Worker for partitioned_dedupe: both rules for one batch of shards.
+    Returns (idx, same_name, indoor) for every court a rule removes, with
+    same_name as (first idx, distance) and indoor as (gym idx, distance).
+    """
+    coords_name, size, courts, gyms, same_name_threshold, indoor_threshold = task
+    coords = SharedFloats.attach(coords_name, size)
+    try:
+        xy = coords.values
+        indoor_buckets = build_indoor_buckets(gyms)
+        removed = []
+        for idx, name, first in courts:
+            lat, lng = xy[2 * idx], xy[2 * idx + 1]
+            same_name = None
+            if first >= 0:
+                dist = haversine_distance(xy[2 * first], xy[2 * first + 1], lat, lng)
+                if dist < same_name_threshold:
+                    same_name = (first, dist)
+            indoor = find_indoor_match({'lat': lat, 'lng': lng, 'name': name}, indoor_buckets, indoor_threshold)
+            if indoor:
+                indoor = (indoor[0]['idx'], indoor[1])
+            if same_name or indoor:
+                removed.append((idx, same_name, indoor))
+        return removed
+    finally:
+        coords.close()
+
+def partitioned_dedupe(path, indoor_gyms, same_name_threshold=500, indoor_threshold=300,
+                       workers=None, precision=SHARD_PRECISION):
+    """
+    stream_dedupe over the courts in `path`, with the rules run in parallel
+    on geohash shards. Yields exactly what stream_dedupe yields.
+    
+    First pass (here): court coordinates go into shared memory, courts are
+    sharded by geohash, and the first court of every name is resolved
+    globally, so a same-name pair split across shards is still compared
+    against the right court. Each shard gets the gyms within the largest
+    threshold of its cell (the halo), in file order, so the first matching
+    gym is the same one the single-process run finds.
+    
+    Workers then apply both rules per shard batch, and a second pass over
+    the file merges their removals back in input order.
+    """
+    workers = workers or os.cpu_count() or 1
+    halo_m = max(same_name_threshold, indoor_threshold)
+    
+    xy = array('d')
+    shards = defaultdict(list)
+    first_by_name = {}
+    for idx, court in enumerate(iter_outdoor_courts(path)):
+        lat, lng = court['lat'], court['lng']
+        xy.append(lat)
+        xy.append(lng)
+        name = court.get('name', '')
+        first = -1
+        if name:
+            first = first_by_name.setdefault(name, idx)
+            if first == idx:
+                first = -1
+        shards[geohash(lat, lng, precision)].append((idx, court['name'], first))
+    first_by_name = None
+    
+    shard_gyms = defaultdict(list)
+    for gym_idx, gym in enumerate(indoor_gyms):
+        for cell in halo_cells(gym['lat'], gym['lng'], halo_m, precision):
+            if cell in shards:
+                shard_gyms[cell].append(gym_idx)
+    
+    coords = SharedFloats.create(xy)
+    del xy
+    removed = {}
+    try:
+        tasks = []
+        for keys in plan_tasks(shards, workers * TASKS_PER_WORKER):
+            courts = [court for key in keys for court in shards[key]]
+            gym_ids = sorted({gym_idx for key in keys for gym_idx in shard_gyms.get(key, ())})
+            gyms = [{'idx': i, 'lat': indoor_gyms[i]['lat'], 'lng': indoor_gyms[i]['lng'],
+                     'name': indoor_gyms[i]['name']} for i in gym_ids]
+            tasks.append((coords.name, coords.size, courts, gyms, same_name_threshold, indoor_threshold))
+        shards = shard_gyms = None
+        print(f"  Partitioned into {len(tasks)} shard batches for {workers} workers")
         
-        nearby_indoor = indoor_buckets.get((bucket_lat, bucket_lng), [])
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for batch in pool.map(_dedupe_shard, tasks):
+                for idx, same_name, indoor in batch:
+                    removed[idx] = (same_name, indoor)
+    finally:
+        coords.close()
+    
+    # Merge: replay the file in order with the shard results
+    kept_by_name = {}
+    for idx, court in enumerate(iter_outdoor_courts(path)):
+        name = court.get('name', '')
+        if name and name not in kept_by_name:
+            kept_by_name[name] = {'id': court.get('id'), 'lat': court['lat'], 'lng': court['lng']}
+        same_name, indoor = removed.get(idx, (None, None))
+        if same_name:
+            same_name = (kept_by_name[name], same_name[1])
+        if indoor:
+            indoor = (indoor_gyms[indoor[0]], indoor[1])
+        yield idx, court, same_name, indoor
+
+def index_dedupe(courts, index, same_name_threshold=500, indoor_threshold=300):
+    """
+    stream_dedupe for `courts` appended to the input of the full run that
+    wrote an index snapshot: yields the tuples a full run over that input
+    plus `courts` would yield for them, reading only the snapshot entries
+    for each court's name and buckets.
+    """
+    batch_first = {}
+    for i, court in enumerate(courts):
+        same_name = None
+        name = court.get('name', '')
+        if name:
+            kept = index.first_of_name(name) or batch_first.get(name)
+            if kept is None:
+                batch_first[name] = {'id': court.get('id'), 'lat': court['lat'], 'lng': court['lng']}
+            else:
+                dist = haversine_distance(kept['lat'], kept['lng'], court['lat'], court['lng'])
+                if dist < same_name_threshold:
+                    same_name = (kept, dist)
         
-        for gym in nearby_indoor:
-            dist = haversine_distance(court['lat'], court['lng'], gym['lat'], gym['lng'])
-            if dist < distance_threshold:
-                # Check name similarity
+        indoor = None
+        for gym_idx, lat, lng in index.gyms_near(court['lat'], court['lng']):
+            dist = haversine_distance(court['lat'], court['lng'], lat, lng)
+            if dist < indoor_threshold:
+                gym = index.gym(gym_idx)
                 if names_are_similar(court['name'], gym['name'], threshold=0.5):
-                    indices_to_remove.add(idx)
-                    if len(removed_examples) < 20:
-                        removed_examples.append({
-                            'outdoor': court['name'],
-                            'indoor': gym['name'],
-                            'distance': dist
-                        })
+                    indoor = (gym, dist)
                     break
+        yield index.court_count + i, court, same_name, indoor
+
+def build_index(path, outdoor_file, indoor_file):
+    """
+    Snapshot the indexes from the deduped outdoor file (a full read of both
+    files). A full run indexes the first court of each name in its input;
+    here the first kept one stands in for it.
+    """
+    indoor_gyms = parse_indoor_gyms(indoor_file)
+    names = {}
+    count = 0
+    for court in iter_outdoor_courts(outdoor_file):
+        count += 1
+        name = court.get('name', '')
+        if name and name not in names:
+            names[name] = (court.get('id'), court['lat'], court['lng'])
+    write_snapshot(path, indoor_gyms, names, count, outdoor_file, indoor_file)
+
+def rollback_add():
+    """Undo the append of an --add that died before its index was updated."""
+    try:
+        with open(PENDING_ADD_FILE, 'r') as f:
+            pending = json.load(f)
+    except FileNotFoundError:
+        return
+    with open(pending['path'], 'r+b') as f:
+        f.seek(pending['offset'])
+        f.write(pending['tail'].encode('latin-1'))
+        f.truncate()
+    # Back to the stamp the index had before the add. An index that add_names
+    # had started on has its stamp cleared, so it is rebuilt either way
+    os.utime(pending['path'], ns=(pending['mtime_ns'], pending['mtime_ns']))
+    os.remove(PENDING_ADD_FILE)
+    print(f"Rolled back an interrupted --add on {pending['path']}")
+
+def load_batch(path):
+    """Courts to add: a JSON array, or fetch_city_courts output ({city: [facility, ...]})."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return [court for courts in data.values() for court in courts]
+    return data
+
+def add_courts(args, params):
+    """
+    Dedupe a new batch against the index snapshot and append what is kept
+    to the outdoor file in place, without a national pass. Falls back to
+    rebuilding the snapshot when the files changed since it was written.
+    """
+    start = time.time()
+    index = DedupeIndex.open(args.index)
+    if index is None or not index.matches(args.outdoor, args.indoor):
+        if index is not None:
+            index.close()
+        print(f"Dedupe index {args.index} missing or out of date, rebuilding from {args.outdoor}...")
+        with phase("build_index"):
+            build_index(args.index, args.outdoor, args.indoor)
+        index = DedupeIndex(args.index)
     
-    return indices_to_remove, removed_examples
+    batch = load_batch(args.add)
+    kept = []
+    new_names = {}
+    same_name_count = 0
+    indoor_priority_count = 0
+    report_file = default_report_path()
+    with DedupeReport(report_file, 'comprehensive_dedupe', args.add, args.outdoor, params) as report:
+        for idx, court, same_name, indoor in index_dedupe(batch, index, same_name_threshold=500,
+                                                          indoor_threshold=300):
+            if same_name:
+                same_name_count += 1
+                report.add(court, same_name[0], 'same_name', distance_m=same_name[1], similarity=1.0, position=idx)
+            if indoor:
+                gym, dist = indoor
+                indoor_priority_count += 1
+                report.add(court, gym, 'indoor_priority', distance_m=dist,
+                           similarity=name_similarity(court['name'], gym['name']), position=idx)
+            if not (same_name or indoor):
+                kept.append(court)
+            name = court.get('name', '')
+            if name and name not in new_names and index.first_of_name(name) is None:
+                new_names[name] = (court.get('id'), court['lat'], court['lng'])
+    
+    if kept:
+        # The index is restamped last; until then the rollback point undoes the append
+        offset, tail = json_array_end(args.outdoor)
+        write_json_atomic(PENDING_ADD_FILE, {'path': os.path.abspath(args.outdoor), 'offset': offset,
+                                             'tail': tail.decode('latin-1'),
+                                             'mtime_ns': os.stat(args.outdoor).st_mtime_ns})
+        append_json_array(args.outdoor, kept)
+    index.add_names(new_names, len(batch))
+    if kept:
+        os.remove(PENDING_ADD_FILE)
+        if not (os.path.exists(args.courts) and os.path.samefile(args.outdoor, args.courts)):
+            link_or_copy(args.outdoor, args.courts)
+    index.close()
+    
+    record_counts(records_in=len(batch), records_out=len(kept))
+    print(f"  Batch courts: {len(batch)} from {args.add}")
+    print(f"  Same-name duplicates removed: {same_name_count}")
+    print(f"  Indoor-priority removals: {indoor_priority_count}")
+    print(f"  Appended {len(kept)} courts to {args.outdoor}")
+    print(f"  Decision report: {report_file} (run #{report.run_id})")
+    print(f"  Done in {(time.time() - start) * 1000:.0f} ms")
 
+@instrument("comprehensive_dedupe")
 def main():
-    outdoor_file = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/assets/data/courts_named.json'
-    courts_file = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/assets/data/courts.json'
-    indoor_file = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/indoor_gyms_data.dart'
+    parser = argparse.ArgumentParser(description="Dedupe outdoor courts and drop outdoor courts duplicated by indoor gyms")
+    parser.add_argument("--outdoor", default=OUTDOOR_COURTS_FILE, help="Outdoor courts JSON, deduped in place")
+    parser.add_argument("--input", default='',
+                        help="Outdoor courts JSON to dedupe into --outdoor (default: --outdoor itself)")
+    parser.add_argument("--courts", default=COURTS_FILE, help="Copy of the deduped outdoor courts the app loads")
+    parser.add_argument("--indoor", default=INDOOR_GYMS_FILE, help="Indoor gyms Dart file (read only)")
+    parser.add_argument("--force", action="store_true", help="Rerun even if the inputs are unchanged since the last run")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for geohash-partitioned dedupe (0 = all cores, 1 = single streaming pass)")
+    parser.add_argument("--add", default='',
+                        help="Dedupe this batch of new courts against the index snapshot and append it, "
+                             "instead of a full pass")
+    parser.add_argument("--index", default=INDEX_FILE, help="Index snapshot written by a full run, used by --add")
+    args = parser.parse_args()
+    
+    outdoor_file = args.outdoor
+    input_file = args.input or outdoor_file
+    courts_file = args.courts
+    indoor_file = args.indoor
+    
+    params = {'same_name_m': 500, 'indoor_priority_m': 300, 'similarity': 0.5}
+    
+    rollback_add()
+    if args.add:
+        add_courts(args, params)
+        return
+    
+    # courts_named.json and courts.json are swapped in together at the end
+    stage = StagedOutputs('comprehensive_dedupe', inputs=[input_file, indoor_file], params=params)
+    if not args.force and stage.up_to_date([outdoor_file, courts_file]):
+        print("Outdoor and indoor data unchanged since the last run, nothing to do (use --force to rerun)")
+        return
     
     print("=" * 60)
     print("COMPREHENSIVE COURT DEDUPLICATION")
     print("=" * 60)
     
     print("\nLoading data...")
-    outdoor_courts = load_outdoor_courts(outdoor_file)
-    print(f"  Outdoor courts: {len(outdoor_courts)}")
-    
-    indoor_gyms = parse_indoor_gyms(indoor_file)
+    with phase("parse_indoor"):
+        indoor_gyms = parse_indoor_gyms(indoor_file)
     print(f"  Indoor gyms: {len(indoor_gyms)}")
+    print(f"  Outdoor courts: streamed from {input_file}")
     
-    # Step 1: Dedupe outdoor courts with same name
+    # Steps 1 + 2 run in one streaming pass: each court is checked against
+    # both rules as it is read and written out immediately if kept.
     print("\n" + "-" * 60)
     print("STEP 1: Deduplicating outdoor courts with EXACT same name within 500m")
+    print("STEP 2: Removing outdoor courts where indoor gym exists (within 300m, similar name)")
     print("-" * 60)
     
-    same_name_indices = dedupe_outdoor_courts(outdoor_courts, distance_threshold=500)
-    print(f"  Found {len(same_name_indices)} duplicate outdoor courts to remove")
+    original_count = 0
+    same_name_count = 0
+    indoor_priority_count = 0
+    removed_count = 0
+    examples = []
+    index_names = {}
     
-    # Step 2: Remove outdoor courts where indoor gym exists
-    print("\n" + "-" * 60)
-    print("STEP 2: Removing outdoor courts where indoor gym exists (within 300m, similar name)")
-    print("-" * 60)
+    # Record every removal so the run can be audited or undone
+    report_file = default_report_path()
+    with DedupeReport(report_file, 'comprehensive_dedupe', input_file, outdoor_file, params) as report, stage:
+        if args.workers == 1:
+            decisions = stream_dedupe(iter_outdoor_courts(input_file), indoor_gyms,
+                                      same_name_threshold=500, indoor_threshold=300)
+        else:
+            decisions = partitioned_dedupe(input_file, indoor_gyms, same_name_threshold=500,
+                                           indoor_threshold=300, workers=args.workers or None)
+        with JsonArrayWriter(stage.path(outdoor_file)) as writer:
+            for idx, court, same_name, indoor in decisions:
+                original_count += 1
+                if same_name:
+                    kept, dist = same_name
+                    same_name_count += 1
+                    report.add(court, kept, 'same_name', distance_m=dist, similarity=1.0, position=idx)
+                if indoor:
+                    gym, dist = indoor
+                    indoor_priority_count += 1
+                    report.add(court, gym, 'indoor_priority', distance_m=dist,
+                               similarity=name_similarity(court['name'], gym['name']), position=idx)
+                    if len(examples) < 20:
+                        examples.append({'outdoor': court['name'], 'indoor': gym['name'], 'distance': dist})
+            
+                if same_name or indoor:
+                    removed_count += 1
+                else:
+                    writer.write(court)
+                # The same-name rule's index: first court of each name, kept or not
+                name = court.get('name', '')
+                if name and name not in index_names:
+                    index_names[name] = (court.get('id'), court['lat'], court['lng'])
+        
+        # courts.json is the same dataset; share the bytes instead of re-serializing
+        link_method = link_or_copy(stage.path(outdoor_file), stage.path(courts_file))
     
-    indoor_priority_indices, examples = remove_outdoor_if_indoor_exists(
-        outdoor_courts, indoor_gyms, distance_threshold=300
-    )
-    print(f"  Found {len(indoor_priority_indices)} outdoor courts that duplicate indoor gyms")
+    final_count = original_count - removed_count
+    # Stamped with the committed files, so the next --add can start from it
+    with phase("write_index"):
+        write_snapshot(args.index, indoor_gyms, index_names, original_count, outdoor_file, indoor_file)
+    record_counts(records_in=original_count, records_out=final_count)
+    print(f"  Outdoor courts read: {original_count}")
+    print(f"  Found {same_name_count} duplicate outdoor courts to remove")
+    print(f"  Found {indoor_priority_count} outdoor courts that duplicate indoor gyms")
     
     if examples:
         print("\n  Sample removals:")
         for ex in examples[:10]:
             print(f"    Outdoor: '{ex['outdoor']}' -> Indoor: '{ex['indoor']}' ({ex['distance']:.0f}m)")
     
-    # Combine all indices to remove
-    all_indices_to_remove = same_name_indices | indoor_priority_indices
-    print(f"\n  Total outdoor courts to remove: {len(all_indices_to_remove)}")
-    
-    # Create deduplicated list
-    deduped_outdoor = [court for i, court in enumerate(outdoor_courts) if i not in all_indices_to_remove]
-    print(f"\n  Outdoor courts after deduplication: {len(deduped_outdoor)}")
+    print(f"\n  Total outdoor courts to remove: {removed_count}")
+    print(f"\n  Outdoor courts after deduplication: {final_count}")
+    print(f"  Decision report: {report_file} (run #{report.run_id})")
     
     # Write back to files
     print("\n" + "-" * 60)
     print("STEP 3: Writing deduplicated data")
     print("-" * 60)
     
-    print(f"  Writing to {outdoor_file}...")
-    with open(outdoor_file, 'w') as f:
-        json.dump(deduped_outdoor, f)
-    
-    print(f"  Writing to {courts_file}...")
-    with open(courts_file, 'w') as f:
-        json.dump(deduped_outdoor, f)
+    print(f"  Wrote {outdoor_file}")
+    print(f"  Wrote {courts_file} ({link_method} of {outdoor_file})")
+    print(f"  Wrote dedupe index {args.index} (for --add)")
+    if not stage.changed:
+        print("  (output identical to the existing files, left untouched)")
     
     print("\n" + "=" * 60)
     print("SUMMARY")
     print("=" * 60)
-    print(f"  Original outdoor courts: {len(outdoor_courts)}")
-    print(f"  Same-name duplicates removed: {len(same_name_indices)}")
-    print(f"  Indoor-priority removals: {len(indoor_priority_indices)}")
-    print(f"  Total removed: {len(all_indices_to_remove)}")
-    print(f"  Final outdoor courts: {len(deduped_outdoor)}")
+    print(f"  Original outdoor courts: {original_count}")
+    print(f"  Same-name duplicates removed: {same_name_count}")
+    print(f"  Indoor-priority removals: {indoor_priority_count}")
+    print(f"  Total removed: {removed_count}")
+    print(f"  Final outdoor courts: {final_count}")
     print(f"  Indoor gyms: {len(indoor_gyms)}")
-    print(f"  TOTAL COURTS: {len(deduped_outdoor) + len(indoor_gyms)}")
+    print(f"  TOTAL COURTS: {final_count + len(indoor_gyms)}")
     print("=" * 60)
     
-    return len(outdoor_courts), len(deduped_outdoor), len(all_indices_to_remove)
+    return original_count, final_count, removed_count
 
 if __name__ == "__main__":
     main()
@@ -4,11 +4,21 @@ Cross-source deduplication: Remove indoor gyms that are duplicates of outdoor co
 Uses fuzzy name matching and proximity to identify duplicates.
 """
 
-import json
+import argparse
 import re
 import math
 from collections import defaultdict
 
+from dart_emitter import (DART_STRING, GYM_FIELDS, dart_unescape, is_dart_columns, read_dart_columns,
+                          write_dart_columns, write_dart_list)
+from dedupe_report import DedupeReport, default_report_path
+from json_stream import iter_json_array
+from pipeline_metrics import instrument, phase, record_counts
+from staged_output import StagedOutputs
+
+OUTDOOR_COURTS_FILE = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/assets/data/courts_named.json'
+INDOOR_GYMS_FILE = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/indoor_gyms_data.dart'
+
 def haversine_distance(lat1, lng1, lat2, lng2):
     """Calculate distance between two points in meters."""
     R = 6371000
@@ -43,30 +53,31 @@ def get_name_tokens(name):
     tokens = set(name.split()) - stopwords
     return tokens
 
-def names_are_similar(name1, name2, threshold=0.6):
-    """Check if two names are similar enough using token overlap."""
+def name_similarity(name1, name2):
+    """Jaccard similarity of the significant name tokens (0.0 - 1.0)."""
     tokens1 = get_name_tokens(name1)
     tokens2 = get_name_tokens(name2)
     
     if not tokens1 or not tokens2:
-        return False
+        return 0.0
     
     # Calculate Jaccard similarity
     intersection = tokens1 & tokens2
     union = tokens1 | tokens2
     
     if not union:
-        return False
+        return 0.0
     
-    similarity = len(intersection) / len(union)
-    return similarity >= threshold
+    return len(intersection) / len(union)
+
+def names_are_similar(name1, name2, threshold=0.6):
+    """Check if two names are similar enough using token overlap."""
+    return name_similarity(name1, name2) >= threshold
 
 def load_outdoor_courts(filepath):
-    """Load outdoor courts from JSON file."""
-    with open(filepath, 'r') as f:
-        data = json.load(f)
+    """Load outdoor courts from JSON file (streamed, keeping only the fields used here)."""
     courts = []
-    for court in data:
+    for court in iter_json_array(filepath):
         if court.get('name') and court.get('lat') and court.get('lng'):
             courts.append({
                 'id': court.get('id', ''),
@@ -78,6 +89,9 @@ def load_outdoor_courts(filepath):
 
 def parse_indoor_gyms(filepath):
     """Parse the Dart file to extract gym entries."""
+    gyms = read_dart_columns(filepath, GYM_FIELDS)
+    if gyms is not None:
+        return gyms
     with open(filepath, 'r') as f:
         content = f.read()
     
@@ -85,7 +99,7 @@ def parse_indoor_gyms(filepath):
     entry_pattern = re.compile(
         r"\{\s*\n"
         r"\s*'id':\s*'([^']+)',\s*\n"
-        r"\s*'name':\s*'([^']*)',\s*\n"
+        r"\s*'name':\s*" + DART_STRING + r",\s*\n"
         r"\s*'lat':\s*([\d.-]+),\s*\n"
         r"\s*'lng':\s*([\d.-]+),\s*\n"
         r"\s*'category':\s*'([^']+)',\s*\n"
@@ -97,48 +111,19 @@ def parse_indoor_gyms(filepath):
     for match in entry_pattern.finditer(content):
         gyms.append({
             'id': match.group(1),
-            'name': match.group(2),
+            'name': dart_unescape(match.group(2)),
             'lat': float(match.group(3)),
             'lng': float(match.group(4)),
             'category': match.group(5),
         })
     return gyms
 
-def generate_dart_file(gyms, output_path):
-    """Generate the Dart file with deduplicated data."""
-    lines = [
-        "// AUTO-GENERATED FILE - DO NOT EDIT MANUALLY",
-        "// Generated from OpenStreetMap data",
-        "// Attribution: © OpenStreetMap contributors (ODbL)",
-        "// Contains: Indoor basketball venues (schools, athletic clubs, rec centers)",
-        "// DEDUPLICATED: Removed duplicates within 100m of same name + cross-source duplicates",
-        "",
-        "/// Indoor basketball venue data from OpenStreetMap",
-        "final List<Map<String, dynamic>> indoorGymsData = [",
-    ]
-    
-    for gym in gyms:
-        name = gym['name'].replace("'", "\\'")
-        entry = f"  {{\n    'id': '{gym['id']}',\n    'name': '{name}',\n    'lat': {gym['lat']},\n    'lng': {gym['lng']},\n    'category': '{gym['category']}',\n    'indoor': true,\n  }},"
-        lines.append(entry)
-    
-    lines.append("];")
-    
-    with open(output_path, 'w') as f:
-        f.write('\n'.join(lines))
-
-def main():
-    outdoor_file = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/assets/data/courts_named.json'
-    indoor_file = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/indoor_gyms_data.dart'
-    
-    print("Loading outdoor courts...")
-    outdoor_courts = load_outdoor_courts(outdoor_file)
-    print(f"  Loaded {len(outdoor_courts)} outdoor courts")
-    
-    print("\nLoading indoor gyms...")
-    indoor_gyms = parse_indoor_gyms(indoor_file)
-    print(f"  Loaded {len(indoor_gyms)} indoor gyms")
-    
+def find_cross_source_duplicates(indoor_gyms, outdoor_courts, distance_threshold=200, similarity_threshold=0.5):
+    """
+    Find indoor gyms that duplicate a nearby, similarly named outdoor court.
+    Returns (duplicates, indices_to_remove); each duplicate is a dict with the
+    gym index, the matching court, both names, distance and similarity.
+    """
     # Build spatial index for outdoor courts (bucket by approximate lat/lng)
     # Use 0.01 degree buckets (~1km)
     outdoor_buckets = defaultdict(list)
@@ -149,7 +134,6 @@ def main():
             for dlng in [-1, 0, 1]:
                 outdoor_buckets[(bucket_lat + dlat, bucket_lng + dlng)].append(court)
     
-    print("\nFinding cross-source duplicates (indoor gyms matching outdoor courts)...")
     duplicates_found = []
     indices_to_remove = set()
     
@@ -165,17 +149,71 @@ def main():
         for court in nearby_outdoor:
             # Check distance first (fast rejection)
             dist = haversine_distance(gym['lat'], gym['lng'], court['lat'], court['lng'])
-            if dist < 200:  # Within 200 meters
+            if dist < distance_threshold:
                 # Check name similarity
-                if names_are_similar(gym['name'], court['name'], threshold=0.5):
+                if names_are_similar(gym['name'], court['name'], threshold=similarity_threshold):
                     indices_to_remove.add(idx)
                     duplicates_found.append({
+                        'idx': idx,
+                        'court': court,
                         'indoor': gym['name'],
                         'outdoor': court['name'],
-                        'distance': dist
+                        'distance': dist,
+                        'similarity': name_similarity(gym['name'], court['name']),
                     })
                     break
     
+    return duplicates_found, indices_to_remove
+
+def generate_dart_file(gyms, output_path, columnar=False):
+    """Generate the Dart file with deduplicated data (typed columns if columnar)."""
+    header = [
+        "// AUTO-GENERATED FILE - DO NOT EDIT MANUALLY",
+        "// Generated from OpenStreetMap data",
+        "// Attribution: © OpenStreetMap contributors (ODbL)",
+        "// Contains: Indoor basketball venues (schools, athletic clubs, rec centers)",
+        "// DEDUPLICATED: Removed duplicates within 100m of same name + cross-source duplicates",
+        "",
+        "/// Indoor basketball venue data from OpenStreetMap",
+        "final List<Map<String, dynamic>> indoorGymsData = [",
+    ]
+    write = write_dart_columns if columnar else write_dart_list
+    # Keep the input's order; stages that rewrite a dataset don't re-sort it (see spatial_order)
+    write(output_path, header, gyms, fields=GYM_FIELDS, constants={'indoor': True}, spatial=False)
+
+@instrument("cross_source_dedupe")
+def main():
+    parser = argparse.ArgumentParser(description='Remove indoor gyms that duplicate outdoor courts')
+    parser.add_argument("--outdoor", default=OUTDOOR_COURTS_FILE, help="Outdoor courts JSON (courts_named.json)")
+    parser.add_argument("--indoor", default=INDOOR_GYMS_FILE, help="Indoor gyms Dart file to dedupe")
+    parser.add_argument("--output", help="Where to write the indoor result (default: overwrite --indoor)")
+    parser.add_argument("--force", action="store_true", help="Rerun even if the inputs are unchanged since the last run")
+    args = parser.parse_args()
+    
+    outdoor_file = args.outdoor
+    indoor_file = args.indoor
+    output_file = args.output or indoor_file
+    params = {'distance_m': 200, 'similarity': 0.5}
+    
+    stage = StagedOutputs('cross_source_dedupe', inputs=[outdoor_file, indoor_file], params=params)
+    if not args.force and stage.up_to_date([output_file]):
+        print("Outdoor and indoor data unchanged since the last cross-source run, nothing to do (use --force to rerun)")
+        return
+    
+    print("Loading outdoor courts...")
+    with phase("load_outdoor"):
+        outdoor_courts = load_outdoor_courts(outdoor_file)
+    print(f"  Loaded {len(outdoor_courts)} outdoor courts")
+    
+    print("\nLoading indoor gyms...")
+    with phase("parse_indoor"):
+        indoor_gyms = parse_indoor_gyms(indoor_file)
+    print(f"  Loaded {len(indoor_gyms)} indoor gyms")
+    
+    print("\nFinding cross-source duplicates (indoor gyms matching outdoor courts)...")
+    with phase("dedupe"):
+        duplicates_found, indices_to_remove = find_cross_source_duplicates(indoor_gyms, outdoor_courts)
+    
     print(f"\nDuplicates found: {len(duplicates_found)}")
     
     if duplicates_found:
@@ -186,10 +224,18 @@ def main():
     # Create deduplicated list
     deduped_gyms = [gym for i, gym in enumerate(indoor_gyms) if i not in indices_to_remove]
     print(f"\nIndoor gyms after cross-source deduplication: {len(deduped_gyms)}")
-    
-    # Write back
-    print(f"\nWriting deduplicated data back to {indoor_file}...")
-    generate_dart_file(deduped_gyms, indoor_file)
+    record_counts(records_in=len(indoor_gyms), records_out=len(deduped_gyms))
+    
+    # Record every removal so the run can be audited or undone, and replace
+    # the original file only once the new one is completely written
+    print(f"\nWriting deduplicated data to {output_file}...")
+    report_file = default_report_path()
+    with DedupeReport(report_file, 'cross_source_dedupe', indoor_file, output_file, params) as report, stage:
+        for dup in duplicates_found:
+            report.add(indoor_gyms[dup['idx']], dup['court'], 'cross_source',
+                       distance_m=dup['distance'], similarity=dup['similarity'], position=dup['idx'])
+        generate_dart_file(deduped_gyms, stage.path(output_file), columnar=is_dart_columns(indoor_file))
+    print(f"Decision report: {report_file} (run #{report.run_id})")
     print("Done!")
     
     return len(indoor_gyms), len(deduped_gyms), len(indices_to_remove)
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Shared Dart data-file emitter for the court pipeline.
+
+The fetch and dedupe scripts all write the same shape of file:
+
+  // header comments
+  final List<Map<String, dynamic>> someData = [
+    {
+      'id': 'osm_123',
+      'name': 'Lincoln Park Court',
+      'lat': 37.123,
+      'lng': -122.456,
+    },
+  ];
+
+This module streams entries through a buffered writer instead of growing one
+big string, escapes strings as Dart literals (Python's repr() produces Python
+escapes and sometimes double quotes), and writes through a temp file that is
+renamed into place. Output is a pure function of the input, and an unchanged
+file is left untouched so its mtime and git state don't churn. Entries are
+written in spatial_order (Hilbert curve, then id) unless spatial=False, so
+refetching one city changes one stretch of the file.
+
+write_dart_columns is the opt-in alternative (--columnar in the writers):
+the same list, stored as one typed array per field, behind a generated
+read-only ListBase view, so `indoorGymsData[i]['name']` keeps working while
+the compiler sees a few flat constant lists instead of one map literal per
+record and the app allocates no maps until a row is read:
+
+  final Int32List _indoorGymsDataLat = Int32List.fromList(const <int>[...]);
+  const List<String> _indoorGymsDataName = <String>[...];
+  final List<Map<String, dynamic>> indoorGymsData = _IndoorGymsDataView();
+
+read_dart_columns() turns such a file back into records, so the pipeline's
+own readers accept either layout.
+"""
+
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from spatial_order import spatial_sort
+from staged_output import replace_if_changed
+
+BUFFER_SIZE = 1 << 20
+
+# Matches a single-quoted Dart string literal; group 1 is the escaped body.
+DART_STRING = r"'((?:[^'\\\n]|\\.)*)'"
+
+# First line of the layout description in a write_dart_columns file
+COLUMNS_MARKER = "// hooprank-columns: "
+
+# lat/lng are stored as Int32 in units of 1e-7 degrees (OSM's own precision)
+COORD_FIELDS = ("lat", "lng")
+COORD_SCALE = 10_000_000
+
+# String columns with at most this many distinct values (and at most a quarter
+# as many as there are rows) become Uint8List codes into a value table
+MAX_DICT_VALUES = 256
+
+# Fields of indoorGymsData entries besides the constant 'indoor': True
+GYM_FIELDS = ('id', 'name', 'lat', 'lng', 'category')
+
+_DECLARATION_RE = re.compile(r"final List<Map<String, dynamic>> (\w+) = \[$")
+
+_ESCAPES = {
+    "\\": "\\\\",
+    "'": "\\'",
+    "$": "\\$",
+    "\n": "\\n",
+    "\r": "\\r",
+    "\t": "\\t",
+    "\b": "\\b",
+    "\f": "\\f",
+    "\v": "\\v",
+}
+_ESCAPE_RE = re.compile(r"[\\'$\x00-\x1f\x7f]")
+_UNESCAPES = {"n": "\n", "r": "\r", "t": "\t", "b": "\b", "f": "\f", "v": "\v"}
+_UNESCAPE_RE = re.compile(r"\\(x[0-9A-Fa-f]{2}|u\{[0-9A-Fa-f]{1,6}\}|u[0-9A-Fa-f]{4}|.)", re.DOTALL)
+
+
+def _escape_char(match: "re.Match") -> str:
+    char = match.group(0)
+    return _ESCAPES.get(char) or f"\\x{ord(char):02X}"
+
+
+def dart_string(value: str) -> str:
+    """Single-quoted Dart string literal for `value`."""
+    return "'" + _ESCAPE_RE.sub(_escape_char, value) + "'"
+
+
+def _unescape_char(match: "re.Match") -> str:
+    esc = match.group(1)
+    if esc[0] == "x" and len(esc) == 3:
+        return chr(int(esc[1:], 16))
+    if esc[0] == "u" and len(esc) > 1:
+        return chr(int(esc[1:].strip("{}"), 16))
+    return _UNESCAPES.get(esc, esc)
+
+
+def dart_unescape(body: str) -> str:
+    """Inverse of dart_string for the body of a single-quoted literal."""
+    return _UNESCAPE_RE.sub(_unescape_char, body)
+
+
+def dart_value(value: Any) -> str:
+    """Dart literal for a JSON-like scalar."""
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return dart_string(str(value))
+
+
+def _write_entry(out, record: Dict, fields: Sequence[str], constants: Dict[str, Any],
+                 optional_fields: Sequence[str]):
+    out.write("  {\n")
+    for key in fields:
+        out.write(f"    '{key}': {dart_value(record[key])},\n")
+    for key, value in constants.items():
+        out.write(f"    '{key}': {dart_value(value)},\n")
+    for key in optional_fields:
+        value = record.get(key)
+        if value:
+            out.write(f"    '{key}': {dart_value(value)},\n")
+    out.write("  },\n")
+
+
+def write_dart_list(
+    path: str,
+    header_lines: List[str],
+    records: Iterable[Dict],
+    fields: Sequence[str],
+    constants: Optional[Dict[str, Any]] = None,
+    optional_fields: Sequence[str] = (),
+    spatial: bool = True,
+) -> int:
+    """
+    Write `records` as a Dart list of map literals.
+
+    header_lines: comment lines plus the `final ... = [` declaration.
+    fields:          keys written for every record, in order.
+    constants:       fixed key/values written after `fields` (e.g. 'indoor': true).
+    optional_fields: keys written only when the record has a truthy value.
+    spatial:         write in spatial_order; False keeps the given order.
+
+    Returns the number of records written.
+    """
+    constants = constants or {}
+    if spatial:
+        records = spatial_sort(records)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8", newline="\n", buffering=BUFFER_SIZE) as out:
+        for line in header_lines:
+            out.write(line + "\n")
+        for record in records:
+            _write_entry(out, record, fields, constants, optional_fields)
+            count += 1
+        out.write("];\n")
+
+    # Same bytes as before: keep the existing file (and its mtime)
+    replace_if_changed(tmp_path, path)
+    return count
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _camel(name: str) -> str:
+    return "".join(part[:1].upper() + part[1:] for part in re.split(r"[^A-Za-z0-9]+", name) if part)
+
+
+def _column_kind(field: str, values: List[Any]) -> str:
+    """coord (Int32 1e-7 degrees), float, dict (Uint8 codes), string or dynamic."""
+    if values and all(_is_number(v) for v in values):
+        return "coord" if field in COORD_FIELDS else "float"
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, str) for v in present):
+        distinct = len(set(values))
+        if distinct <= MAX_DICT_VALUES and distinct * 4 <= len(values):
+            return "dict"
+        return "string"
+    return "dynamic"
+
+
+def _write_block(out, declaration: str, literals: Iterable[str], close: str = "];"):
+    out.write(declaration + "\n")
+    for literal in literals:
+        out.write(f"  {literal},\n")
+    out.write(close + "\n\n")
+
+
+def _write_column(out, name: str, kind: str, values: List[Any]) -> str:
+    """Write one column's declarations; returns the Dart expression for row `_i`."""
+    nullable = "?" if any(v is None for v in values) else ""
+    if kind == "coord":
+        _write_block(out, f"final Int32List {name} = Int32List.fromList(const <int>[",
+                     (str(round(v * COORD_SCALE)) for v in values), "]);")
+        return f"{name}[_i] / {COORD_SCALE}"
+    if kind == "float":
+        _write_block(out, f"final Float64List {name} = Float64List.fromList(const <double>[",
+                     (repr(float(v)) for v in values), "]);")
+        return f"{name}[_i]"
+    if kind == "dict":
+        table = sorted(set(values), key=lambda v: (v is not None, v or ""))
+        codes = {value: code for code, value in enumerate(table)}
+        _write_block(out, f"const List<String{nullable}> {name}Values = <String{nullable}>[",
+                     (dart_value(v) for v in table))
+        _write_block(out, f"final Uint8List {name} = Uint8List.fromList(const <int>[",
+                     (str(codes[v]) for v in values), "]);")
+        return f"{name}Values[{name}[_i]]"
+    dart_type = f"String{nullable}" if kind == "string" else "Object?"
+    _write_block(out, f"const List<{dart_type}> {name} = <{dart_type}>[", (dart_value(v) for v in values))
+    return f"{name}[_i]"
+
+
+def write_dart_columns(
+    path: str,
+    header_lines: List[str],
+    records: Iterable[Dict],
+    fields: Sequence[str],
+    constants: Optional[Dict[str, Any]] = None,
+    optional_fields: Sequence[str] = (),
+    spatial: bool = True,
+) -> int:
+    """
+    Columnar version of write_dart_list, with the same arguments: the list
+    named in header_lines' `final List<Map<String, dynamic>> name = [` line
+    becomes a read-only view over typed columns. Rows read back the same
+    keys, in the same order, as the map literals write_dart_list writes.
+
+    Returns the number of records written.
+    """
+    constants = constants or {}
+    records = spatial_sort(records) if spatial else list(records)
+    match = _DECLARATION_RE.match(header_lines[-1])
+    if match is None:
+        raise ValueError(f"Expected a List<Map<String, dynamic>> declaration, got {header_lines[-1]!r}")
+    var = match.group(1)
+    prefix = "_" + var
+    row_class, view_class = f"_{_camel(var)}Row", f"_{_camel(var)}View"
+
+    columns: List[Tuple[str, str, List[Any]]] = []
+    for key in fields:
+        values = [record[key] for record in records]
+        columns.append((key, _column_kind(key, values), values))
+    for key in optional_fields:
+        values = [record.get(key) or None for record in records]
+        columns.append((key, _column_kind(key, values), values))
+
+    layout = {
+        "var": var,
+        "count": len(records),
+        "fields": [[key, kind] for key, kind, _ in columns[:len(fields)]],
+        "constants": constants,
+        "optional": [[key, kind] for key, kind, _ in columns[len(fields):]],
+    }
+    comments = [line for line in header_lines[:-1] if not line.startswith("///")]
+    docs = [line for line in header_lines[:-1] if line.startswith("///")]
+    read_only = f"throw UnsupportedError('{var} is read-only')"
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8", newline="\n", buffering=BUFFER_SIZE) as out:
+        for line in comments:
+            out.write(line + "\n")
+        out.write(COLUMNS_MARKER + json.dumps(layout, sort_keys=True) + "\n\n")
+        out.write("import 'dart:collection';\n")
+        out.write("import 'dart:typed_data';\n\n")
+
+        getters = {}
+        for key, kind, values in columns:
+            getters[key] = _write_column(out, prefix + _camel(key), kind, values)
+
+        out.write(f"class {row_class} extends MapBase<String, dynamic> {{\n")
+        out.write(f"  {row_class}(this._i);\n\n")
+        out.write("  final int _i;\n\n")
+        out.write("  @override\n")
+        out.write("  dynamic operator [](Object? key) {\n")
+        out.write("    switch (key) {\n")
+        for key in fields:
+            out.write(f"      case '{key}':\n        return {getters[key]};\n")
+        for key, value in constants.items():
+            out.write(f"      case '{key}':\n        return {dart_value(value)};\n")
+        for key in optional_fields:
+            out.write(f"      case '{key}':\n        return {getters[key]};\n")
+        out.write("    }\n")
+        out.write("    return null;\n")
+        out.write("  }\n\n")
+        out.write("  @override\n")
+        out.write("  Iterable<String> get keys => <String>[\n")
+        for key in list(fields) + list(constants):
+            out.write(f"        '{key}',\n")
+        for key in optional_fields:
+            out.write(f"        if ({getters[key]} != null) '{key}',\n")
+        out.write("      ];\n\n")
+        out.write("  @override\n")
+        out.write(f"  void operator []=(String key, dynamic value) => {read_only};\n\n")
+        out.write("  @override\n")
+        out.write(f"  void clear() => {read_only};\n\n")
+        out.write("  @override\n")
+        out.write(f"  dynamic remove(Object? key) => {read_only};\n")
+        out.write("}\n\n")
+
+        out.write(f"class {view_class} extends ListBase<Map<String, dynamic>> {{\n")
+        out.write("  @override\n")
+        out.write(f"  int get length => {len(records)};\n\n")
+        out.write("  @override\n")
+        out.write(f"  set length(int newLength) => {read_only};\n\n")
+        out.write("  @override\n")
+        out.write(f"  Map<String, dynamic> operator [](int index) => {row_class}(IndexError.check(index, length, indexable: this));\n\n")
+        out.write("  @override\n")
+        out.write(f"  void operator []=(int index, Map<String, dynamic> value) => {read_only};\n")
+        out.write("}\n\n")
+
+        for line in docs:
+            out.write(line + "\n")
+        out.write(f"final List<Map<String, dynamic>> {var} = {view_class}();\n")
+
+    replace_if_changed(tmp_path, path)
+    return len(records)
+
+
+def _parse_literal(literal: str, kind: str) -> Any:
+    if kind == "coord":
+        return int(literal) / COORD_SCALE
+    if kind == "float":
+        return float(literal)
+    return dart_literal(literal)
+
+
+def dart_literal(literal: str) -> Any:
+    """Inverse of dart_value."""
+    if literal == "null":
+        return None
+    if literal in ("true", "false"):
+        return literal == "true"
+    if literal.startswith("'"):
+        return dart_unescape(literal[1:-1])
+    return float(literal) if any(c in literal for c in ".eE") else int(literal)
+
+
+def read_dart_columns(path: str, keys: Optional[Sequence[str]] = None) -> Optional[List[Dict]]:
+    """
+    Records of a write_dart_columns file (only `keys`, if given), or None if
+    the file is in the map-literal layout.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    start = content.find(COLUMNS_MARKER)
+    if start == -1:
+        return None
+    layout = json.loads(content[start + len(COLUMNS_MARKER):content.index("\n", start)])
+    prefix = "_" + layout["var"]
+
+    def block(name: str, kind: str) -> List[Any]:
+        match = re.search(r"^[^\n]* " + re.escape(name) + r" = [^\n]*\[\n(.*?)^\]\)?;", content,
+                          re.MULTILINE | re.DOTALL)
+        return [_parse_literal(line.strip()[:-1], kind) for line in match.group(1).splitlines()]
+
+    def column(key: str, kind: str) -> List[Any]:
+        name = prefix + _camel(key)
+        if kind == "dict":
+            table = block(name + "Values", "string")
+            return [table[code] for code in block(name, "int")]
+        return block(name, kind)
+
+    fields = [(key, column(key, kind)) for key, kind in layout["fields"]]
+    optional = [(key, column(key, kind)) for key, kind in layout["optional"]]
+    records = []
+    for i in range(layout["count"]):
+        record = {key: values[i] for key, values in fields}
+        record.update(layout["constants"])
+        for key, values in optional:
+            if values[i]:
+                record[key] = values[i]
+        if keys is not None:
+            record = {key: record[key] for key in keys if key in record}
+        records.append(record)
+    return records
+
+
+def is_dart_columns(path: str) -> bool:
+    """Whether a Dart data file was written by write_dart_columns."""
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(1 << 16)
+    return COLUMNS_MARKER in head
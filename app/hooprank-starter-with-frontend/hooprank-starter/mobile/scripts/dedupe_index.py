@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped snapshot of comprehensive_dedupe's indexes, so a new batch
+of courts (one fetch_city_courts city, say) is deduped without re-reading
+and re-indexing the national outdoor and indoor files.
+
+The snapshot holds exactly what the two dedupe rules look up:
+
+  - indoor gyms by 0.01 degree bucket (the build_indoor_buckets grid), as a
+    sorted array of bucket keys, so the gyms near a court are found by
+    binary search over the 3x3 buckets around it
+  - the first court of every name (stream_dedupe's first_by_name), in an
+    open-addressing hash table keyed by a stable 64-bit hash of the name
+
+Everything is fixed-size records in one file read through mmap, so opening
+it is free and a lookup touches a few pages. add_names() fills table slots
+in place and appends the new strings at the end of the file; the table is
+only rewritten when it passes MAX_LOAD.
+
+The header records the path, size and mtime of the outdoor and gym files
+the snapshot describes. open() callers check matches() and rebuild when
+either file was changed by something else.
+
+Layout (little endian):
+    header                      HEADER
+    gym bucket keys, sorted     int64 x gyms
+    gym index for each key      int64 x gyms
+    gym records, file order     GYM x gyms
+    name table                  SLOT x table_cap
+    strings                     uint32 length + utf-8 bytes, to strings_end
+"""
+
+import bisect
+import hashlib
+import math
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MAGIC = b"HRDX"
+VERSION = 1
+
+# magic, version, gym_count, table_cap, name_count, court_count, strings_end,
+# outdoor size/mtime_ns, gyms size/mtime_ns, outdoor/gyms path offsets
+HEADER = struct.Struct("<4sIQQQQQQqQqQQ")
+
+# lat, lng, id offset, name offset
+GYM = struct.Struct("<ddQQ")
+
+# name hash (0 = empty), lat, lng, id offset, name offset
+SLOT = struct.Struct("<QddQQ")
+STRING_LEN = struct.Struct("<I")
+
+# The table is rewritten at twice the size beyond this fill ratio
+MAX_LOAD = 0.7
+
+# Bucket keys are row * GYM_KEY_STRIDE + col for the 0.01 degree buckets
+GYM_KEY_STRIDE = 100_000
+
+Stamp = Tuple[int, int]  # (size, mtime_ns)
+
+
+def file_stamp(path: str) -> Stamp:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def name_hash(name: str) -> int:
+    digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+def gym_key(bucket_lat: int, bucket_lng: int) -> int:
+    return bucket_lat * GYM_KEY_STRIDE + bucket_lng
+
+
+def _table_capacity(names: int) -> int:
+    return 1 << max(4, math.ceil(math.log2(names / MAX_LOAD * 1.5 + 1)))
+
+
+def _probe(hashed: int, cap: int) -> Iterable[int]:
+    slot = hashed & (cap - 1)
+    while True:
+        yield slot
+        slot = (slot + 1) & (cap - 1)
+
+
+def write_snapshot(path: str, gyms: List[Dict], names: Dict[str, Tuple[str, float, float]],
+                   court_count: int, outdoor_path: str, gyms_path: str):
+    """
+    Write a snapshot for `gyms` (in gym file order) and `names` (name ->
+    (id, lat, lng) of the first court with that name) after `court_count`
+    input courts, stamped with the current state of outdoor_path and
+    gyms_path. Written to a temp file and renamed in.
+    """
+    gym_count = len(gyms)
+    cap = _table_capacity(len(names))
+    keys_off = HEADER.size
+    order_off = keys_off + 8 * gym_count
+    gyms_off = order_off + 8 * gym_count
+    table_off = gyms_off + GYM.size * gym_count
+    strings = bytearray()
+    strings_start = table_off + SLOT.size * cap
+
+    def add_string(value: str) -> int:
+        offset = strings_start + len(strings)
+        data = (value or "").encode("utf-8")
+        strings.extend(STRING_LEN.pack(len(data)))
+        strings.extend(data)
+        return offset
+
+    outdoor_path_off = add_string(os.path.abspath(outdoor_path))
+    gyms_path_off = add_string(os.path.abspath(gyms_path))
+
+    keyed = sorted(((gym_key(int(gym['lat'] * 100), int(gym['lng'] * 100)), idx)
+                    for idx, gym in enumerate(gyms)))
+    body = bytearray(strings_start - HEADER.size)
+    for i, (key, idx) in enumerate(keyed):
+        struct.pack_into("<q", body, keys_off - HEADER.size + 8 * i, key)
+        struct.pack_into("<q", body, order_off - HEADER.size + 8 * i, idx)
+    for idx, gym in enumerate(gyms):
+        GYM.pack_into(body, gyms_off - HEADER.size + GYM.size * idx, gym['lat'], gym['lng'],
+                      add_string(gym.get('id')), add_string(gym['name']))
+    for name, (court_id, lat, lng) in names.items():
+        hashed = name_hash(name)
+        for slot in _probe(hashed, cap):
+            pos = table_off - HEADER.size + SLOT.size * slot
+            if struct.unpack_from("<Q", body, pos)[0] == 0:
+                SLOT.pack_into(body, pos, hashed, lat, lng, add_string(court_id), add_string(name))
+                break
+
+    outdoor_size, outdoor_mtime = file_stamp(outdoor_path)
+    gyms_size, gyms_mtime = file_stamp(gyms_path)
+    header = HEADER.pack(MAGIC, VERSION, gym_count, cap, len(names), court_count,
+                         strings_start + len(strings), outdoor_size, outdoor_mtime,
+                         gyms_size, gyms_mtime, outdoor_path_off, gyms_path_off)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(body)
+        f.write(strings)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class DedupeIndex:
+    """An open snapshot: gym and first-of-name lookups, and in-place name inserts."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.f = open(path, "r+b")
+        self.mm = None
+        self.keys = self.order = None
+        self._map()
+
+    def _map(self):
+        self.mm = mmap.mmap(self.f.fileno(), 0)
+        (magic, version, self.gym_count, self.table_cap, self.name_count, self.court_count,
+         self.strings_end, *stamps, outdoor_path_off, gyms_path_off) = HEADER.unpack_from(self.mm, 0)
+        self.path_offsets = (outdoor_path_off, gyms_path_off)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a version {VERSION} dedupe index")
+        self.outdoor_stamp = (stamps[0], stamps[1])
+        self.gyms_stamp = (stamps[2], stamps[3])
+        self.outdoor_path = self._string(outdoor_path_off)
+        self.gyms_path = self._string(gyms_path_off)
+        self.keys_off = HEADER.size
+        self.order_off = self.keys_off + 8 * self.gym_count
+        self.gyms_off = self.order_off + 8 * self.gym_count
+        self.table_off = self.gyms_off + GYM.size * self.gym_count
+        self.keys = memoryview(self.mm)[self.keys_off:self.order_off].cast("q")
+        self.order = memoryview(self.mm)[self.order_off:self.gyms_off].cast("q")
+
+    def _unmap(self):
+        if self.keys is not None:
+            self.keys.release()
+            self.order.release()
+            self.keys = self.order = None
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    @classmethod
+    def open(cls, path: str) -> Optional["DedupeIndex"]:
+        """The snapshot at path, or None if there is none (or it is unreadable)."""
+        try:
+            return cls(path)
+        except (FileNotFoundError, ValueError, struct.error):
+            return None
+
+    def matches(self, outdoor_path: str, gyms_path: str) -> bool:
+        """Whether the snapshot describes these files as they are now."""
+        try:
+            return (self.outdoor_path == os.path.abspath(outdoor_path)
+                    and self.gyms_path == os.path.abspath(gyms_path)
+                    and file_stamp(outdoor_path) == self.outdoor_stamp
+                    and file_stamp(gyms_path) == self.gyms_stamp)
+        except FileNotFoundError:
+            return False
+
+    def _string(self, offset: int) -> str:
+        (length,) = STRING_LEN.unpack_from(self.mm, offset)
+        start = offset + STRING_LEN.size
+        return self.mm[start:start + length].decode("utf-8")
+
+    def gym(self, idx: int) -> Dict:
+        """{'id', 'name', 'lat', 'lng'} of the gym at this position in the gym file."""
+        lat, lng, id_off, name_off = GYM.unpack_from(self.mm, self.gyms_off + GYM.size * idx)
+        return {'id': self._string(id_off), 'name': self._string(name_off), 'lat': lat, 'lng': lng}
+
+    def gyms_near(self, lat: float, lng: float) -> List[Tuple[int, float, float]]:
+        """
+        (idx, lat, lng) of the gyms in the 3x3 buckets around a point, in gym
+        file order: the same candidates, in the same order, as
+        build_indoor_buckets gives. Names are only decoded by gym(idx).
+        """
+        bucket_lat, bucket_lng = int(lat * 100), int(lng * 100)
+        found = []
+        for dlat in (-1, 0, 1):
+            for dlng in (-1, 0, 1):
+                key = gym_key(bucket_lat + dlat, bucket_lng + dlng)
+                lo = bisect.bisect_left(self.keys, key)
+                hi = bisect.bisect_right(self.keys, key, lo)
+                found.extend(self.order[lo:hi])
+        found.sort()
+        return [(idx, *GYM.unpack_from(self.mm, self.gyms_off + GYM.size * idx)[:2]) for idx in found]
+
+    def first_of_name(self, name: str) -> Optional[Dict]:
+        """{'id', 'lat', 'lng'} of the first court named `name`, or None."""
+        hashed = name_hash(name)
+        for slot in _probe(hashed, self.table_cap):
+            slot_hash, lat, lng, id_off, name_off = SLOT.unpack_from(self.mm, self.table_off + SLOT.size * slot)
+            if slot_hash == 0:
+                return None
+            if slot_hash == hashed and self._string(name_off) == name:
+                return {'id': self._string(id_off), 'lat': lat, 'lng': lng}
+
+    def names(self) -> Dict[str, Tuple[str, float, float]]:
+        """Every name in the table, as write_snapshot takes them."""
+        names = {}
+        for slot in range(self.table_cap):
+            slot_hash, lat, lng, id_off, name_off = SLOT.unpack_from(self.mm, self.table_off + SLOT.size * slot)
+            if slot_hash:
+                names[self._string(name_off)] = (self._string(id_off), lat, lng)
+        return names
+
+    def add_names(self, names: Dict[str, Tuple[str, float, float]], added_courts: int):
+        """
+        Record the first courts of new names and `added_courts` more input
+        courts, then restamp the header from the outdoor file as it is now.
+        The outdoor stamp is cleared before the slots are written and set
+        again last, so a crash in between leaves a snapshot that matches no
+        file (and is rebuilt), even if rollback_add restores the outdoor
+        file's old size and mtime.
+        """
+        court_count = self.court_count + added_courts
+        if self.name_count + len(names) > self.table_cap * MAX_LOAD:
+            merged = self.names()
+            merged.update(names)
+            gyms = [self.gym(idx) for idx in range(self.gym_count)]
+            outdoor_path, gyms_path = self.outdoor_path, self.gyms_path
+            self._unmap()
+            self.f.close()
+            write_snapshot(self.path, gyms, merged, court_count, outdoor_path, gyms_path)
+            self.f = open(self.path, "r+b")
+            self._map()
+            return
+
+        strings = bytearray()
+
+        def add_string(value: str) -> int:
+            offset = self.strings_end + len(strings)
+            data = (value or "").encode("utf-8")
+            strings.extend(STRING_LEN.pack(len(data)))
+            strings.extend(data)
+            return offset
+
+        slots = []
+        taken = set()
+        for name, (court_id, lat, lng) in names.items():
+            hashed = name_hash(name)
+            for slot in _probe(hashed, self.table_cap):
+                if slot not in taken and struct.unpack_from("<Q", self.mm, self.table_off + SLOT.size * slot)[0] == 0:
+                    taken.add(slot)
+                    slots.append((slot, SLOT.pack(hashed, lat, lng, add_string(court_id), add_string(name))))
+                    break
+
+        # Invalidate the header, then strings, the slots that point at them,
+        # and finally the restamped header
+        self._write_header((0, 0), self.name_count, self.court_count, self.strings_end)
+        self.f.seek(self.strings_end)
+        self.f.write(strings)
+        self.f.flush()
+        for slot, packed in slots:
+            pos = self.table_off + SLOT.size * slot
+            self.mm[pos:pos + SLOT.size] = packed
+        self._write_header(file_stamp(self.outdoor_path), self.name_count + len(slots), court_count,
+                           self.strings_end + len(strings))
+        self._unmap()
+        self._map()
+
+    def _write_header(self, outdoor_stamp: Stamp, name_count: int, court_count: int, strings_end: int):
+        self.mm[:HEADER.size] = HEADER.pack(
+            MAGIC, VERSION, self.gym_count, self.table_cap, name_count, court_count, strings_end,
+            outdoor_stamp[0], outdoor_stamp[1], self.gyms_stamp[0], self.gyms_stamp[1], *self.path_offsets)
+        self.mm.flush()
+
+    def close(self):
+        self._unmap()
+        self.f.close()
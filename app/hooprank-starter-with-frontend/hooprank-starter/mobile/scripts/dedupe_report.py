@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Dedupe decision report shared by the dedupe scripts.
+
+Every dedupe run records one row per removed court: the cluster it belonged to,
+the court that was kept in its place, the rule that fired, and the distance and
+name similarity that triggered it. The removed record itself is stored too, so a
+run can be rolled back by joining its rows into the current dataset instead of
+re-fetching and re-running everything.
+
+Rows live in a small SQLite file (one column per field, indexed by member id and
+kept id), so a single court can be looked up without loading the whole report.
+By default it is .pipeline/dedupe_report.sqlite next to these scripts.
+
+Usage:
+  python dedupe_report.py runs
+  python dedupe_report.py show --id gym_123456
+  python dedupe_report.py undo --run 3 --dataset ../assets/data/courts_named.json
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional
+
+from json_stream import JsonArrayWriter
+from staged_output import STATE_DIR
+
+REPORT_FILENAME = "dedupe_report.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    script TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    input_path TEXT,
+    output_path TEXT,
+    params TEXT,
+    removed INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS decisions (
+    run_id INTEGER NOT NULL,
+    cluster_id INTEGER NOT NULL,
+    member_id TEXT NOT NULL,
+    kept_id TEXT,
+    rule TEXT NOT NULL,
+    distance_m REAL,
+    similarity REAL,
+    position INTEGER,
+    record TEXT
+);
+CREATE INDEX IF NOT EXISTS decisions_member ON decisions (member_id);
+CREATE INDEX IF NOT EXISTS decisions_kept ON decisions (kept_id);
+CREATE INDEX IF NOT EXISTS decisions_run ON decisions (run_id, cluster_id);
+"""
+
+# Rows are buffered and written with executemany; one transaction per run.
+BATCH_SIZE = 1000
+
+
+def default_report_path() -> str:
+    """Pipeline-wide report file (kept out of assets/, which ships with the app)."""
+    return os.path.join(STATE_DIR, REPORT_FILENAME)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class DedupeReport:
+    """
+    Collects the decisions of one dedupe run.
+
+    A cluster is a kept court plus every court removed in its favour, so rows
+    are grouped by kept id; each new kept id opens a new cluster.
+    """
+
+    def __init__(self, path: str, script: str, input_path: str = "",
+                 output_path: str = "", params: Optional[Dict] = None):
+        self.path = path
+        self.conn = connect(path)
+        cur = self.conn.execute(
+            "INSERT INTO runs (script, started_at, input_path, output_path, params) VALUES (?, ?, ?, ?, ?)",
+            (script, time.strftime("%Y-%m-%dT%H:%M:%S"), input_path, output_path,
+             json.dumps(params or {}, sort_keys=True)),
+        )
+        self.run_id = cur.lastrowid
+        self.clusters: Dict[str, int] = {}
+        self.removed = set()
+        self._rows: List[tuple] = []
+
+    def add(self, member: Dict, kept: Optional[Dict], rule: str,
+            distance_m: Optional[float] = None, similarity: Optional[float] = None,
+            position: Optional[int] = None):
+        """Record that `member` was removed in favour of `kept` by `rule`."""
+        kept_id = kept.get("id") if kept else None
+        cluster_key = kept_id or member.get("id")
+        cluster_id = self.clusters.get(cluster_key)
+        if cluster_id is None:
+            cluster_id = len(self.clusters) + 1
+            self.clusters[cluster_key] = cluster_id
+
+        self.removed.add(member.get("id"))
+        self._rows.append((
+            self.run_id, cluster_id, member.get("id"), kept_id, rule,
+            round(distance_m, 1) if distance_m is not None else None,
+            round(similarity, 3) if similarity is not None else None,
+            position, json.dumps(member, ensure_ascii=False),
+        ))
+        if len(self._rows) >= BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self.conn.executemany(
+            "INSERT INTO decisions (run_id, cluster_id, member_id, kept_id, rule, distance_m, "
+            "similarity, position, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            self._rows,
+        )
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        self.conn.execute("UPDATE runs SET removed = ? WHERE run_id = ?", (len(self.removed), self.run_id))
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.rollback()
+            self.conn.close()
+
+
+def lookup(path: str, court_id: str) -> List[Dict]:
+    """All decisions where `court_id` was either removed or kept."""
+    conn = connect(path)
+    rows = conn.execute(
+        "SELECT d.*, r.script FROM decisions d JOIN runs r USING (run_id) "
+        "WHERE d.member_id = ? OR d.kept_id = ? ORDER BY d.run_id, d.cluster_id",
+        (court_id, court_id),
+    ).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+def removed_records(path: str, run_id: int) -> Iterator[tuple]:
+    """Yield (position, record) for each court a run removed, in input order."""
+    conn = connect(path)
+    # A court can be removed by more than one rule; restore it once.
+    rows = conn.execute(
+        "SELECT MIN(position) AS position, record FROM decisions WHERE run_id = ? "
+        "GROUP BY member_id ORDER BY position",
+        (run_id,),
+    )
+    for row in rows:
+        yield row["position"], json.loads(row["record"])
+    conn.close()
+
+
+def undo_run(current: List[Dict], path: str, run_id: int) -> List[Dict]:
+    """
+    Put the courts removed by `run_id` back at their original positions.
+
+    `current` is the run's output; since dedupe only deletes entries, inserting
+    each removed record at its recorded input position (in ascending order)
+    reproduces the run's input, in the run's input order.
+    """
+    present = {c.get("id") for c in current}
+    restored = list(current)
+    for position, record in removed_records(path, run_id):
+        if record.get("id") in present:
+            continue
+        if position is None or position > len(restored):
+            restored.append(record)
+        else:
+            restored.insert(position, record)
+    return restored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or undo dedupe runs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_runs = sub.add_parser("runs", help="List recorded dedupe runs")
+    p_runs.add_argument("--report", default=default_report_path())
+
+    p_show = sub.add_parser("show", help="Show every decision involving a court id")
+    p_show.add_argument("--report", default=default_report_path())
+    p_show.add_argument("--id", required=True)
+
+    p_undo = sub.add_parser("undo", help="Restore the courts removed by a run")
+    p_undo.add_argument("--report", default=default_report_path())
+    p_undo.add_argument("--run", type=int, required=True)
+    p_undo.add_argument("--dataset", required=True, help="JSON list or indoor gyms Dart file to restore into")
+    p_undo.add_argument("--output", help="Where to write the restored dataset (default: overwrite --dataset)")
+    args = parser.parse_args()
+
+    if args.command == "runs":
+        conn = connect(args.report)
+        for r in conn.execute("SELECT * FROM runs ORDER BY run_id"):
+            print(f"  #{r['run_id']} {r['started_at']} {r['script']}: removed {r['removed']} ({r['output_path']})")
+        conn.close()
+
+    elif args.command == "show":
+        rows = lookup(args.report, args.id)
+        if not rows:
+            print(f"No decisions recorded for {args.id}")
+        for r in rows:
+            dist = f"{r['distance_m']:.0f}m" if r["distance_m"] is not None else "-"
+            sim = f"{r['similarity']:.2f}" if r["similarity"] is not None else "-"
+            name = json.loads(r["record"]).get("name")
+            print(f"  run #{r['run_id']} ({r['script']}) cluster {r['cluster_id']}: "
+                  f"removed {r['member_id']} '{name}' -> kept {r['kept_id']} [{r['rule']}, {dist}, sim {sim}]")
+
+    elif args.command == "undo":
+        output = args.output or args.dataset
+        if args.dataset.endswith(".dart"):
+            from dart_emitter import is_dart_columns
+            from deduplicate_indoor_gyms import generate_dart_file, parse_dart_file
+            current = parse_dart_file(args.dataset)
+            restored = undo_run(current, args.report, args.run)
+            generate_dart_file(restored, output, columnar=is_dart_columns(args.dataset))
+        else:
+            with open(args.dataset, "r") as f:
+                current = json.load(f)
+            restored = undo_run(current, args.report, args.run)
+            # Replaced by rename, so a hard-linked courts.json keeps its bytes
+            with JsonArrayWriter(output) as writer:
+                writer.write_all(restored)
+        print(f"Restored {len(restored) - len(current)} courts from run #{args.run} into {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,13 @@ Duplicates are defined as courts with:
 2. Within 100 meters of each other geographically
 """
 
-import json
 import math
 from collections import defaultdict
 
+from dedupe_report import DedupeReport, default_report_path
+from json_stream import JsonArrayWriter, iter_json_array
+from pipeline_metrics import instrument, record_counts
+
 def haversine_distance(lat1, lng1, lat2, lng2):
     """Calculate distance between two points in meters."""
     R = 6371000  # Earth's radius in meters
@@ -31,78 +34,91 @@ def normalize_name(name):
     # Lowercase, remove extra whitespace
     return ' '.join(name.lower().strip().split())
 
+def iter_duplicates(courts, distance_threshold=100):
+    """
+    Single pass over `courts` (any iterable, e.g. streamed from disk).
+    Yields (idx, court, matches) for every court, where matches lists each
+    earlier same-name court within distance_threshold as (idx, court, distance).
+    Earlier courts are remembered only as small id/lat/lng dicts.
+    """
+    seen_by_name = defaultdict(list)
+    
+    for idx2, court2 in enumerate(courts):
+        matches = []
+        name = normalize_name(court2.get('name', ''))
+        if name:
+            lat2, lng2 = court2.get('lat'), court2.get('lng')
+            earlier = seen_by_name[name]
+            for idx1, court1 in earlier:
+                lat1, lng1 = court1['lat'], court1['lng']
+                
+                if lat1 and lng1 and lat2 and lng2:
+                    dist = haversine_distance(lat1, lng1, lat2, lng2)
+                    if dist < distance_threshold:
+                        matches.append((idx1, court1, dist))
+            earlier.append((idx2, {'id': court2.get('id'), 'lat': lat2, 'lng': lng2}))
+        
+        yield idx2, court2, matches
+
 def find_duplicates(courts, distance_threshold=100):
     """
     Find duplicate courts based on name similarity and geographic proximity.
-    Returns: list of (original_index, duplicate_index, distance) tuples
+    Returns: list of (original_index, duplicate_index, distance, name) tuples
     """
-    # Group by normalized name
-    name_groups = defaultdict(list)
-    for i, court in enumerate(courts):
-        name = normalize_name(court.get('name', ''))
-        if name:
-            name_groups[name].append((i, court))
-    
     duplicates = []
-    
-    # Find duplicates within each name group
-    for name, courts_with_indices in name_groups.items():
-        if len(courts_with_indices) > 1:
-            # Check all pairs
-            for i, (idx1, court1) in enumerate(courts_with_indices):
-                for idx2, court2 in courts_with_indices[i+1:]:
-                    lat1, lng1 = court1.get('lat'), court1.get('lng')
-                    lat2, lng2 = court2.get('lat'), court2.get('lng')
-                    
-                    if lat1 and lng1 and lat2 and lng2:
-                        dist = haversine_distance(lat1, lng1, lat2, lng2)
-                        if dist < distance_threshold:
-                            duplicates.append((idx1, idx2, dist, name))
-    
+    for idx2, court2, matches in iter_duplicates(courts, distance_threshold):
+        name = normalize_name(court2.get('name', ''))
+        for idx1, _, dist in matches:
+            duplicates.append((idx1, idx2, dist, name))
     return duplicates
 
+@instrument("deduplicate_courts")
 def main():
-    # Load courts
     input_file = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/assets/data/courts_named.json'
+    output_file = input_file.replace('.json', '_deduped.json')
+    report_file = default_report_path()
     
-    print(f"Loading courts from {input_file}...")
-    with open(input_file, 'r') as f:
-        courts = json.load(f)
-    
-    print(f"Total courts: {len(courts)}")
-    
-    # Find duplicates
+    # Courts are streamed: each one is checked against earlier same-name
+    # courts as it is read and written straight to the output if kept.
+    print(f"Streaming courts from {input_file}...")
     print("\nFinding duplicates (same name within 100m)...")
-    duplicates = find_duplicates(courts)
     
-    print(f"\nFound {len(duplicates)} duplicate pairs")
+    total = 0
+    duplicate_pairs = 0
+    removed = 0
+    samples = []
+    
+    # Record every removal so the run can be audited or undone
+    with DedupeReport(report_file, 'deduplicate_courts', input_file, output_file, {'distance_m': 100}) as report, \
+            JsonArrayWriter(output_file) as writer:
+        for idx2, court2, matches in iter_duplicates(iter_json_array(input_file)):
+            total += 1
+            if not matches:
+                writer.write(court2)
+                continue
+            
+            # Keep the first occurrence, remove subsequent
+            removed += 1
+            for idx1, court1, dist in matches:
+                duplicate_pairs += 1
+                report.add(court2, court1, 'same_name', distance_m=dist, similarity=1.0, position=idx2)
+                if len(samples) < 20:
+                    samples.append((normalize_name(court2.get('name', '')), dist, court1, court2))
+    
+    record_counts(records_in=total, records_out=total - removed)
+    print(f"Total courts: {total}")
+    print(f"\nFound {duplicate_pairs} duplicate pairs")
     
     # Show sample duplicates
     print("\nSample duplicates (first 20):")
-    for idx1, idx2, dist, name in duplicates[:20]:
-        court1 = courts[idx1]
-        court2 = courts[idx2]
+    for name, dist, court1, court2 in samples:
         print(f"  '{name}' - {dist:.1f}m apart")
         print(f"    ({court1.get('lat')}, {court1.get('lng')})")
         print(f"    ({court2.get('lat')}, {court2.get('lng')})")
     
-    # Collect all indices to remove (keep the first occurrence, remove subsequent)
-    indices_to_remove = set()
-    for idx1, idx2, dist, name in duplicates:
-        # Keep idx1 (first occurrence), remove idx2
-        indices_to_remove.add(idx2)
-    
-    print(f"\nTotal courts to remove: {len(indices_to_remove)}")
-    
-    # Create deduplicated list
-    deduped_courts = [court for i, court in enumerate(courts) if i not in indices_to_remove]
-    
-    print(f"Courts after deduplication: {len(deduped_courts)}")
-    
-    # Save deduplicated courts
-    output_file = input_file.replace('.json', '_deduped.json')
-    with open(output_file, 'w') as f:
-        json.dump(deduped_courts, f)
+    print(f"\nTotal courts to remove: {removed}")
+    print(f"Courts after deduplication: {total - removed}")
+    print(f"Decision report: {report_file} (run #{report.run_id})")
     
     print(f"\nSaved deduplicated courts to: {output_file}")
     
@@ -111,7 +127,7 @@ def main():
     print(f"  cp {output_file} {input_file}")
     print(f"  cp {output_file} {input_file.replace('courts_named.json', 'courts.json')}")
     
-    return len(courts), len(deduped_courts), len(indices_to_remove)
+    return total, total - removed, removed
 
 if __name__ == "__main__":
     main()
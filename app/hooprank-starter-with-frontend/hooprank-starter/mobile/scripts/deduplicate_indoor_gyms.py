@@ -3,10 +3,19 @@
 Script to identify and remove duplicate indoor gyms from the Dart data file.
 """
 
+import argparse
 import re
 import math
 from collections import defaultdict
 
+from dart_emitter import (DART_STRING, GYM_FIELDS, dart_unescape, is_dart_columns, read_dart_columns,
+                          write_dart_columns, write_dart_list)
+from dedupe_report import DedupeReport, default_report_path
+from pipeline_metrics import instrument, phase, record_counts
+from staged_output import StagedOutputs
+
+INDOOR_GYMS_FILE = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/indoor_gyms_data.dart'
+
 def haversine_distance(lat1, lng1, lat2, lng2):
     """Calculate distance between two points in meters."""
     R = 6371000
@@ -25,6 +34,9 @@ def normalize_name(name):
 
 def parse_dart_file(filepath):
     """Parse the Dart file to extract gym entries."""
+    gyms = read_dart_columns(filepath, GYM_FIELDS)
+    if gyms is not None:
+        return gyms
     with open(filepath, 'r') as f:
         content = f.read()
     
@@ -43,7 +55,7 @@ def parse_dart_file(filepath):
     entry_pattern = re.compile(
         r"\{\s*\n"                           # Opening brace
         r"\s*'id':\s*'([^']+)',\s*\n"        # id
-        r"\s*'name':\s*'([^']*)',\s*\n"      # name (can be empty)
+        r"\s*'name':\s*" + DART_STRING + r",\s*\n"  # name (can be empty)
         r"\s*'lat':\s*([\d.-]+),\s*\n"       # lat
         r"\s*'lng':\s*([\d.-]+),\s*\n"       # lng
         r"\s*'category':\s*'([^']+)',\s*\n"  # category
@@ -56,7 +68,7 @@ def parse_dart_file(filepath):
         try:
             gym = {
                 'id': match.group(1),
-                'name': match.group(2),
+                'name': dart_unescape(match.group(2)),
                 'lat': float(match.group(3)),
                 'lng': float(match.group(4)),
                 'category': match.group(5),
@@ -67,8 +79,11 @@ def parse_dart_file(filepath):
     
     return gyms
 
-def find_duplicates(gyms, distance_threshold=100):
-    """Find duplicate gyms based on name similarity and geographic proximity."""
+def find_duplicates(gyms, distance_threshold=100, decisions=None):
+    """
+    Find duplicate gyms based on name similarity and geographic proximity.
+    If `decisions` is a list, (removed_idx, kept_idx, distance) is appended for each removal.
+    """
     name_groups = defaultdict(list)
     for i, gym in enumerate(gyms):
         name = normalize_name(gym.get('name', ''))
@@ -94,12 +109,14 @@ def find_duplicates(gyms, distance_threshold=100):
                         if dist < distance_threshold:
                             indices_to_remove.add(idx2)
                             duplicate_pairs += 1
+                            if decisions is not None:
+                                decisions.append((idx2, idx1, dist))
     
     return indices_to_remove, duplicate_pairs
 
-def generate_dart_file(gyms, output_path):
-    """Generate the Dart file with deduplicated data."""
-    lines = [
+def generate_dart_file(gyms, output_path, columnar=False):
+    """Generate the Dart file with deduplicated data (typed columns if columnar)."""
+    header = [
         "// AUTO-GENERATED FILE - DO NOT EDIT MANUALLY",
         "// Generated from OpenStreetMap data",
         "// Attribution: © OpenStreetMap contributors (ODbL)",
@@ -109,23 +126,29 @@ def generate_dart_file(gyms, output_path):
         "/// Indoor basketball venue data from OpenStreetMap",
         "final List<Map<String, dynamic>> indoorGymsData = [",
     ]
-    
-    for gym in gyms:
-        # Escape single quotes in name
-        name = gym['name'].replace("'", "\\'")
-        entry = f"  {{\n    'id': '{gym['id']}',\n    'name': '{name}',\n    'lat': {gym['lat']},\n    'lng': {gym['lng']},\n    'category': '{gym['category']}',\n    'indoor': true,\n  }},"
-        lines.append(entry)
-    
-    lines.append("];")
-    
-    with open(output_path, 'w') as f:
-        f.write('\n'.join(lines))
+    write = write_dart_columns if columnar else write_dart_list
+    # Keep the input's order: the rules keep whichever entry comes first
+    write(output_path, header, gyms, fields=GYM_FIELDS, constants={'indoor': True}, spatial=False)
 
+@instrument("deduplicate_indoor_gyms")
 def main():
-    input_file = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/indoor_gyms_data.dart'
+    parser = argparse.ArgumentParser(description='Remove duplicate indoor gyms (same name within 100m)')
+    parser.add_argument("--input", default=INDOOR_GYMS_FILE, help="Indoor gyms Dart file to dedupe")
+    parser.add_argument("--output", help="Where to write the result (default: overwrite --input)")
+    parser.add_argument("--force", action="store_true", help="Rerun even if the inputs are unchanged since the last run")
+    args = parser.parse_args()
+    
+    input_file = args.input
+    output_file = args.output or input_file
+    
+    stage = StagedOutputs('deduplicate_indoor_gyms', inputs=[input_file], params={'distance_m': 100})
+    if not args.force and stage.up_to_date([output_file]):
+        print(f"{input_file} is unchanged since the last dedupe run, nothing to do (use --force to rerun)")
+        return
     
     print(f"Parsing indoor gyms data from {input_file}...")
-    gyms = parse_dart_file(input_file)
+    with phase("parse"):
+        gyms = parse_dart_file(input_file)
     print(f"Total indoor gyms: {len(gyms)}")
     
     if len(gyms) == 0:
@@ -133,17 +156,27 @@ def main():
         return 0, 0, 0
     
     print("\nFinding duplicates (same name within 100m)...")
-    indices_to_remove, duplicate_pairs = find_duplicates(gyms)
+    decisions = []
+    with phase("dedupe"):
+        indices_to_remove, duplicate_pairs = find_duplicates(gyms, decisions=decisions)
     print(f"Duplicate pairs found: {duplicate_pairs}")
     print(f"Gyms to remove: {len(indices_to_remove)}")
     
     # Create deduplicated list
     deduped_gyms = [gym for i, gym in enumerate(gyms) if i not in indices_to_remove]
     print(f"Gyms after deduplication: {len(deduped_gyms)}")
-    
-    # Overwrite the original file
-    print(f"\nWriting deduplicated data back to {input_file}...")
-    generate_dart_file(deduped_gyms, input_file)
+    record_counts(records_in=len(gyms), records_out=len(deduped_gyms))
+    
+    # Record every removal so the run can be audited or undone, and replace
+    # the original file only once the new one is completely written
+    print(f"\nWriting deduplicated data to {output_file}...")
+    report_file = default_report_path()
+    with DedupeReport(report_file, 'deduplicate_indoor_gyms', input_file, output_file, {'distance_m': 100}) as report, \
+            stage:
+        for idx2, idx1, dist in decisions:
+            report.add(gyms[idx2], gyms[idx1], 'same_name', distance_m=dist, similarity=1.0, position=idx2)
+        generate_dart_file(deduped_gyms, stage.path(output_file), columnar=is_dart_columns(input_file))
+    print(f"Decision report: {report_file} (run #{report.run_id})")
     print("Done!")
     
     return len(gyms), len(deduped_gyms), len(indices_to_remove)
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Export courts and indoor gyms as Mapbox Vector Tiles in an MBTiles archive.
+
+The app ships the whole dataset as Dart source and JSON. This stage writes
+the same points as z0-z14 vector tiles, one `courts` layer per tile with
+id, name, indoor, category and signature tier, so a map can fetch only the
+tiles it shows from any static file server (or from --serve locally).
+
+  - every court gets a signature score: from the signature builder's CSV
+    when --signatures is given and the OSM id matches, otherwise from the
+    same heuristics applied to the fields the record has
+  - below MAX_ZOOM a tile keeps its TILE_BUDGET best-scoring points, so
+    low zooms show the signature courts rather than a random sample
+  - tiles are MVT 2.1 (protobuf encoded here, no dependency), gzipped,
+    and written in parallel with --workers
+  - each tile's content hash is kept in the archive; a rerun only encodes
+    tiles whose points changed and copies the rest from the last archive
+
+Usage:
+    python export_court_tiles.py
+    python export_court_tiles.py --signatures hooprank_top100_venues.csv --workers 4
+    python export_court_tiles.py --serve 8766   # http://127.0.0.1:8766/{z}/{x}/{y}.pbf
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from comprehensive_dedupe import parse_indoor_gyms
+from json_stream import iter_json_array
+from pipeline_metrics import instrument, phase, record_counts
+from staged_output import STATE_DIR, StagedOutputs
+
+MOBILE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTDOOR_COURTS_FILE = os.path.join(MOBILE_DIR, "assets", "data", "courts_named.json")
+INDOOR_GYMS_FILE = os.path.join(MOBILE_DIR, "lib", "services", "indoor_gyms_data.dart")
+OUTPUT_FILE = os.path.join(STATE_DIR, "court_tiles.mbtiles")
+
+MIN_ZOOM = 0
+MAX_ZOOM = 14
+TILE_EXTENT = 4096
+LAYER_NAME = "courts"
+
+# Points per tile below MAX_ZOOM, best signature score first
+TILE_BUDGET = 1000
+
+TASKS_PER_WORKER = 8
+
+# hooprank_osm_signature_builder's tier() thresholds
+SIGNATURE_TIERS = ((7, "A"), (4, "B"))
+
+GENERIC_NAMES = {"", "basketball court"}
+SCHOOL_CATEGORIES = {"high_school", "middle_school", "school", "college"}
+GYM_CATEGORIES = {"athletic_club", "recreation_center", "gym"}
+
+_OSM_ID_RE = re.compile(r"(\d+)$")
+
+# zoom, x, y (XYZ scheme) -> rows of (id, name, indoor, category, tier, px, py)
+TilePlan = Dict[Tuple[int, int, int], List[Tuple]]
+
+
+def tier(score: int) -> str:
+    for threshold, name in SIGNATURE_TIERS:
+        if score >= threshold:
+            return name
+    return "C"
+
+
+def record_score(record: Dict) -> int:
+    """signature_score() over what a court/gym record keeps of its OSM tags."""
+    score = 0
+    if (record.get("name") or "").strip().lower() not in GENERIC_NAMES:
+        score += 2
+    if record.get("signatureCity"):
+        score += 4
+    if record.get("website"):
+        score += 2
+    if record.get("access") in ("private", "customers", "members"):
+        score -= 1
+    if record.get("category") in SCHOOL_CATEGORIES:
+        score += 2
+    elif record.get("category") in GYM_CATEGORIES:
+        score += 1
+    if record.get("surface"):
+        score += 1
+    if record.get("lit"):
+        score += 1
+    return score
+
+
+def load_signature_scores(path: str) -> Dict[int, int]:
+    """osm_id -> signature_score from a hooprank_osm_signature_builder CSV (best score per id)."""
+    scores: Dict[int, int] = {}
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            if not row.get("osm_id"):
+                continue
+            osm_id, score = int(float(row["osm_id"])), int(float(row.get("signature_score") or 0))
+            scores[osm_id] = max(score, scores.get(osm_id, score))
+    return scores
+
+
+def mercator(lat: float, lng: float) -> Tuple[float, float]:
+    """Web Mercator x, y in [0, 1) (y down)."""
+    lat = min(max(lat, -85.05112878), 85.05112878)
+    sin = math.sin(math.radians(lat))
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+    return min(max(lng / 360 + 0.5, 0.0), 1 - 1e-12), min(max(y, 0.0), 1 - 1e-12)
+
+
+def load_features(outdoor_file: str, indoor_file: str, signatures: Optional[Dict[int, int]]) -> List[Tuple]:
+    """(-score, id, name, indoor, category, tier, x, y) for every point, best first."""
+    features = []
+    records = list(iter_json_array(outdoor_file))
+    if indoor_file:
+        records += [dict(gym, indoor=True) for gym in parse_indoor_gyms(indoor_file)]
+    for record in records:
+        lat, lng = record.get("lat"), record.get("lng")
+        if lat is None or lng is None:
+            continue
+        court_id = str(record.get("id", ""))
+        score = record_score(record)
+        match = _OSM_ID_RE.search(court_id)
+        if signatures is not None and match and int(match.group(1)) in signatures:
+            score = signatures[int(match.group(1))]
+        x, y = mercator(lat, lng)
+        features.append((-score, court_id, record.get("name") or "", bool(record.get("indoor")),
+                         record.get("category") or "", tier(score), x, y))
+    features.sort()
+    return features
+
+
+def plan_tiles(features: List[Tuple]) -> TilePlan:
+    """The rows of every non-empty tile, z0-z14, thinned to TILE_BUDGET below MAX_ZOOM."""
+    plan: TilePlan = {}
+    for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+        scale = 1 << zoom
+        budget = None if zoom == MAX_ZOOM else TILE_BUDGET
+        for _, court_id, name, indoor, category, tier_name, x, y in features:
+            fx, fy = x * scale, y * scale
+            tx, ty = int(fx), int(fy)
+            rows = plan.setdefault((zoom, tx, ty), [])
+            if budget is not None and len(rows) >= budget:
+                continue
+            rows.append((court_id, name, indoor, category, tier_name,
+                         round((fx - tx) * TILE_EXTENT), round((fy - ty) * TILE_EXTENT)))
+    return plan
+
+
+def tile_hash(rows: List[Tuple]) -> str:
+    return hashlib.blake2b(repr(rows).encode("utf-8"), digest_size=16).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# MVT encoding (vector_tile.proto, version 2)
+# ---------------------------------------------------------------------------
+
+def _encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+# Every tag index, zigzagged tile coordinate and most lengths are below 2^14
+_SMALL_VARINTS = [_encode_varint(value) for value in range(1 << 14)]
+
+
+def _varint(value: int) -> bytes:
+    if value < 16384:
+        return _SMALL_VARINTS[value]
+    return _encode_varint(value)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 31)
+
+
+def _message(number: int, payload: bytes) -> bytes:
+    """A length-delimited field (wire type 2)."""
+    return _varint((number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def _uint(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _packed(number: int, values: List[int]) -> bytes:
+    if max(values) < 0x80:
+        return _message(number, bytes(values))
+    return _message(number, b"".join([_varint(v) for v in values]))
+
+
+def encode_tile(rows: List[Tuple]) -> bytes:
+    """One gzipped MVT tile with a point feature per row."""
+    keys = ["id", "name", "indoor", "category", "tier"]
+    values: Dict[Tuple[type, object], int] = {}
+    features = []
+    for row in rows:
+        tags = []
+        for key_index, value in enumerate(row[:5]):
+            if value == "" and keys[key_index] == "category":
+                continue
+            value_index = values.setdefault((type(value), value), len(values))
+            tags += (key_index, value_index)
+        px, py = row[5], row[6]
+        features.append(_message(2,
+                                 _packed(2, tags)
+                                 + _uint(3, 1)  # POINT
+                                 + _packed(4, [9, _zigzag(px), _zigzag(py)])))  # MoveTo(1)
+    value_messages = []
+    for value_type, value in values:
+        if value_type is bool:
+            value_messages.append(_message(4, _uint(7, int(value))))
+        else:
+            value_messages.append(_message(4, _message(1, value.encode("utf-8"))))
+    layer = (_uint(15, 2)
+             + _message(1, LAYER_NAME.encode("utf-8"))
+             + b"".join(features)
+             + b"".join(_message(3, key.encode("utf-8")) for key in keys)
+             + b"".join(value_messages)
+             + _uint(5, TILE_EXTENT))
+    return gzip.compress(_message(3, layer), compresslevel=9, mtime=0)
+
+
+def encode_tiles(batch: List[Tuple[Tuple[int, int, int], List[Tuple]]]) -> List[Tuple[Tuple[int, int, int], bytes]]:
+    return [(tile, encode_tile(rows)) for tile, rows in batch]
+
+
+# ---------------------------------------------------------------------------
+# MBTiles
+# ---------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+CREATE TABLE IF NOT EXISTS tile_hashes (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, hash TEXT,
+                                        PRIMARY KEY (zoom_level, tile_column, tile_row));
+"""
+
+
+def tms_row(zoom: int, y: int) -> int:
+    """MBTiles stores rows bottom-up (TMS)."""
+    return (1 << zoom) - 1 - y
+
+
+def previous_hashes(db: sqlite3.Connection) -> Dict[Tuple[int, int, int], str]:
+    try:
+        rows = db.execute("SELECT zoom_level, tile_column, tile_row, hash FROM tile_hashes").fetchall()
+    except sqlite3.DatabaseError:
+        return {}
+    return {(z, x, tms_row(z, row)): digest for z, x, row, digest in rows}
+
+
+def metadata(features: List[Tuple]) -> Dict[str, str]:
+    lngs = [x * 360 - 180 for *_, x, _ in features] or [0.0]
+    lats = [math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y)))) for *_, y in features] or [0.0]
+    bounds = (min(lngs), min(lats), max(lngs), max(lats))
+    fields = {"id": "String", "name": "String", "indoor": "Boolean", "category": "String", "tier": "String"}
+    return {
+        "name": "HoopRank courts",
+        "format": "pbf",
+        "type": "overlay",
+        "version": "1",
+        "minzoom": str(MIN_ZOOM),
+        "maxzoom": str(MAX_ZOOM),
+        "bounds": ",".join(f"{v:.6f}" for v in bounds),
+        "center": f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{MIN_ZOOM + 4}",
+        "attribution": "© OpenStreetMap contributors (ODbL)",
+        "json": json.dumps({"vector_layers": [{"id": LAYER_NAME, "fields": fields,
+                                               "minzoom": MIN_ZOOM, "maxzoom": MAX_ZOOM}]}, sort_keys=True),
+    }
+
+
+def write_archive(path: str, previous: Optional[str], features: List[Tuple], plan: TilePlan, workers: int):
+    """
+    Write the MBTiles archive for `plan` to `path`, starting from a copy of
+    `previous` (the last archive) so tiles whose hash didn't change are kept.
+    """
+    if previous and os.path.exists(previous):
+        shutil.copyfile(previous, path)
+    elif os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    try:
+        old = previous_hashes(db) if previous else {}
+        db.executescript(SCHEMA)
+        hashes = {tile: tile_hash(rows) for tile, rows in plan.items()}
+        changed = [tile for tile in plan if old.get(tile) != hashes[tile]]
+        removed = [tile for tile in old if tile not in plan]
+        print(f"  {len(plan):,} tiles: {len(changed):,} to encode, {len(plan) - len(changed):,} reused, "
+              f"{len(removed):,} removed")
+
+        if workers > 1:
+            # Round-robin, so the few dense low-zoom tiles land in different tasks
+            tasks = workers * TASKS_PER_WORKER
+            batches = [[(tile, plan[tile]) for tile in changed[i::tasks]] for i in range(tasks)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                encoded = [result for batch in pool.map(encode_tiles, batches) for result in batch]
+        else:
+            encoded = encode_tiles([(tile, plan[tile]) for tile in changed])
+
+        with db:
+            db.executemany("DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                           [(z, x, tms_row(z, y)) for z, x, y in removed])
+            db.executemany("DELETE FROM tile_hashes WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                           [(z, x, tms_row(z, y)) for z, x, y in removed])
+            db.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                           [(z, x, tms_row(z, y), blob) for (z, x, y), blob in sorted(encoded)])
+            db.executemany("INSERT OR REPLACE INTO tile_hashes VALUES (?, ?, ?, ?)",
+                           [(z, x, tms_row(z, y), hashes[(z, x, y)]) for z, x, y in sorted(changed)])
+            db.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", sorted(metadata(features).items()))
+    finally:
+        db.close()
+    return len(changed)
+
+
+def serve(path: str, port: int):
+    """Serve /{z}/{x}/{y}.pbf from the archive, as a static tile host would."""
+    tile_re = re.compile(r"^/(\d+)/(\d+)/(\d+)\.pbf$")
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = tile_re.match(self.path)
+            blob = None
+            if match:
+                z, x, y = (int(v) for v in match.groups())
+                db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                try:
+                    row = db.execute("SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? "
+                                     "AND tile_row = ?", (z, x, tms_row(z, y))).fetchone()
+                finally:
+                    db.close()
+                blob = row[0] if row else None
+            if blob is None:
+                self.send_response(204 if match else 404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.mapbox-vector-tile")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(blob)))
+            self.end_headers()
+            self.wfile.write(blob)
+
+    print(f"Serving {path} at http://127.0.0.1:{port}/{{z}}/{{x}}/{{y}}.pbf")
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+@instrument("export_court_tiles")
+def main():
+    parser = argparse.ArgumentParser(description="Export courts as z0-z14 vector tiles (MBTiles)")
+    parser.add_argument("--outdoor", default=OUTDOOR_COURTS_FILE, help="Final outdoor courts JSON")
+    parser.add_argument("--indoor", default=INDOOR_GYMS_FILE, help="Indoor gyms Dart file ('' to leave out)")
+    parser.add_argument("--signatures", help="Signature builder CSV to take signature scores from")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="MBTiles archive to write")
+    parser.add_argument("--workers", type=int, default=1, help="Processes encoding tiles (0 = one per CPU)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the inputs are unchanged since the last run")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="Serve --output over HTTP instead of building it")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.output, args.serve)
+        return
+
+    inputs = [p for p in (args.outdoor, args.indoor, args.signatures) if p]
+    params = {"max_zoom": MAX_ZOOM, "extent": TILE_EXTENT, "budget": TILE_BUDGET}
+    stage = StagedOutputs("export_court_tiles", inputs=inputs, params=params)
+    if not args.force and stage.up_to_date([args.output]):
+        print("Courts unchanged since the last tile export, nothing to do (use --force to rerun)")
+        return
+
+    print("Loading courts...")
+    with phase("load"):
+        signatures = load_signature_scores(args.signatures) if args.signatures else None
+        features = load_features(args.outdoor, args.indoor, signatures)
+    print(f"  {len(features):,} points")
+
+    with phase("plan"):
+        plan = plan_tiles(features)
+
+    print(f"Writing {args.output}...")
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with phase("encode"), stage:
+        encoded = write_archive(stage.path(args.output), args.output, features, plan,
+                                args.workers or os.cpu_count() or 1)
+    record_counts(records_in=len(features), records_out=encoded)
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,36 @@
 """
 Fetch verified recreation centers for top basketball cities from OpenStreetMap.
 This does targeted queries city by city to avoid API timeouts.
+
+Cities are fetched concurrently (--workers, bounded by the server's free
+query slots) and each city's result is checkpointed under
+.pipeline/city_courts/ as soon as it completes, so a rerun after a failure
+only fetches the cities that are missing. Checkpoints are cleared once the
+combined output has been written. The city list defaults to BASKETBALL_CITIES; use
+--cities-csv or --gazetteer N to scale to hundreds of metros.
+
+Usage:
+    python3 fetch_city_courts.py [--workers 4] [--slim]
+    python3 fetch_city_courts.py --cities-csv metros.csv --radius-km 15
+    python3 fetch_city_courts.py --gazetteer 300 --output city_facilities_top300.json
 """
 
-import requests
+import argparse
+import csv
+import math
+import os
 import json
-import time
+import re
+import sys
+
+from overpass_client import OVERPASS_MIRRORS, csv_setting
+from overpass_scheduler import MirrorScheduler
+from pipeline_metrics import instrument, record_counts
+from spatial_order import spatial_sort
+from staged_output import STATE_DIR, write_json_atomic
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+# Override with HOOPRANK_OVERPASS_URL (e.g. a local mock_osm_server.py)
+OVERPASS_URL = os.environ.get("HOOPRANK_OVERPASS_URL", "https://overpass-api.de/api/interpreter")
 
 # Top basketball cities with their bounding boxes (south, west, north, east)
 BASKETBALL_CITIES = {
@@ -24,12 +47,25 @@ BASKETBALL_CITIES = {
     'Oakland_SF': (37.6879, -122.5300, 37.9298, -122.1142),
 }
 
-def query_city_rec_centers(city_name, bbox):
-    """Query a single city for recreation centers and basketball facilities."""
+# One result file per finished city, for resume
+CHECKPOINT_DIR = os.path.join(STATE_DIR, "city_courts")
+
+# The only columns extract_facility reads, for --slim CSV output
+SLIM_COLUMNS = ('::type', '::id', '::lat', '::lon', 'name', 'sport', 'leisure', 'amenity',
+                'building', 'addr:street')
+
+def query_city_rec_centers(client, city_name, bbox, slim=False):
+    """
+    Query a single city for recreation centers and basketball facilities.
+    Elements are streamed through extract_facility as they are decoded.
+    With slim, only SLIM_COLUMNS come back, as CSV rows for facility_from_row.
+    Raises OverpassError if the city still fails after retries.
+    """
     south, west, north, east = bbox
     
+    output_format = csv_setting(SLIM_COLUMNS) if slim else '[out:json]'
     query = f"""
-    [out:json][timeout:60];
+    {output_format}[timeout:60];
     (
       // Recreation centers
       node["leisure"="sports_centre"](
@@ -72,99 +108,218 @@ def query_city_rec_centers(city_name, bbox):
     """
     
     print(f"Querying {city_name}...")
-    try:
-        response = requests.post(OVERPASS_URL, data={'data': query}, timeout=90)
-        if response.status_code == 200:
-            data = response.json()
-            elements = data.get('elements', [])
-            print(f"  Found {len(elements)} facilities")
-            return elements
-        else:
-            print(f"  Error: HTTP {response.status_code}")
-            return []
-    except Exception as e:
-        print(f"  Error: {e}")
-        return []
+    if slim:
+        facilities, element_count = client.query_csv(
+            query, lambda row: facility_from_row(row, city_name), timeout=90)
+    else:
+        facilities, element_count = client.query_elements(
+            query, lambda elem: extract_facility(elem, city_name), timeout=90)
+    print(f"  Found {element_count} facilities")
+    return facilities
+
+def extract_facility(elem, city_name):
+    """Extract facility info from one Overpass element (None to skip it)."""
+    # Get coordinates
+    if elem['type'] == 'node':
+        lat = elem['lat']
+        lng = elem['lon']
+    elif 'center' in elem:
+        lat = elem['center']['lat']
+        lng = elem['center']['lon']
+    else:
+        return None
+
+    return build_facility(elem['id'], lat, lng, elem.get('tags', {}), city_name)
+
+def facility_from_row(row, city_name):
+    """Same as extract_facility for a --slim CSV row (missing tags are "")."""
+    if not row.get('::lat'):
+        return None
+    return build_facility(row['::id'], float(row['::lat']), float(row['::lon']), row, city_name)
+
+def build_facility(elem_id, lat, lng, tags, city_name):
+    name = tags.get('name', '')
+
+    if not name:
+        return None
+
+    # Determine if indoor
+    sport = tags.get('sport', '')
+    leisure = tags.get('leisure', '')
+    amenity = tags.get('amenity', '')
+    building = tags.get('building', '')
+
+    is_indoor = (
+        building != '' or
+        'gym' in name.lower() or
+        'center' in name.lower() or
+        'centre' in name.lower() or
+        amenity == 'community_centre' or
+        leisure == 'sports_centre'
+    )
+
+    # Determine category
+    if 'ymca' in name.lower() or 'ywca' in name.lower():
+        category = 'athletic_club'
+    elif 'jcc' in name.lower():
+        category = 'recreation_center'
+    elif amenity == 'community_centre':
+        category = 'recreation_center'
+    elif leisure == 'sports_centre':
+        category = 'athletic_club'
+    elif sport == 'basketball':
+        category = 'recreation_center'
+    else:
+        category = 'recreation_center'
+
+    return {
+        'id': f"osm_{city_name.lower()}_{elem_id}",
+        'name': name,
+        'lat': round(lat, 6),
+        'lng': round(lng, 6),
+        'city': city_name,
+        'category': category,
+        'indoor': is_indoor,
+        'address': tags.get('addr:street', ''),
+        'sport': sport,
+    }
 
 def extract_facilities(elements, city_name):
     """Extract facility info from API results."""
-    facilities = []
-    
-    for elem in elements:
-        tags = elem.get('tags', {})
-        name = tags.get('name', '')
-        
-        if not name:
-            continue
-        
-        # Get coordinates
-        if elem['type'] == 'node':
-            lat = elem['lat']
-            lng = elem['lon']
-        elif 'center' in elem:
-            lat = elem['center']['lat']
-            lng = elem['center']['lon']
-        else:
-            continue
-        
-        # Determine if indoor
-        sport = tags.get('sport', '')
-        leisure = tags.get('leisure', '')
-        amenity = tags.get('amenity', '')
-        building = tags.get('building', '')
-        
-        is_indoor = (
-            building != '' or
-            'gym' in name.lower() or
-            'center' in name.lower() or
-            'centre' in name.lower() or
-            amenity == 'community_centre' or
-            leisure == 'sports_centre'
-        )
-        
-        # Determine category
-        if 'ymca' in name.lower() or 'ywca' in name.lower():
-            category = 'athletic_club'
-        elif 'jcc' in name.lower():
-            category = 'recreation_center'
-        elif amenity == 'community_centre':
-            category = 'recreation_center'
-        elif leisure == 'sports_centre':
-            category = 'athletic_club'
-        elif sport == 'basketball':
-            category = 'recreation_center'
-        else:
-            category = 'recreation_center'
-        
-        facilities.append({
-            'id': f"osm_{city_name.lower()}_{elem['id']}",
-            'name': name,
-            'lat': round(lat, 6),
-            'lng': round(lng, 6),
-            'city': city_name,
-            'category': category,
-            'indoor': is_indoor,
-            'address': tags.get('addr:street', ''),
-            'sport': sport,
-        })
-    
-    return facilities
+    return [f for f in (extract_facility(elem, city_name) for elem in elements) if f]
+
+def bbox_around(lat, lon, radius_km):
+    """(south, west, north, east) of a square radius_km around a city center."""
+    dlat = radius_km / 111.0
+    dlon = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+    return (round(lat - dlat, 4), round(lon - dlon, 4), round(lat + dlat, 4), round(lon + dlon, 4))
+
+def city_label(city, state=''):
+    """City key in the style of BASKETBALL_CITIES, e.g. 'San_Antonio_TX'."""
+    label = f"{city} {state}".strip() if state else city
+    return re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')
+
+def load_cities_csv(path, radius_km):
+    """
+    City list from a CSV with a `city` column (optional `state`) and either
+    south,west,north,east or lat,lon (boxed with radius_km).
+    """
+    cities = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            name = city_label(row['city'], row.get('state', ''))
+            if row.get('south'):
+                cities[name] = tuple(float(row[k]) for k in ('south', 'west', 'north', 'east'))
+            else:
+                cities[name] = bbox_around(float(row['lat']), float(row['lon']), radius_km)
+    return cities
+
+def load_gazetteer_cities(max_cities, radius_km):
+    """Top max_cities US places by population from the Census Gazetteer."""
+    # Needs pandas; only imported when this option is used
+    from hooprank_osm_signature_builder import load_top_cities_from_census_gazetteer
+    df = load_top_cities_from_census_gazetteer(max_cities=max_cities)
+    return {city_label(row.city, row.state): bbox_around(row.lat, row.lon, radius_km)
+            for row in df.itertuples()}
 
+def checkpoint_path(city_name):
+    return os.path.join(CHECKPOINT_DIR, f"{city_name}.json")
+
+def load_checkpoint(city_name, bbox):
+    """A finished city's facilities, or None if it has no checkpoint for this bbox."""
+    try:
+        with open(checkpoint_path(city_name)) as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if checkpoint.get('bbox') != list(bbox):
+        return None
+    return checkpoint['facilities']
+
+def save_checkpoint(city_name, bbox, facilities):
+    write_json_atomic(checkpoint_path(city_name), {
+        'city': city_name,
+        'bbox': list(bbox),
+        'facilities': facilities,
+    })
+
+@instrument("fetch_city_courts")
 def main():
-    print("=== Fetching Basketball Facilities for Top Cities ===\n")
+    global OVERPASS_URL
+    parser = argparse.ArgumentParser(description="Fetch basketball facilities for top cities from OSM")
+    parser.add_argument('--output', default='city_facilities.json', help="Output JSON path")
+    parser.add_argument('--overpass-url', default=OVERPASS_URL,
+                        help="Overpass API endpoint (default: $HOOPRANK_OVERPASS_URL or overpass-api.de)")
+    parser.add_argument('--allow-partial', action='store_true',
+                        help="Write output even if some cities failed after retries")
+    parser.add_argument('--slim', action='store_true',
+                        help="Request only the columns this stage uses (CSV output) to cut transfer size")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Max cities in flight per Overpass endpoint (default: 4)")
+    parser.add_argument('--mirrors', action='store_true',
+                        help="Spread cities over all Overpass mirrors by free slots")
+    parser.add_argument('--cities-csv', default='',
+                        help="CSV of cities: city[,state] and south,west,north,east or lat,lon")
+    parser.add_argument('--gazetteer', type=int, default=0,
+                        help="Use the top N US places from the Census Gazetteer (needs pandas)")
+    parser.add_argument('--radius-km', type=float, default=15.0,
+                        help="Box half-width around lat,lon city centers (default: 15km)")
+    parser.add_argument('--fresh', action='store_true',
+                        help="Ignore per-city checkpoints and refetch every city")
+    args = parser.parse_args()
+    OVERPASS_URL = args.overpass_url
+    
+    if args.cities_csv:
+        cities = load_cities_csv(args.cities_csv, args.radius_km)
+    elif args.gazetteer:
+        cities = load_gazetteer_cities(args.gazetteer, args.radius_km)
+    else:
+        cities = BASKETBALL_CITIES
+    
+    print(f"=== Fetching Basketball Facilities for {len(cities)} Cities ===\n")
+    
+    # Resume: cities with a checkpoint for the same bbox are not refetched
+    results = {}
+    if not args.fresh:
+        for city_name, bbox in cities.items():
+            facilities = load_checkpoint(city_name, bbox)
+            if facilities is not None:
+                results[city_name] = facilities
+        if results:
+            print(f"Resuming: {len(results)} cities already fetched, {len(cities) - len(results)} to go\n")
+    
+    def fetch_city(client, city_name):
+        bbox = cities[city_name]
+        facilities = query_city_rec_centers(client, city_name, bbox, args.slim)
+        save_checkpoint(city_name, bbox, facilities)
+        return facilities
+    
+    # Cities run concurrently, as many per endpoint as it has free slots (up to --workers)
+    pending = [city_name for city_name in cities if city_name not in results]
+    scheduler = MirrorScheduler(OVERPASS_MIRRORS if args.mirrors else [OVERPASS_URL], max_slots=args.workers)
+    fetched, failed = scheduler.run_units('fetch_city_courts', pending, fetch_city)
+    results.update(fetched)
+    if failed and not args.allow_partial:
+        print(f"\n❌ {len(failed)} cities failed: {', '.join(unit for unit, _ in failed)}")
+        print("Not writing partial output; finished cities are checkpointed, rerun to fetch the rest")
+        sys.exit(1)
     
     all_facilities = {}
     
-    for city_name, bbox in BASKETBALL_CITIES.items():
-        elements = query_city_rec_centers(city_name, bbox)
-        facilities = extract_facilities(elements, city_name)
-        all_facilities[city_name] = facilities
-        time.sleep(3)  # Be nice to the API
+    for city_name in cities:
+        if city_name in results:
+            all_facilities[city_name] = spatial_sort(results[city_name])
     
     # Save results
-    with open('city_facilities.json', 'w') as f:
+    with open(args.output, 'w') as f:
         json.dump(all_facilities, f, indent=2)
     
+    # Checkpoints only bridge interrupted runs; the next full run fetches fresh data
+    if not failed:
+        for city_name in cities:
+            if os.path.exists(checkpoint_path(city_name)):
+                os.remove(checkpoint_path(city_name))
+    
     print("\n=== Summary ===")
     total = 0
     for city, facilities in all_facilities.items():
@@ -173,11 +328,12 @@ def main():
         print(f"{city}: {len(facilities)} facilities ({indoor_count} indoor)")
     
     print(f"\nTotal: {total} facilities")
-    print("Saved to city_facilities.json")
+    record_counts(records_out=total)
+    print(f"Saved to {args.output}")
     
-    # Print sample for each city
+    # Print sample for the first few cities
     print("\n=== Sample Facilities ===")
-    for city, facilities in all_facilities.items():
+    for city, facilities in list(all_facilities.items())[:10]:
         print(f"\n{city}:")
         for f in facilities[:5]:
             indoor_str = "INDOOR" if f['indoor'] else "outdoor"
@@ -9,20 +9,28 @@ This script queries OSM for:
 - Recreation centers and community centers with basketball
 
 Usage:
-    python3 fetch_indoor_gyms.py [--region REGION] [--output OUTPUT]
+    python3 fetch_indoor_gyms.py [--region REGION] [--output OUTPUT] [--union [--tile-deg DEG]]
 
 Options:
     --region    Geographic region (default: "usa" for continental US)
     --output    Output file path (default: indoor_gyms_data.dart)
+    --union     One query per tile for all venue types instead of one per type
 """
 
 import argparse
 import json
-import requests
-import time
+import os
+import sys
 from typing import List, Dict, Optional
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+from dart_emitter import write_dart_columns, write_dart_list
+from overpass_client import OVERPASS_MIRRORS, OverpassClient, OverpassError, run_units
+from overpass_scheduler import MirrorScheduler
+from pipeline_metrics import instrument, record_counts
+from spatial_order import spatial_sort
+
+# Override with HOOPRANK_OVERPASS_URL (e.g. a local mock_osm_server.py)
+OVERPASS_URL = os.environ.get("HOOPRANK_OVERPASS_URL", "https://overpass-api.de/api/interpreter")
 
 # Bounding boxes for different regions
 REGIONS = {
@@ -32,6 +40,9 @@ REGIONS = {
     "world": None,  # No bounds - worldwide
 }
 
+# Overpass prints nodes, then ways, then relations, each sorted by id
+ELEMENT_ORDER = {"node": 0, "way": 1, "relation": 2}
+
 # Categories to search
 VENUE_TYPES = [
     # Schools with potential gyms
@@ -76,38 +87,98 @@ out center {limit};
     return query
 
 
-def fetch_venues_batch(region: str, venue_type: tuple) -> List[Dict]:
-    """Fetch venues of a specific type from OSM Overpass API."""
+def build_union_query(bbox: tuple = None, venue_types: List[tuple] = VENUE_TYPES) -> str:
+    """Build one Overpass QL query matching every venue type at once."""
+    bbox_str = "({},{},{},{})".format(*bbox) if bbox else ""
+    
+    # One regex filter per key instead of one statement per key=value
+    values_by_key: Dict[str, List[str]] = {}
+    for key, value in venue_types:
+        values_by_key.setdefault(key, []).append(value)
+    
+    statements = "".join(
+        f'  nwr["{key}"~"^({"|".join(values)})$"]{bbox_str};\n'
+        for key, values in values_by_key.items()
+    )
+    return f"""
+[out:json][timeout:300];
+(
+{statements});
+out center;
+"""
+
+
+def tile_bboxes(bbox: tuple, tile_deg: float) -> List[Optional[tuple]]:
+    """Split a (south, west, north, east) bbox into tiles of about tile_deg degrees."""
+    if not bbox or not tile_deg:
+        return [bbox]
+    south, west, north, east = bbox
+    tiles = []
+    lat = south
+    while lat < north:
+        lng = west
+        while lng < east:
+            tiles.append((round(lat, 6), round(lng, 6),
+                          round(min(lat + tile_deg, north), 6), round(min(lng + tile_deg, east), 6)))
+            lng += tile_deg
+        lat += tile_deg
+    return tiles
+
+
+def fetch_venues_batch(client: OverpassClient, region: str, venue_type: tuple) -> List[Dict]:
+    """Fetch venues of a specific type from OSM Overpass API. Raises OverpassError on failure."""
     bbox = REGIONS.get(region)
     query = build_overpass_query(bbox, venue_type, limit=10000)
     
     key, value = venue_type
     print(f"  Fetching {key}={value}...")
     
-    try:
-        response = requests.post(
-            OVERPASS_URL,
-            data={"data": query},
-            timeout=600
-        )
-        response.raise_for_status()
-        data = response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"    Error: {e}")
-        return []
-    
-    venues = []
-    elements = data.get("elements", [])
-    print(f"    Found {len(elements)} raw elements")
-    
-    for element in elements:
-        venue = process_element(element, key, value)
-        if venue:
-            venues.append(venue)
+    venues, element_count = client.query_elements(
+        query, lambda element: process_element(element, key, value), timeout=600)
+    print(f"    Found {element_count} raw elements")
     
     return venues
 
 
+def fetch_tile_union(client: OverpassClient, bbox: Optional[tuple]) -> Dict[tuple, List[tuple]]:
+    """
+    Fetch every venue type in a tile with one union query. Returns
+    {venue_type: [(element type, element id, venue)]} so tiles can be merged
+    back into Overpass output order. Raises OverpassError on failure.
+    """
+    print(f"  Fetching all venue types in {bbox or 'world'}...")
+    def transform(element: Dict) -> Optional[tuple]:
+        matched = classify_union_element(element)
+        if matched:
+            order = (ELEMENT_ORDER.get(element.get("type"), 3), element.get("id"))
+            return matched + (order,)
+        return None
+    
+    matches, element_count = client.query_elements(build_union_query(bbox), transform, timeout=600)
+    print(f"    Found {element_count} raw elements")
+    
+    batches: Dict[tuple, List[tuple]] = {}
+    for venue_type, venue, order in matches:
+        batches.setdefault(venue_type, []).append((order, venue))
+    return batches
+
+
+def classify_union_element(element: Dict) -> Optional[tuple]:
+    """
+    Assign a union-query element to a venue type the way the per-type
+    queries did: the first VENUE_TYPES entry whose tag it carries and for
+    which process_element keeps it. Returns (venue_type, venue) or None.
+    """
+    tags = element.get("tags", {})
+    for key, value in VENUE_TYPES:
+        if tags.get(key) != value:
+            continue
+        venue = process_element(element, key, value)
+        if venue:
+            return (key, value), venue
+    return None
+
+
 def process_element(element: Dict, key: str, value: str) -> Optional[Dict]:
     """Process a single OSM element into a venue dict."""
     # Get coordinates
@@ -184,25 +255,61 @@ def process_element(element: Dict, key: str, value: str) -> Optional[Dict]:
     }
 
 
-def fetch_all_venues(region: str = "usa") -> List[Dict]:
-    """Fetch all venue types and deduplicate."""
+def fetch_all_venues(region: str = "usa", client: Optional[OverpassClient] = None,
+                     allow_partial: bool = False, mirrors: Optional[List[str]] = None,
+                     union: bool = False, tile_deg: float = 0) -> List[Dict]:
+    """
+    Fetch all venue types and deduplicate. Units (venue types, or tiles with
+    `union`) that still fail after the retry pass are recorded in
+    .pipeline/failed_units/ and raise OverpassError unless allow_partial is
+    set. With `mirrors`, units are queued across those Overpass mirrors
+    instead of run one by one.
+    """
     print(f"\nFetching indoor basketball venues for region: {region}")
     print(f"Bounding box: {REGIONS.get(region)}\n")
     
+    if union:
+        # One query per tile for all venue types, split by type client-side
+        units = tile_bboxes(REGIONS.get(region), tile_deg)
+        fetch = fetch_tile_union
+        label = lambda bbox: ",".join(map(str, bbox)) if bbox else "world"
+    else:
+        units = VENUE_TYPES
+        fetch = lambda unit_client, venue_type: fetch_venues_batch(unit_client, region, venue_type)
+        label = lambda venue_type: "=".join(venue_type)
+    
+    if mirrors:
+        fetched, failed = MirrorScheduler(mirrors).run_units("fetch_indoor_gyms", units, fetch, label=label)
+    else:
+        client = client or OverpassClient(OVERPASS_URL)
+        fetched, failed = run_units("fetch_indoor_gyms", units, lambda unit: fetch(client, unit), label=label)
+    if failed and not allow_partial:
+        raise OverpassError(f"{len(failed)} unit(s) failed: {', '.join(unit for unit, _ in failed)}")
+    
+    if union:
+        # Restore the order a single per-type query would have returned, so
+        # id collisions below resolve the same way; ways spanning tiles appear
+        # once per tile and collapse here
+        batches: Dict[tuple, List[Dict]] = {}
+        for venue_type in VENUE_TYPES:
+            merged = {}
+            for unit in units:
+                for order, venue in fetched.get(unit, {}).get(venue_type, []):
+                    merged.setdefault(order, venue)
+            batches[venue_type] = [merged[order] for order in sorted(merged)]
+    else:
+        batches = fetched
+    
     all_venues = []
     seen_ids = set()
     
+    # Merge in VENUE_TYPES order so dedupe keeps the same first occurrence
     for venue_type in VENUE_TYPES:
-        venues = fetch_venues_batch(region, venue_type)
-        
         # Deduplicate by ID
-        for venue in venues:
+        for venue in batches.get(venue_type, []):
             if venue["id"] not in seen_ids:
                 seen_ids.add(venue["id"])
                 all_venues.append(venue)
-        
-        # Rate limiting - be nice to the API
-        time.sleep(2)
     
     print(f"\nTotal unique venues: {len(all_venues)}")
     
@@ -216,45 +323,33 @@ def fetch_all_venues(region: str = "usa") -> List[Dict]:
     for cat, count in sorted(categories.items()):
         print(f"  {cat}: {count}")
     
+    # osm_type is the tag that matched, also for union queries
+    matched_tags = {}
+    for venue in all_venues:
+        matched_tags[venue["osm_type"]] = matched_tags.get(venue["osm_type"], 0) + 1
+    
+    print("\nBy matched tag:")
+    for tag, count in sorted(matched_tags.items()):
+        print(f"  {tag}: {count}")
+    
     return all_venues
 
 
-def generate_dart_file(venues: List[Dict], output_path: str):
-    """Generate Dart file with venue data."""
-    dart_content = '''// AUTO-GENERATED FILE - DO NOT EDIT MANUALLY
-// Generated from OpenStreetMap data
-// Attribution: © OpenStreetMap contributors (ODbL)
-// Contains: Indoor basketball venues (schools, athletic clubs, rec centers)
-
-/// Indoor basketball venue data from OpenStreetMap
-final List<Map<String, dynamic>> indoorGymsData = [
-'''
-    
-    for venue in venues:
-        dart_content += f'''  {{
-    'id': '{venue["id"]}',
-    'name': {repr(venue["name"])},
-    'lat': {venue["lat"]},
-    'lng': {venue["lng"]},
-    'category': '{venue["category"]}',
-    'indoor': true,
-'''
-        if venue.get("address"):
-            dart_content += f"    'address': {repr(venue['address'])},\n"
-        if venue.get("city"):
-            dart_content += f"    'city': {repr(venue['city'])},\n"
-        if venue.get("state"):
-            dart_content += f"    'state': {repr(venue['state'])},\n"
-        if venue.get("website"):
-            dart_content += f"    'website': {repr(venue['website'])},\n"
-        if venue.get("phone"):
-            dart_content += f"    'phone': {repr(venue['phone'])},\n"
-        dart_content += "  },\n"
-    
-    dart_content += "];\n"
-    
-    with open(output_path, "w") as f:
-        f.write(dart_content)
+def generate_dart_file(venues: List[Dict], output_path: str, columnar: bool = False):
+    """Generate Dart file with venue data (typed columns if columnar)."""
+    header = [
+        "// AUTO-GENERATED FILE - DO NOT EDIT MANUALLY",
+        "// Generated from OpenStreetMap data",
+        "// Attribution: © OpenStreetMap contributors (ODbL)",
+        "// Contains: Indoor basketball venues (schools, athletic clubs, rec centers)",
+        "",
+        "/// Indoor basketball venue data from OpenStreetMap",
+        "final List<Map<String, dynamic>> indoorGymsData = [",
+    ]
+    write = write_dart_columns if columnar else write_dart_list
+    write(output_path, header, venues,
+          fields=("id", "name", "lat", "lng", "category"), constants={"indoor": True},
+          optional_fields=("address", "city", "state", "website", "phone"))
     
     print(f"\nGenerated {output_path} with {len(venues)} venues")
 
@@ -263,11 +358,13 @@ def generate_json_file(venues: List[Dict], output_path: str):
     """Generate JSON file for inspection/backup."""
     json_path = output_path.replace('.dart', '.json')
     with open(json_path, "w") as f:
-        json.dump(venues, f, indent=2)
+        json.dump(spatial_sort(venues), f, indent=2)
     print(f"Generated {json_path} for backup")
 
 
+@instrument("fetch_indoor_gyms")
 def main():
+    global OVERPASS_URL
     parser = argparse.ArgumentParser(description="Fetch indoor basketball venues from OSM")
     parser.add_argument(
         "--region",
@@ -280,12 +377,51 @@ def main():
         default="../lib/services/indoor_gyms_data.dart",
         help="Output Dart file path"
     )
+    parser.add_argument(
+        "--overpass-url",
+        default=OVERPASS_URL,
+        help="Overpass API endpoint (default: $HOOPRANK_OVERPASS_URL or overpass-api.de)"
+    )
+    parser.add_argument(
+        "--allow-partial",
+        action="store_true",
+        help="Write output even if some venue types failed after retries"
+    )
+    parser.add_argument(
+        "--mirrors",
+        action="store_true",
+        help="Spread venue-type queries over all Overpass mirrors by free slots"
+    )
+    parser.add_argument(
+        "--union",
+        action="store_true",
+        help="Fetch all venue types with one union query per tile instead of one query per type"
+    )
+    parser.add_argument(
+        "--tile-deg",
+        type=float,
+        default=0,
+        help="With --union, split the region into tiles of this many degrees (default: one tile)"
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Write typed column arrays behind a list view instead of one map literal per venue"
+    )
     args = parser.parse_args()
+    OVERPASS_URL = args.overpass_url
     
-    venues = fetch_all_venues(args.region)
+    try:
+        venues = fetch_all_venues(args.region, OverpassClient(OVERPASS_URL), args.allow_partial,
+                                  mirrors=OVERPASS_MIRRORS if args.mirrors else None,
+                                  union=args.union, tile_deg=args.tile_deg)
+    except OverpassError as e:
+        print(f"❌ {e}; not writing partial output (rerun, or pass --allow-partial)")
+        sys.exit(1)
+    record_counts(records_out=len(venues))
     
     if venues:
-        generate_dart_file(venues, args.output)
+        generate_dart_file(venues, args.output, columnar=args.columnar)
         generate_json_file(venues, args.output)
         print(f"\n✅ Success! Fetched {len(venues)} indoor venues for {args.region}")
     else:
@@ -16,11 +16,16 @@ Options:
 
 import argparse
 import json
-import requests
-import time
-from typing import List, Dict
+import os
+import sys
+from typing import List, Dict, Optional
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+from dart_emitter import write_dart_columns, write_dart_list
+from overpass_client import OverpassClient, OverpassError
+from pipeline_metrics import instrument, record_counts
+
+# Override with HOOPRANK_OVERPASS_URL (e.g. a local mock_osm_server.py)
+OVERPASS_URL = os.environ.get("HOOPRANK_OVERPASS_URL", "https://overpass-api.de/api/interpreter")
 
 # Bounding boxes for different regions
 REGIONS = {
@@ -52,8 +57,8 @@ out center {limit};
     return query
 
 
-def fetch_courts(region: str = "bay_area") -> List[Dict]:
-    """Fetch basketball courts from OSM Overpass API."""
+def fetch_courts(region: str = "bay_area", client: Optional[OverpassClient] = None) -> List[Dict]:
+    """Fetch basketball courts from OSM Overpass API. Raises OverpassError on failure."""
     bbox = REGIONS.get(region)
     query = build_overpass_query(bbox, limit=50000 if region == "usa" else 10000)
     
@@ -61,119 +66,97 @@ def fetch_courts(region: str = "bay_area") -> List[Dict]:
     print(f"Bounding box: {bbox}")
     print(f"Query:\n{query}\n")
     
-    try:
-        response = requests.post(
-            OVERPASS_URL,
-            data={"data": query},
-            timeout=600  # 10 minute timeout for large queries
-        )
-        response.raise_for_status()
-        data = response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching data: {e}")
-        return []
-    
-    courts = []
-    elements = data.get("elements", [])
-    print(f"Found {len(elements)} elements")
-    
-    for element in elements:
-        # Get coordinates (nodes have lat/lon directly, ways/relations have center)
-        if element.get("type") == "node":
-            lat = element.get("lat")
-            lng = element.get("lon")
-        else:
-            center = element.get("center", {})
-            lat = center.get("lat")
-            lng = center.get("lon")
-        
-        if lat is None or lng is None:
-            continue
-        
-        tags = element.get("tags", {})
-        
-        # Build court name from tags
-        name = tags.get("name")
-        if not name:
-            # Try to build a name from related tags
-            leisure_name = tags.get("leisure:name")
-            sport_name = tags.get("sport:name")
-            operator = tags.get("operator")
-            
-            if leisure_name:
-                name = leisure_name
-            elif sport_name:
-                name = sport_name
-            elif operator:
-                name = f"{operator} Court"
-            else:
-                name = "Basketball Court"
-        
-        # Get address info if available
-        address_parts = []
-        if tags.get("addr:housenumber"):
-            address_parts.append(tags.get("addr:housenumber"))
-        if tags.get("addr:street"):
-            address_parts.append(tags.get("addr:street"))
-        if tags.get("addr:city"):
-            address_parts.append(tags.get("addr:city"))
-        
-        address = ", ".join(address_parts) if address_parts else None
-        
-        # Use city from tags or leave as None
-        city = tags.get("addr:city")
-        
-        court = {
-            "id": f"osm_{element.get('id')}",
-            "name": name,
-            "lat": lat,
-            "lng": lng,
-            "address": address,
-            "city": city,
-            "surface": tags.get("surface"),
-            "access": tags.get("access"),
-            "lit": tags.get("lit") == "yes",
-            "indoor": tags.get("indoor") == "yes",
-        }
-        courts.append(court)
+    # Elements are streamed and converted one by one; the raw response
+    # (hundreds of MB for the USA) is never held in memory
+    client = client or OverpassClient(OVERPASS_URL)
+    courts, element_count = client.query_elements(query, element_to_court, timeout=600)  # 10 minute timeout
+    print(f"Found {element_count} elements")
     
     print(f"Processed {len(courts)} courts with valid coordinates")
     return courts
 
 
-def generate_dart_file(courts: List[Dict], output_path: str):
-    """Generate Dart file with court data."""
-    dart_content = '''// AUTO-GENERATED FILE - DO NOT EDIT MANUALLY
-// Generated from OpenStreetMap data
-// Attribution: © OpenStreetMap contributors (ODbL)
-
-/// Basketball court data from OpenStreetMap
-/// Tag: leisure=pitch + sport=basketball
-final List<Map<String, dynamic>> mockCourtsData = [
-'''
+def element_to_court(element: Dict) -> Optional[Dict]:
+    """Convert one Overpass element into a court dict (None without coordinates)."""
+    # Get coordinates (nodes have lat/lon directly, ways/relations have center)
+    if element.get("type") == "node":
+        lat = element.get("lat")
+        lng = element.get("lon")
+    else:
+        center = element.get("center", {})
+        lat = center.get("lat")
+        lng = center.get("lon")
+    
+    if lat is None or lng is None:
+        return None
+    
+    tags = element.get("tags", {})
+    
+    # Build court name from tags
+    name = tags.get("name")
+    if not name:
+        # Try to build a name from related tags
+        leisure_name = tags.get("leisure:name")
+        sport_name = tags.get("sport:name")
+        operator = tags.get("operator")
+        
+        if leisure_name:
+            name = leisure_name
+        elif sport_name:
+            name = sport_name
+        elif operator:
+            name = f"{operator} Court"
+        else:
+            name = "Basketball Court"
+    
+    # Get address info if available
+    address_parts = []
+    if tags.get("addr:housenumber"):
+        address_parts.append(tags.get("addr:housenumber"))
+    if tags.get("addr:street"):
+        address_parts.append(tags.get("addr:street"))
+    if tags.get("addr:city"):
+        address_parts.append(tags.get("addr:city"))
     
-    for court in courts:
-        dart_content += f'''  {{
-    'id': '{court["id"]}',
-    'name': {repr(court["name"])},
-    'lat': {court["lat"]},
-    'lng': {court["lng"]},
-'''
-        if court.get("address"):
-            dart_content += f"    'address': {repr(court['address'])},\n"
-        if court.get("city"):
-            dart_content += f"    'city': {repr(court['city'])},\n"
-        dart_content += "  },\n"
+    address = ", ".join(address_parts) if address_parts else None
     
-    dart_content += "];\n"
+    # Use city from tags or leave as None
+    city = tags.get("addr:city")
     
-    with open(output_path, "w") as f:
-        f.write(dart_content)
+    return {
+        "id": f"osm_{element.get('id')}",
+        "name": name,
+        "lat": lat,
+        "lng": lng,
+        "address": address,
+        "city": city,
+        "surface": tags.get("surface"),
+        "access": tags.get("access"),
+        "lit": tags.get("lit") == "yes",
+        "indoor": tags.get("indoor") == "yes",
+    }
+
+
+def generate_dart_file(courts: List[Dict], output_path: str, columnar: bool = False):
+    """Generate Dart file with court data (typed columns if columnar)."""
+    header = [
+        "// AUTO-GENERATED FILE - DO NOT EDIT MANUALLY",
+        "// Generated from OpenStreetMap data",
+        "// Attribution: © OpenStreetMap contributors (ODbL)",
+        "",
+        "/// Basketball court data from OpenStreetMap",
+        "/// Tag: leisure=pitch + sport=basketball",
+        "final List<Map<String, dynamic>> mockCourtsData = [",
+    ]
+    write = write_dart_columns if columnar else write_dart_list
+    write(output_path, header, courts, fields=("id", "name", "lat", "lng"), optional_fields=("address", "city"))
     
     print(f"Generated {output_path} with {len(courts)} courts")
 
 
+@instrument("fetch_osm_courts")
 def main():
+    global OVERPASS_URL
     parser = argparse.ArgumentParser(description="Fetch basketball courts from OSM")
     parser.add_argument(
         "--region",
@@ -186,12 +169,28 @@ def main():
         default="lib/services/mock_courts_data.dart",
         help="Output Dart file path"
     )
+    parser.add_argument(
+        "--overpass-url",
+        default=OVERPASS_URL,
+        help="Overpass API endpoint (default: $HOOPRANK_OVERPASS_URL or overpass-api.de)"
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Write typed column arrays behind a list view instead of one map literal per court"
+    )
     args = parser.parse_args()
+    OVERPASS_URL = args.overpass_url
     
-    courts = fetch_courts(args.region)
+    try:
+        courts = fetch_courts(args.region, OverpassClient(OVERPASS_URL))
+    except OverpassError as e:
+        print(f"Error fetching data: {e}")
+        sys.exit(1)
+    record_counts(records_out=len(courts))
     
     if courts:
-        generate_dart_file(courts, args.output)
+        generate_dart_file(courts, args.output, columnar=args.columnar)
         print(f"\nSuccess! Fetched {len(courts)} courts for {args.region}")
     else:
         print("No courts found or error occurred")
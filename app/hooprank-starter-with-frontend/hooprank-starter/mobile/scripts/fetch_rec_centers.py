@@ -8,29 +8,36 @@ This queries for:
 - Buildings tagged as recreation centers
 """
 
-import requests
+import argparse
+import os
 import json
-import time
-
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
-
-# Query for recreation centers in the US that might have basketball
-# We query in chunks by region to avoid timeout
-REGIONS = {
-    'california_north': (36.0, -125.0, 42.0, -119.0),
-    'california_south': (32.0, -121.0, 36.0, -114.0),
-    'pacific_nw': (42.0, -125.0, 49.0, -116.0),
-    'mountain': (31.0, -117.0, 49.0, -102.0),
-    'texas': (25.0, -107.0, 37.0, -93.0),
-    'midwest_north': (40.0, -97.0, 49.0, -82.0),
-    'midwest_south': (33.0, -97.0, 40.0, -82.0),
-    'southeast': (24.0, -92.0, 37.0, -75.0),
-    'northeast': (37.0, -82.0, 45.0, -66.0),
-    'new_england': (40.0, -74.0, 47.5, -66.0),
-}
-
-def query_rec_centers(bbox, region_name):
-    """Query Overpass API for recreation centers with potential basketball facilities."""
+import sys
+
+from overpass_client import OVERPASS_MIRRORS, OverpassClient, csv_setting, run_units
+from overpass_scheduler import MirrorScheduler
+from pipeline_metrics import instrument, record_counts
+from region_partition import (DensityGrid, build_plan, leaf_owns, load_plan, record_leaf_counts,
+                              save_plan)
+from spatial_order import spatial_sort
+from staged_output import STATE_DIR
+
+# Override with HOOPRANK_OVERPASS_URL (e.g. a local mock_osm_server.py)
+OVERPASS_URL = os.environ.get("HOOPRANK_OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+
+# Continental US; split into non-overlapping quadtree leaves (see region_partition)
+BOUNDS = (24.0, -125.0, 49.5, -66.0)
+
+# Elements a single leaf query should return at most
+MAX_PER_LEAF = 4000
+
+PLAN_DIR = os.path.join(STATE_DIR, "rec_centers")
+PLAN_PATH = os.path.join(PLAN_DIR, "plan.json")
+DENSITY_PATH = os.path.join(PLAN_DIR, "density.json")
+
+# The only columns this stage reads, for --slim CSV output
+SLIM_COLUMNS = ('::type', '::id', '::lat', '::lon', 'name', 'sport')
+
+def build_rec_centers_query(bbox, output_format='[out:json]', out='out center;'):
     south, west, north, east = bbox
     
     # This query finds:
@@ -38,8 +45,8 @@ def query_rec_centers(bbox, region_name):
     # 2. Community centres
     # 3. Recreation grounds with buildings
     # 4. Any place tagged with recreation_center
-    query = f"""
-    [out:json][timeout:120];
+    return f"""
+    {output_format}[timeout:120];
     (
       // Sports centres
       way["leisure"="sports_centre"]["sport"~"basketball|multi"](
@@ -78,70 +85,175 @@ def query_rec_centers(bbox, region_name):
         {south},{west},{north},{east}
       );
     );
-    out center;
+    {out}
+    """
+
+def query_rec_centers(client, bbox, region_name, slim=False, keep=None):
+    """
+    Query Overpass API for recreation centers with potential basketball facilities.
+    Elements are streamed through extract_rec_center as they are decoded.
+    With slim, only SLIM_COLUMNS come back, as CSV rows for rec_center_from_row.
+    keep(lat, lng) can drop elements before they are built.
+    Raises OverpassError if the region still fails after retries.
     """
+    output_format = csv_setting(SLIM_COLUMNS) if slim else '[out:json]'
+    query = build_rec_centers_query(bbox, output_format)
     
     print(f"  Querying {region_name}...")
-    try:
-        response = requests.post(OVERPASS_URL, data={'data': query}, timeout=180)
-        if response.status_code == 200:
-            data = response.json()
-            elements = data.get('elements', [])
-            print(f"    Found {len(elements)} potential rec centers")
-            return elements
-        else:
-            print(f"    Error: HTTP {response.status_code}")
-            return []
-    except Exception as e:
-        print(f"    Error: {e}")
-        return []
+    if slim:
+        centers, element_count = client.query_csv(query, lambda row: rec_center_from_row(row, keep), timeout=180)
+    else:
+        centers, element_count = client.query_elements(query, lambda elem: extract_rec_center(elem, keep), timeout=180)
+    print(f"    Found {element_count} potential rec centers")
+    return centers
+
+def count_rec_centers(client, bbox):
+    """Number of elements the rec center query would return for bbox (Overpass `out count`)."""
+    data = client.query(build_rec_centers_query(bbox, '[out:json][timeout:60]', 'out count;'), timeout=120)
+    for elem in data.get('elements', []):
+        if elem.get('type') == 'count':
+            return int(elem['tags']['total'])
+    return 0
+
+def query_leaf(client, leaf, slim=False):
+    """
+    Query one plan leaf. Elements outside the leaf's half-open bbox (on an
+    edge, or ways that only reach into it) belong to a neighbouring leaf and
+    are dropped. Returns (centers, density grid, elements returned).
+    """
+    grid = DensityGrid()
+    returned = 0
+
+    def keep(lat, lng):
+        nonlocal returned
+        returned += 1
+        if not leaf_owns(leaf['bbox'], BOUNDS, lat, lng):
+            return False
+        grid.add(lat, lng)
+        return True
+
+    centers = query_rec_centers(client, leaf['bbox'], leaf['id'], slim, keep)
+    return centers, grid, returned
+
+def plan_leaves(client, max_per_leaf, replan=False):
+    """
+    The cached leaf plan, or a new one built from the last run's density
+    grid (or from `out count` queries on a first run).
+    """
+    plan = None if replan else load_plan(PLAN_PATH, BOUNDS, max_per_leaf)
+    if plan is not None:
+        print(f"Using cached plan: {len(plan['leaves'])} leaves (from {plan['source']}, {plan['created']})")
+        return plan
+    grid = DensityGrid.load(DENSITY_PATH)
+    if grid is not None:
+        plan = build_plan(BOUNDS, grid.count, max_per_leaf, source='density')
+    else:
+        print("No density grid from a previous run; estimating with Overpass count queries")
+        plan = build_plan(BOUNDS, lambda bbox: count_rec_centers(client, bbox), max_per_leaf, source='count')
+    save_plan(PLAN_PATH, plan)
+    return plan
+
+def extract_rec_center(elem, keep=None):
+    """Extract recreation center info from one Overpass element (None to skip it)."""
+    # Get coordinates
+    if elem['type'] == 'node':
+        lat = elem['lat']
+        lng = elem['lon']
+    elif 'center' in elem:
+        lat = elem['center']['lat']
+        lng = elem['center']['lon']
+    else:
+        return None
+
+    return build_rec_center(elem['type'], elem['id'], lat, lng, elem.get('tags', {}), keep)
+
+def rec_center_from_row(row, keep=None):
+    """Same as extract_rec_center for a --slim CSV row (missing tags are "")."""
+    if not row.get('::lat'):
+        return None
+    return build_rec_center(row['::type'], row['::id'], float(row['::lat']), float(row['::lon']), row, keep)
+
+def build_rec_center(elem_type, elem_id, lat, lng, tags, keep=None):
+    if keep is not None and not keep(lat, lng):
+        return None
+
+    name = tags.get('name', '')
+
+    # Skip if no name
+    if not name:
+        return None
+
+    # Create unique ID
+    elem_id = f"osm_{elem_type}_{elem_id}"
+
+    return {
+        'id': elem_id,
+        'name': name,
+        'lat': round(lat, 6),
+        'lng': round(lng, 6),
+        'category': 'recreation_center',
+        'tags': tags  # Keep for filtering later
+    }
 
 def extract_rec_centers(elements):
     """Extract recreation center info from Overpass API results."""
-    centers = []
-    
-    for elem in elements:
-        tags = elem.get('tags', {})
-        name = tags.get('name', '')
-        
-        # Skip if no name
-        if not name:
-            continue
-            
-        # Get coordinates
-        if elem['type'] == 'node':
-            lat = elem['lat']
-            lng = elem['lon']
-        elif 'center' in elem:
-            lat = elem['center']['lat']
-            lng = elem['center']['lon']
-        else:
-            continue
-        
-        # Create unique ID
-        elem_id = f"osm_{elem['type']}_{elem['id']}"
-        
-        centers.append({
-            'id': elem_id,
-            'name': name,
-            'lat': round(lat, 6),
-            'lng': round(lng, 6),
-            'category': 'recreation_center',
-            'tags': tags  # Keep for filtering later
-        })
-    
-    return centers
+    return [c for c in map(extract_rec_center, elements) if c]
 
+@instrument("fetch_rec_centers")
 def main():
+    global OVERPASS_URL
+    parser = argparse.ArgumentParser(description="Fetch recreation centers from OSM")
+    parser.add_argument('--output', default='rec_centers_found.json', help="Output JSON path")
+    parser.add_argument('--overpass-url', default=OVERPASS_URL,
+                        help="Overpass API endpoint (default: $HOOPRANK_OVERPASS_URL or overpass-api.de)")
+    parser.add_argument('--allow-partial', action='store_true',
+                        help="Write output even if some regions failed after retries")
+    parser.add_argument('--mirrors', action='store_true',
+                        help="Spread region queries over all Overpass mirrors by free slots")
+    parser.add_argument('--slim', action='store_true',
+                        help="Request only the columns this stage uses (CSV output) to cut transfer size")
+    parser.add_argument('--max-per-leaf', type=int, default=MAX_PER_LEAF,
+                        help=f"Elements one leaf query may return (default: {MAX_PER_LEAF})")
+    parser.add_argument('--replan', action='store_true',
+                        help="Rebuild the leaf plan instead of reusing the cached one")
+    args = parser.parse_args()
+    OVERPASS_URL = args.overpass_url
+    
     print("=== Fetching Recreation Centers with Basketball Courts ===\n")
     
+    client = OverpassClient(OVERPASS_URL)
+    plan = plan_leaves(client, args.max_per_leaf, args.replan)
+    leaves = {leaf['id']: leaf for leaf in plan['leaves']}
+    
+    if args.mirrors:
+        results, failed = MirrorScheduler(OVERPASS_MIRRORS).run_units(
+            'fetch_rec_centers', list(leaves),
+            lambda client, leaf_id: query_leaf(client, leaves[leaf_id], args.slim),
+        )
+    else:
+        # The client paces queries from the server's slot status
+        results, failed = run_units(
+            'fetch_rec_centers', list(leaves),
+            lambda leaf_id: query_leaf(client, leaves[leaf_id], args.slim),
+        )
+    if failed and not args.allow_partial:
+        print(f"\n❌ {len(failed)} leaves failed: {', '.join(unit for unit, _ in failed)}")
+        print("Not writing partial output (rerun, or pass --allow-partial)")
+        sys.exit(1)
+    
     all_centers = []
+    density = DensityGrid()
+    
+    for leaf_id in leaves:
+        if leaf_id in results:
+            centers, grid, _ = results[leaf_id]
+            all_centers.extend(centers)
+            density.merge(grid)
     
-    for region_name, bbox in REGIONS.items():
-        elements = query_rec_centers(bbox, region_name)
-        centers = extract_rec_centers(elements)
-        all_centers.extend(centers)
-        time.sleep(2)  # Be nice to the API
+    record_leaf_counts(PLAN_PATH, plan, {leaf_id: result[2] for leaf_id, result in results.items()})
+    if not failed:
+        # A partial grid would under-plan the failed leaves next time
+        density.save(DENSITY_PATH)
     
     # Deduplicate by name + approximate location
     seen = set()
@@ -176,15 +288,16 @@ def main():
             filtered.append(c)
     
     print(f"Filtered to {len(filtered)} likely basketball venues\n")
+    record_counts(records_in=len(all_centers), records_out=len(filtered))
     
     # Save to JSON for review
     output = [{'id': c['id'], 'name': c['name'], 'lat': c['lat'], 'lng': c['lng'], 'category': c['category']} 
-              for c in filtered]
+              for c in spatial_sort(filtered)]
     
-    with open('rec_centers_found.json', 'w') as f:
+    with open(args.output, 'w') as f:
         json.dump(output, f, indent=2)
     
-    print(f"Saved to rec_centers_found.json")
+    print(f"Saved to {args.output}")
     
     # Print sample
     print("\nSample of found recreation centers:")
@@ -4,16 +4,27 @@ Remove false positive indoor venues that don't have basketball courts.
 Uses name patterns to identify non-basketball facilities.
 """
 
+import argparse
 import re
 from collections import Counter, defaultdict
 
+from dart_emitter import (DART_STRING, GYM_FIELDS, dart_unescape, is_dart_columns, read_dart_columns,
+                          write_dart_columns, write_dart_list)
+from pipeline_metrics import instrument, phase, record_counts
+from staged_output import StagedOutputs
+
+INDOOR_GYMS_FILE = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/indoor_gyms_data.dart'
+
 def parse_indoor_gyms(filepath):
     """Parse the Dart file to extract gym entries."""
+    gyms = read_dart_columns(filepath, GYM_FIELDS)
+    if gyms is not None:
+        return gyms
     with open(filepath, 'r') as f:
         content = f.read()
     
     entry_pattern = re.compile(
-        r"\{\s*\n\s*'id':\s*'([^']+)',\s*\n\s*'name':\s*'([^']*)',\s*\n\s*'lat':\s*([\d.-]+),\s*\n\s*'lng':\s*([\d.-]+),\s*\n\s*'category':\s*'([^']+)',\s*\n\s*'indoor':\s*true,\s*\n\s*\}",
+        r"\{\s*\n\s*'id':\s*'([^']+)',\s*\n\s*'name':\s*" + DART_STRING + r",\s*\n\s*'lat':\s*([\d.-]+),\s*\n\s*'lng':\s*([\d.-]+),\s*\n\s*'category':\s*'([^']+)',\s*\n\s*'indoor':\s*true,\s*\n\s*\}",
         re.MULTILINE
     )
     
@@ -21,7 +32,7 @@ def parse_indoor_gyms(filepath):
     for match in entry_pattern.finditer(content):
         entries.append({
             'id': match.group(1),
-            'name': match.group(2),
+            'name': dart_unescape(match.group(2)),
             'lat': float(match.group(3)),
             'lng': float(match.group(4)),
             'category': match.group(5),
@@ -131,9 +142,9 @@ def is_false_positive(name, category):
     
     return False, None
 
-def write_dart_file(entries, filepath, header_comment=""):
-    """Write entries back to Dart file format."""
-    lines = [
+def write_dart_file(entries, filepath, header_comment="", columnar=False):
+    """Write entries back to Dart file format (typed columns if columnar)."""
+    header = [
         "// AUTO-GENERATED FILE - DO NOT EDIT MANUALLY",
         "// Generated from OpenStreetMap data",
         "// Attribution: © OpenStreetMap contributors (ODbL)",
@@ -143,33 +154,33 @@ def write_dart_file(entries, filepath, header_comment=""):
         "/// Indoor basketball venue data from OpenStreetMap",
         "final List<Map<String, dynamic>> indoorGymsData = [",
     ]
-    
-    for e in entries:
-        # Escape single quotes in name
-        name = e['name'].replace("'", "\\'")
-        lines.append(f"  {{")
-        lines.append(f"    'id': '{e['id']}',")
-        lines.append(f"    'name': '{name}',")
-        lines.append(f"    'lat': {e['lat']},")
-        lines.append(f"    'lng': {e['lng']},")
-        lines.append(f"    'category': '{e['category']}',")
-        lines.append(f"    'indoor': true,")
-        lines.append(f"  }},")
-    
-    lines.append("];")
-    
-    with open(filepath, 'w') as f:
-        f.write('\n'.join(lines))
+    write = write_dart_columns if columnar else write_dart_list
+    # Keep the input's order; stages that rewrite a dataset don't re-sort it (see spatial_order)
+    write(filepath, header, entries, fields=GYM_FIELDS, constants={'indoor': True}, spatial=False)
 
+@instrument("filter_false_positives")
 def main():
-    input_file = '/Users/brettcorbett/.gemini/antigravity/playground/electric-planetary/HoopRank/app/hooprank-starter-with-frontend/hooprank-starter/mobile/lib/services/indoor_gyms_data.dart'
+    parser = argparse.ArgumentParser(description="Remove indoor venues that don't have basketball courts")
+    parser.add_argument("--input", default=INDOOR_GYMS_FILE, help="Indoor gyms Dart file to filter")
+    parser.add_argument("--output", help="Where to write the result (default: overwrite --input)")
+    parser.add_argument("--force", action="store_true", help="Rerun even if the inputs are unchanged since the last run")
+    args = parser.parse_args()
+    
+    input_file = args.input
+    output_file = args.output or input_file
+    
+    stage = StagedOutputs('filter_false_positives', inputs=[input_file])
+    if not args.force and stage.up_to_date([output_file]):
+        print(f"{input_file} is unchanged since the last filter run, nothing to do (use --force to rerun)")
+        return
     
     print("=" * 60)
     print("INDOOR VENUE FALSE POSITIVE REMOVAL")
     print("=" * 60)
     
     print("\nParsing indoor gyms data...")
-    entries = parse_indoor_gyms(input_file)
+    with phase("parse"):
+        entries = parse_indoor_gyms(input_file)
     print(f"  Total entries: {len(entries)}")
     
     # Categorize entries
@@ -187,6 +198,7 @@ def main():
     
     print(f"\n  False positives identified: {len(false_positives)}")
     print(f"  Valid entries remaining: {len(valid_entries)}")
+    record_counts(records_in=len(entries), records_out=len(valid_entries))
     
     print("\n" + "-" * 60)
     print("REMOVAL BREAKDOWN BY REASON")
@@ -211,8 +223,9 @@ def main():
     print("WRITING FILTERED DATA")
     print("-" * 60)
     
-    write_dart_file(valid_entries, input_file)
-    print(f"  Wrote {len(valid_entries)} entries to {input_file}")
+    with stage:
+        write_dart_file(valid_entries, stage.path(output_file), columnar=is_dart_columns(input_file))
+    print(f"  Wrote {len(valid_entries)} entries to {output_file}")
     
     print("\n" + "=" * 60)
     print("SUMMARY")
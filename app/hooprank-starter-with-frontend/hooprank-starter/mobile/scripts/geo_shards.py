@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Geohash sharding helpers for running spatial rules across processes.
+
+Points are grouped into shards by geohash prefix. A rule that only compares
+a point with neighbours within `halo_m` meters can run on each shard on its
+own, as long as the shard also sees every neighbour within halo_m of its
+cell: halo_cells() lists the cells a neighbour must be copied into.
+
+Coordinates go into one SharedFloats block (multiprocessing.shared_memory),
+so workers can read any point by index without the whole array being
+pickled into every task.
+
+Usage:
+    shards = defaultdict(list)
+    for idx, (lat, lng) in enumerate(points):
+        shards[geohash(lat, lng, 4)].append(idx)
+    for keys in plan_tasks(shards, tasks=32):
+        ...
+"""
+
+import math
+from array import array
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Set, Tuple
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {c: i for i, c in enumerate(BASE32)}
+
+# halo_cells() assumes the halo is smaller than a cell; precision 5 cells
+# are still ~4.9 x 4.9 km at the equator (~3.3 km wide at 48N)
+MAX_PRECISION = 5
+
+
+def geohash(lat: float, lng: float, precision: int) -> str:
+    """Standard geohash of a point, `precision` characters long."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                value = value * 2 + 1
+                lng_lo = mid
+            else:
+                value = value * 2
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = value * 2 + 1
+                lat_lo = mid
+            else:
+                value = value * 2
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def geohash_bbox(code: str) -> Tuple[float, float, float, float]:
+    """(south, west, north, east) of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    even = True
+    for char in code:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                if bit:
+                    lng_lo = mid
+                else:
+                    lng_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lng_lo, lat_hi, lng_hi
+
+
+def halo_cells(lat: float, lng: float, halo_m: float, precision: int) -> Set[str]:
+    """
+    Cells whose shard must see a point so that every point within halo_m
+    of it is matched: the cells touched by the halo_m box around the point.
+    """
+    if precision > MAX_PRECISION:
+        raise ValueError(f"halo_cells needs precision <= {MAX_PRECISION}, got {precision}")
+    dlat = halo_m / 111_320
+    dlng = halo_m / (111_320 * max(math.cos(math.radians(lat)), 0.01))
+    return {geohash(lat + sy * dlat, lng + sx * dlng, precision)
+            for sy in (-1, 0, 1) for sx in (-1, 0, 1)}
+
+
+def plan_tasks(shards: Dict[str, List], tasks: int) -> List[List[str]]:
+    """
+    Group shard keys into about `tasks` batches of similar size. Keys are
+    taken in geohash order, so each batch covers a compact area.
+    """
+    total = sum(len(items) for items in shards.values())
+    target = max(total // max(tasks, 1), 1)
+    batches: List[List[str]] = []
+    current: List[str] = []
+    size = 0
+    for key in sorted(shards):
+        current.append(key)
+        size += len(shards[key])
+        if size >= target:
+            batches.append(current)
+            current, size = [], 0
+    if current:
+        batches.append(current)
+    return batches
+
+
+class SharedFloats:
+    """A float64 array in shared memory, created by the parent and attached by workers."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, size: int, owner: bool):
+        self.shm = shm
+        self.size = size
+        self.owner = owner
+        self.values: Optional[memoryview] = shm.buf[:size * 8].cast("d")
+
+    @classmethod
+    def create(cls, values: array) -> "SharedFloats":
+        shm = shared_memory.SharedMemory(create=True, size=max(len(values) * 8, 1))
+        shared = cls(shm, len(values), owner=True)
+        shared.values[:] = values
+        return shared
+
+    @classmethod
+    def attach(cls, name: str, size: int) -> "SharedFloats":
+        return cls(shared_memory.SharedMemory(name=name), size, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        if self.values is not None:
+            self.values.release()
+            self.values = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Persistent reverse-geocode cache shared by the court naming scripts.
+
+Nominatim allows one request per second, so a national naming run is days
+of HTTP. This keeps every response (the full JSON payload, not the name
+derived from it) in SQLite under .pipeline/, so:
+
+  - reruns, resumed runs and runs with a changed naming rule reuse what
+    was already fetched and cost no HTTP calls
+  - a court is answered by any cached result close enough to it, not only
+    one that rounds to the same coordinates: the nearest result within
+    PLACE_RADIUS_M that names a park/school (see PLACE_KEYS), otherwise
+    the nearest result of any kind within REUSE_RADIUS_M
+
+Rows are indexed by a CELL_DEG grid cell, so a lookup reads only the few
+cells around the point.
+
+Usage:
+    cache = GeocodeCache()
+    geo_data = cache.lookup(lat, lng)
+    if geo_data is None:
+        geo_data = reverse_geocode(lat, lng)
+        cache.put(lat, lng, geo_data)
+"""
+
+import json
+import math
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+from staged_output import STATE_DIR
+
+DEFAULT_CACHE_PATH = os.path.join(STATE_DIR, "geocode_cache.sqlite")
+
+# Address components that name the place a court is in
+PLACE_KEYS = ("park", "playground", "recreation_ground", "school", "university")
+
+# A cached park/school result is reused this far away; any other result this far
+PLACE_RADIUS_M = 100
+REUSE_RADIUS_M = 50
+
+# Grid cell size for the spatial index (~110 m of latitude)
+CELL_DEG = 0.001
+
+# Cell keys are row * CELL_STRIDE + col; |col| stays below 180 / CELL_DEG
+CELL_STRIDE = 400_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocodes (
+    id INTEGER PRIMARY KEY,
+    cell INTEGER NOT NULL,
+    lat REAL NOT NULL,
+    lng REAL NOT NULL,
+    has_place INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS geocodes_cell ON geocodes (cell);
+"""
+
+
+def haversine_distance(lat1, lng1, lat2, lng2):
+    """Calculate distance between two points in meters."""
+    R = 6371000  # Earth's radius in meters
+
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lng = math.radians(lng2 - lng1)
+
+    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lng/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+    return R * c
+
+
+def has_place(payload: Dict) -> bool:
+    address = payload.get("address") or {}
+    return any(address.get(key) for key in PLACE_KEYS)
+
+
+class GeocodeCache:
+    """Nominatim reverse-geocode responses in SQLite, looked up by distance."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, radius_m: float = REUSE_RADIUS_M,
+                 place_radius_m: float = PLACE_RADIUS_M):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.radius_m = radius_m
+        self.place_radius_m = place_radius_m
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+
+    @staticmethod
+    def cell(lat: float, lng: float) -> int:
+        return math.floor(lat / CELL_DEG) * CELL_STRIDE + math.floor(lng / CELL_DEG)
+
+    def nearest(self, lat: float, lng: float, radius_m: float, place_only: bool = False) -> Optional[Dict]:
+        """Payload of the closest cached result within radius_m, or None."""
+        rows = math.ceil(radius_m / 111_320 / CELL_DEG)
+        cols = math.ceil(radius_m / (111_320 * max(math.cos(math.radians(lat)), 0.01)) / CELL_DEG)
+        row, col = math.floor(lat / CELL_DEG), math.floor(lng / CELL_DEG)
+        cells = [r * CELL_STRIDE + c
+                 for r in range(row - rows, row + rows + 1)
+                 for c in range(col - cols, col + cols + 1)]
+
+        sql = f"SELECT lat, lng, payload FROM geocodes WHERE cell IN ({','.join('?' * len(cells))})"
+        if place_only:
+            sql += " AND has_place = 1"
+        best, best_dist = None, radius_m
+        for row_lat, row_lng, payload in self.conn.execute(sql, cells):
+            dist = haversine_distance(lat, lng, row_lat, row_lng)
+            if dist <= best_dist:
+                best, best_dist = payload, dist
+        return json.loads(best) if best is not None else None
+
+    def lookup(self, lat: float, lng: float) -> Optional[Dict]:
+        """A cached response usable for (lat, lng): nearby park/school first, then anything close."""
+        payload = self.nearest(lat, lng, self.place_radius_m, place_only=True)
+        if payload is None:
+            payload = self.nearest(lat, lng, self.radius_m)
+        if payload is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return payload
+
+    def put(self, lat: float, lng: float, payload: Dict):
+        """Store a response (also one without an address, so it isn't asked again)."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO geocodes (cell, lat, lng, has_place, payload, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.cell(lat, lng), lat, lng, int(has_place(payload)),
+                 json.dumps(payload, sort_keys=True), time.time()),
+            )
+
+    def describe(self) -> str:
+        return f"{self.hits:,} hits, {self.misses:,} misses ({len(self):,} cached) in {self.path}"
+
+    def close(self):
+        self.conn.close()
@@ -24,8 +24,8 @@ from __future__ import annotations
 import argparse
 import io
 import json
+import os
 import re
-import time
 import zipfile
 from dataclasses import dataclass
 from typing import Any, Dict, Iterable, List, Optional, Tuple
@@ -34,6 +34,10 @@ import pandas as pd
 import requests
 from tqdm import tqdm
 
+from overpass_client import OverpassClient
+from overpass_scheduler import MirrorScheduler
+from pipeline_metrics import instrument, record_counts
+
 
 GAZETTEER_URL_CANDIDATES = [
     # Try newest-first; if one 404s, script will fall back.
@@ -47,6 +51,9 @@ OVERPASS_URL_CANDIDATES = [
     "https://overpass.kumi.systems/api/interpreter",
     "https://overpass.openstreetmap.ru/api/interpreter",
 ]
+# Set to use one endpoint only (e.g. a local mock_osm_server.py)
+if os.environ.get("HOOPRANK_OVERPASS_URL"):
+    OVERPASS_URL_CANDIDATES = [os.environ["HOOPRANK_OVERPASS_URL"]]
 
 
 NAME_HINT_RE = re.compile(
@@ -114,19 +121,6 @@ def load_cities_from_csv(path: str) -> pd.DataFrame:
     return df[["city", "state", "population", "lat", "lon"]]
 
 
-def pick_working_overpass_endpoint(timeout_s: int = 20) -> str:
-    for url in OVERPASS_URL_CANDIDATES:
-        try:
-            # Minimal query to test availability
-            q = '[out:json][timeout:10];node(0,0,0.0001,0.0001);out 1;'
-            r = requests.post(url, data={"data": q}, timeout=timeout_s)
-            if r.status_code == 200:
-                return url
-        except Exception:
-            pass
-    raise RuntimeError("Could not reach any Overpass endpoint. Try again later or change OVERPASS_URL_CANDIDATES.")
-
-
 def build_overpass_query(
     lat: float,
     lon: float,
@@ -179,15 +173,12 @@ def build_overpass_query(
     return q
 
 
-def overpass_fetch(url: str, query: str, timeout_s: int = 120, sleep_s: float = 1.0) -> Dict[str, Any]:
+def overpass_fetch(client: OverpassClient, query: str, timeout_s: int = 120) -> Dict[str, Any]:
     """
-    Execute Overpass query. Adds a small sleep to be nice to Overpass.
+    Execute Overpass query on the mirror the scheduler picked. Raises
+    OverpassError on 429/504/HTML so the scheduler can retry elsewhere.
     """
-    r = requests.post(url, data={"data": query}, timeout=timeout_s)
-    # If Overpass is overloaded, it may return 429/504 or HTML. Let user see it.
-    r.raise_for_status()
-    time.sleep(sleep_s)
-    return r.json()
+    return client.query(query, timeout=timeout_s)
 
 
 def classify_element(tags: Dict[str, str]) -> Tuple[str, str, str, bool]:
@@ -350,15 +341,18 @@ def elements_to_rows(
     return rows
 
 
+@instrument("hooprank_osm_signature_builder")
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--out", required=True, help="Output CSV path")
     ap.add_argument("--max-cities", type=int, default=100, help="How many top cities to process (default: 100)")
     ap.add_argument("--radius-km", type=float, default=20.0, help="Search radius around city center (default: 20km)")
     ap.add_argument("--timeout-s", type=int, default=180, help="Overpass query timeout (default: 180s)")
-    ap.add_argument("--sleep-s", type=float, default=1.0, help="Sleep between Overpass requests (default: 1s)")
+    ap.add_argument("--sleep-s", type=float, default=1.0, help="Minimum gap between requests to one mirror (default: 1s)")
     ap.add_argument("--only-named", action="store_true", help="Keep only elements that have a name tag")
     ap.add_argument("--cities-csv", default="", help="Optional CSV with columns city,state,lat,lon[,population]")
+    ap.add_argument("--overpass-url", default="", help="Use only this Overpass endpoint instead of all the candidates")
+    ap.add_argument("--max-slots", type=int, default=4, help="Max concurrent queries per mirror (default: 4)")
 
     ap.add_argument("--no-courts", action="store_true", help="Do NOT include sport=basketball courts")
     ap.add_argument("--no-rec-centers", action="store_true", help="Do NOT include rec centers / gyms")
@@ -374,22 +368,15 @@ def main() -> None:
     else:
         cities = load_top_cities_from_census_gazetteer(max_cities=args.max_cities)
 
-    overpass_url = pick_working_overpass_endpoint()
-    print(f"[info] Using Overpass endpoint: {overpass_url}")
+    overpass_urls = [args.overpass_url] if args.overpass_url else OVERPASS_URL_CANDIDATES
+    print(f"[info] Using Overpass endpoints: {', '.join(overpass_urls)}")
     radius_m = int(args.radius_km * 1000)
 
-    all_rows: List[Dict[str, Any]] = []
-    seen: set = set()
-
-    for _, row in tqdm(cities.iterrows(), total=len(cities), desc="Cities"):
-        city = row["city"]
-        state = row["state"]
-        lat = float(row["lat"])
-        lon = float(row["lon"])
-
+    def fetch_city(client: OverpassClient, index: int) -> Dict[str, Any]:
+        row = cities.iloc[index]
         q = build_overpass_query(
-            lat=lat,
-            lon=lon,
+            lat=float(row["lat"]),
+            lon=float(row["lon"]),
             radius_m=radius_m,
             include_courts=not args.no_courts,
             include_rec_centers=not args.no_rec_centers,
@@ -397,14 +384,31 @@ def main() -> None:
             include_universities=not args.no_universities,
             timeout_s=args.timeout_s,
         )
+        return overpass_fetch(client, q, timeout_s=args.timeout_s + 60)
 
-        try:
-            data = overpass_fetch(overpass_url, q, timeout_s=args.timeout_s + 60, sleep_s=args.sleep_s)
-        except Exception as e:
-            print(f"[warn] Overpass failed for {city}, {state}: {e}")
-            continue
+    def city_label(index: int) -> str:
+        return f'{cities.iloc[index]["city"]}, {cities.iloc[index]["state"]}'
+
+    # Cities are queued and spread over every mirror with a free slot
+    scheduler = MirrorScheduler(overpass_urls, max_slots=args.max_slots, min_delay=args.sleep_s)
+    with tqdm(total=len(cities), desc="Cities") as bar:
+        results, failed = scheduler.run_units(
+            "hooprank_osm_signature_builder", range(len(cities)), fetch_city,
+            label=city_label, on_done=lambda _: bar.update(1),
+        )
+    for label, error in failed:
+        print(f"[warn] Overpass failed for {label}: {error}")
 
-        elements = data.get("elements", [])
+    all_rows: List[Dict[str, Any]] = []
+    seen: set = set()
+
+    # Merge in city order so the output doesn't depend on which mirror answered first
+    for index in range(len(cities)):
+        if index not in results:
+            continue
+        city = cities.iloc[index]["city"]
+        state = cities.iloc[index]["state"]
+        elements = results[index].get("elements", [])
         rows = elements_to_rows(elements, city_anchor=city, state_anchor=state)
 
         for r in rows:
@@ -432,6 +436,7 @@ def main() -> None:
     # Sort: best signature first, then by city
     df = df.sort_values(["signature_tier", "signature_score", "city_anchor"], ascending=[True, False, True])
 
+    record_counts(records_out=len(df))
     df.to_csv(args.out, index=False)
     print(f"[done] Wrote {len(df):,} rows to {args.out}")
 
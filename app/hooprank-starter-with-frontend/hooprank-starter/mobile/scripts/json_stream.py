@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Streaming JSON array reader/writer for the court datasets.
+
+courts_named.json / courts.json are a single top-level array and Overpass
+responses are an object with an "elements" array. Loading either with
+`json.load` holds every court in memory at once (twice, once more for the
+output list). These helpers read one array item at a time and write one item
+at a time, so peak memory stays flat as the national dataset grows.
+
+Only the standard library is used: items are decoded with the C-accelerated
+`json.JSONDecoder.raw_decode` on a sliding buffer, so no extra dependency
+(ijson/orjson) is needed.
+"""
+
+import json
+import os
+import shutil
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from staged_output import fsync_file, replace_if_changed
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789+-.eE"
+
+_decoder = json.JSONDecoder()
+
+
+class _Buffer:
+    """Text buffer fed by an iterator of str/bytes chunks."""
+
+    def __init__(self, chunks: Iterator[Union[str, bytes]]):
+        self.chunks = chunks
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+        self._pending = b""
+
+    def fill(self) -> bool:
+        """Append the next chunk; returns False at end of input."""
+        if self.eof:
+            return False
+        for chunk in self.chunks:
+            if isinstance(chunk, bytes):
+                # Keep incomplete UTF-8 sequences for the next chunk
+                data = self._pending + chunk
+                try:
+                    chunk = data.decode("utf-8")
+                    self._pending = b""
+                except UnicodeDecodeError as e:
+                    if e.start < len(data) - 3:
+                        raise
+                    chunk = data[:e.start].decode("utf-8")
+                    self._pending = data[e.start:]
+            if not chunk:
+                continue
+            # Drop what has already been consumed before growing the buffer
+            self.text = self.text[self.pos:] + chunk
+            self.pos = 0
+            return True
+        self.eof = True
+        return False
+
+    def skip_ws(self) -> Optional[str]:
+        """Advance past whitespace; returns the next char or None at EOF."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char: str):
+        if self.skip_ws() != char:
+            found = self.text[self.pos:self.pos + 20] or "end of input"
+            raise ValueError(f"Expected '{char}' in JSON stream, found {found!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value."""
+        self.skip_ws()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number cut at the end of the buffer ("12" of "123", "0" of "0.5")
+            # still decodes, so only accept it once its delimiter is buffered.
+            if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and (end == len(self.text) or self.text[end] in NUMBER_CHARS)
+                    and self.fill()):
+                continue
+            self.pos = end
+            return value
+
+
+def _chunks(source, chunk_size: int) -> Iterator[Union[str, bytes]]:
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from iter(lambda: f.read(chunk_size), b"")
+    elif hasattr(source, "read"):
+        yield from iter(lambda: source.read(chunk_size), source.read(0))
+    else:
+        yield from source
+
+
+def iter_json_array(source, key: Optional[str] = None, trailer: Optional[Dict] = None,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Yield the items of a JSON array one at a time.
+
+    source:  file path, open file object, or iterable of str/bytes chunks
+             (e.g. `response.iter_content(...)`).
+    key:     name of the array inside a top-level object (e.g. "elements" for
+             Overpass); None when the document itself is an array.
+    trailer: if given, filled with the other top-level keys of the object
+             (e.g. Overpass "remark") once the array has been consumed.
+    """
+    buf = _Buffer(_chunks(source, chunk_size))
+
+    if key is not None:
+        buf.expect("{")
+        while True:
+            name = buf.value()
+            buf.expect(":")
+            if name == key:
+                break
+            value = buf.value()
+            if trailer is not None:
+                trailer[name] = value
+            if buf.skip_ws() != ",":
+                raise ValueError(f"Key '{key}' not found in JSON stream")
+            buf.pos += 1
+
+    buf.expect("[")
+    if buf.skip_ws() == "]":
+        buf.pos += 1
+    else:
+        while True:
+            yield buf.value()
+            char = buf.skip_ws()
+            buf.pos += 1
+            if char == "]":
+                break
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON array, found {char!r}")
+
+    if key is not None and trailer is not None:
+        while buf.skip_ws() == ",":
+            buf.pos += 1
+            name = buf.value()
+            buf.expect(":")
+            trailer[name] = buf.value()
+
+
+class JsonArrayWriter:
+    """
+    Write a JSON array one item at a time.
+
+    Output is byte-identical to `json.dump(items, f)`. The file is written to a
+    temp path in the same directory and renamed into place on close (or
+    dropped if the bytes are unchanged), so the destination may also be the
+    file being streamed from.
+    """
+
+    def __init__(self, path: str, buffering: int = 1 << 20):
+        self.path = path
+        self.tmp_path = f"{path}.tmp{os.getpid()}"
+        self.f = open(self.tmp_path, "w", encoding="utf-8", buffering=buffering)
+        self.f.write("[")
+        self.count = 0
+
+    def write(self, item: Any):
+        if self.count:
+            self.f.write(", ")
+        self.f.write(json.dumps(item))
+        self.count += 1
+
+    def write_all(self, items: Iterable[Any]):
+        for item in items:
+            self.write(item)
+
+    def close(self):
+        self.f.write("]")
+        self.f.close()
+        replace_if_changed(self.tmp_path, self.path)
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def json_array_end(path: str) -> Tuple[int, bytes]:
+    """Offset of the closing `]` of a JSON array file, and the bytes from there to the end."""
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(size - 64, 0))
+        tail = f.read()
+    stripped = tail.rstrip()
+    if not stripped.endswith(b"]"):
+        raise ValueError(f"{path} does not end with a JSON array")
+    return size - len(tail) + len(stripped) - 1, tail[len(stripped) - 1:]
+
+
+def append_json_array(path: str, items: Iterable[Any]) -> int:
+    """
+    Append items to a JSON array file in place, writing only the new items
+    over its closing bracket. For a JsonArrayWriter file the result is
+    byte-identical to writing the old and new items in one go. Not atomic:
+    save json_array_end() first to be able to roll back. Returns the count.
+    """
+    encoded = [json.dumps(item) for item in items]
+    if not encoded:
+        return 0
+    offset, tail = json_array_end(path)
+    with open(path, "r+b") as f:
+        f.seek(max(offset - 64, 0))
+        empty = f.read(offset - max(offset - 64, 0)).rstrip().endswith(b"[")
+        f.seek(offset)
+        f.write(((", " if not empty else "") + ", ".join(encoded)).encode("utf-8") + tail)
+        f.truncate()
+    fsync_file(path)
+    return len(encoded)
+
+
+def _reflink(src: str, dst: str) -> bool:
+    """Copy-on-write clone (Linux FICLONE); False if unsupported."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    FICLONE = 0x40049409
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    """
+    Make `dst` hold the same bytes as `src` without serializing again.
+
+    Tries a hard link, then a copy-on-write clone, then a plain copy, and
+    swaps the result into place atomically. Returns the method used.
+    Every writer here except append_json_array replaces files by rename
+    rather than editing in place, so a hard-linked pair never changes behind
+    one name's back (an append changes both names together).
+    """
+    tmp = f"{dst}.tmp{os.getpid()}"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+        method = "hardlink"
+    except OSError:
+        if _reflink(src, tmp):
+            method = "reflink"
+        else:
+            shutil.copyfile(src, tmp)
+            method = "copy"
+    os.replace(tmp, dst)
+    return method
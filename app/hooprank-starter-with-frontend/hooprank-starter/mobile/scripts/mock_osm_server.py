@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Overpass and Nominatim APIs.
+
+Serves recorded responses from a fixtures directory so the fetch and naming
+scripts can run offline, in CI, or under load without touching the public
+servers. Queries with no fixture get a deterministic synthetic response, so
+load tests don't need a fixture per tile.
+
+Endpoints (same paths as the real services):
+  POST/GET /api/interpreter   Overpass query (form field or query param `data`)
+  GET      /api/status        Overpass slot status, reflecting --slots
+  GET      /reverse           Nominatim reverse geocoding
+  GET      /__stats           request/fault counters as JSON (for load tests)
+
+Fault injection:
+  --latency/--jitter      added delay per request (ms)
+  --rate-429/--rate-504   share of requests answered with 429 (with Retry-After) or 504
+  --truncate-rate         share of responses cut off mid-body
+  --remark-rate           share of Overpass responses that come back partial
+                          with a "runtime error" remark, as Overpass does
+  --slots                 concurrent Overpass queries allowed; extra ones get 429
+
+Point the scripts at it with the endpoint overrides:
+  HOOPRANK_OVERPASS_URL=http://127.0.0.1:8765/api/interpreter \\
+  HOOPRANK_NOMINATIM_URL=http://127.0.0.1:8765/reverse python fetch_indoor_gyms.py ...
+
+Usage:
+  python mock_osm_server.py --fixtures fixtures/ --port 8765
+  python mock_osm_server.py --latency 300 --jitter 200 --rate-429 0.1 --slots 2
+  python mock_osm_server.py --record        # fill missing fixtures from the live APIs
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+LIVE_OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+LIVE_NOMINATIM_URL = "https://nominatim.openstreetmap.org/reverse"
+
+SYNTHETIC_NAMES = ["Lincoln", "Washington", "Riverside", "Lakeview", "Oak", "Maple", "Sunset",
+                   "Highland", "Mission", "Central", "Memorial", "Roosevelt", "Hillcrest", "Willow"]
+SYNTHETIC_SUFFIXES = ["Park", "Recreation Center", "Community Center", "High School", "Middle School",
+                      "Playground", "Athletic Club", "YMCA"]
+SYNTHETIC_STREETS = ["Main Street", "2nd Avenue", "Broadway", "Market Street", "Elm Street", "Park Avenue"]
+
+_BBOX_RE = re.compile(r"\(\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*\)")
+_AROUND_RE = re.compile(r"around:\s*([\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)")
+# A query statement's filters, e.g. nwr["amenity"~"^(school|college)$"]["name"](bbox)
+_STATEMENT_RE = re.compile(r'\b(?:node|way|relation|nwr|nw|nr|wr)((?:\s*\[[^\]]*\])+)')
+_TAG_RE = re.compile(r'\[\s*"([^"]+)"\s*(=|~)\s*"([^"]+)"\s*(?:,\s*i\s*)?\]')
+# Leading settings statement, e.g. [out:json][timeout:60]; or [out:csv(::id,"name";true)];
+_SETTINGS_RE = re.compile(r'^\s*(?:\[(?:[^\[\]()]|\([^)]*\))*\]\s*)+;')
+_CSV_RE = re.compile(r'\[out:csv\(([^)]*)\)\]')
+_COUNT_RE = re.compile(r'\bout\s+count\s*;')
+
+
+def fixture_key(service: str, key: str) -> str:
+    return os.path.join(service, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+
+def overpass_key(query: str) -> str:
+    return " ".join(query.split())
+
+
+def nominatim_key(params: Dict[str, str]) -> str:
+    lat, lon = float(params.get("lat", 0)), float(params.get("lon", 0))
+    return f"{lat:.5f},{lon:.5f},{params.get('zoom', '18')}"
+
+
+def synthetic_reverse_geocode(lat: float, lng: float) -> Dict:
+    """Deterministic Nominatim-shaped payload; mixes park/school/neighbourhood hits."""
+    cell = int(abs(lat) * 1000) * 7 + int(abs(lng) * 1000)
+    address = {"city": "Springfield", "road": SYNTHETIC_STREETS[cell % len(SYNTHETIC_STREETS)],
+               "country_code": "us"}
+    kind = cell % 5
+    if kind == 0:
+        address["park"] = f"{SYNTHETIC_NAMES[cell % len(SYNTHETIC_NAMES)]} Park"
+    elif kind == 1:
+        address["school"] = f"{SYNTHETIC_NAMES[cell % len(SYNTHETIC_NAMES)]} High School"
+    elif kind in (2, 3):
+        address["neighbourhood"] = f"{SYNTHETIC_NAMES[(cell // 5) % len(SYNTHETIC_NAMES)]} Heights"
+    return {"lat": str(lat), "lon": str(lng), "display_name": ", ".join(address.values()), "address": address}
+
+
+def synthetic_count(south: float, west: float, north: float, east: float, density: float) -> int:
+    """
+    Elements in a bbox at `density` per square degree, weighted toward the
+    east (0.25x on the west coast, 1.75x on the east coast) so quadtree
+    partitioning has something uneven to adapt to.
+    """
+    mid_lng = (west + east) / 2
+    weight = 0.25 + 1.5 * min(max((mid_lng + 125.0) / 59.0, 0.0), 1.0)
+    return round(density * weight * (north - south) * (east - west))
+
+
+def regex_values(pattern: str) -> List[str]:
+    """The literal alternatives of a tag regex like ^(a|b)$ or a|b."""
+    core = pattern
+    if core.startswith("^"):
+        core = core[1:]
+    if core.endswith("$"):
+        core = core[:-1]
+    if core.startswith("(") and core.endswith(")"):
+        core = core[1:-1]
+    return core.split("|")
+
+
+def tag_sets(query: str) -> List[Dict[str, str]]:
+    """
+    The tag combinations a query asks for, in query order: one per statement,
+    and one per alternative of a `~` regex filter, so nwr["k"~"^(a|b)$"]
+    asks for k=a and k=b. Filters without a value (["k"]) are left out.
+    """
+    sets = []
+    for statement in _STATEMENT_RE.finditer(query):
+        options = [{}]
+        for key, op, value in _TAG_RE.findall(statement.group(1)):
+            values = [value] if op == "=" else regex_values(value)
+            options = [dict(option, **{key: v}) for option in options for v in values]
+        for option in options:
+            if option and option not in sets:
+                sets.append(option)
+    return sets or [{"sport": "basketball"}]
+
+
+def synthetic_overpass(query: str, elements: int, density: float = 0) -> Dict:
+    """
+    Elements scattered over the query's bbox (or `around:` circle): a block of
+    them for each tag combination the query asks for (see tag_sets). Each
+    block is seeded by the area and its tags, not the query text, so a union
+    query returns exactly the elements of the per-tag queries it replaces,
+    and the same query returns the same elements whatever the output format.
+    With a density, the element count per block scales with the bbox area,
+    and `out count` queries get just the total count.
+    """
+    body = _SETTINGS_RE.sub("", query, count=1)
+    bbox = _BBOX_RE.search(query)
+    around = _AROUND_RE.search(query)
+    if bbox:
+        south, west, north, east = (float(v) for v in bbox.groups())
+    elif around:
+        radius, lat, lon = (float(v) for v in around.groups())
+        dlat = radius / 111_000
+        south, west, north, east = lat - dlat, lon - dlat, lat + dlat, lon + dlat
+    else:
+        south, west, north, east = 24.0, -125.0, 49.5, -66.5
+    sets = tag_sets(body)
+    if density:
+        elements = synthetic_count(south, west, north, east, density)
+    if _COUNT_RE.search(body):
+        total = elements * len(sets)
+        ways = (elements // 3 + (1 if elements % 3 else 0)) * len(sets)
+        counts = {"nodes": total - ways, "ways": ways, "relations": 0, "total": total}
+        return {"version": 0.6, "generator": "hooprank mock_osm_server",
+                "elements": [{"type": "count", "id": 0, "tags": {k: str(v) for k, v in counts.items()}}]}
+
+    result = []
+    area = f"{south:.6f},{west:.6f},{north:.6f},{east:.6f}"
+    for tags in sets:
+        seed = area + json.dumps(tags, sort_keys=True)
+        rng = random.Random(seed)
+        base_id = int(hashlib.sha1(seed.encode("utf-8")).hexdigest()[:8], 16)
+        for i in range(elements):
+            lat = round(rng.uniform(south, north), 7)
+            lon = round(rng.uniform(west, east), 7)
+            element_tags = dict(tags)
+            if rng.random() < 0.8:
+                element_tags["name"] = f"{rng.choice(SYNTHETIC_NAMES)} {rng.choice(SYNTHETIC_SUFFIXES)}"
+            if rng.random() < 0.3:
+                element_tags["addr:city"] = "Springfield"
+                element_tags["addr:street"] = rng.choice(SYNTHETIC_STREETS)
+            if "sport" not in element_tags and rng.random() < 0.4:
+                element_tags["sport"] = rng.choice(["basketball", "multi", "tennis"])
+            if i % 3:
+                result.append({"type": "node", "id": base_id + i, "lat": lat, "lon": lon, "tags": element_tags})
+            else:
+                result.append({"type": "way", "id": base_id + i, "center": {"lat": lat, "lon": lon},
+                               "tags": element_tags})
+    return {
+        "version": 0.6,
+        "generator": "hooprank mock_osm_server",
+        "osm3s": {"timestamp_osm_base": "2026-01-01T00:00:00Z"},
+        "elements": result,
+    }
+
+
+def csv_format(query: str) -> Optional[Tuple[list, bool]]:
+    """(columns, header) of an [out:csv(...)] query, or None for JSON output."""
+    match = _CSV_RE.search(query)
+    if not match:
+        return None
+    parts = [part.strip() for part in match.group(1).split(";")]
+    columns = [column.strip().strip('"') for column in parts[0].split(",")]
+    header = len(parts) < 2 or parts[1] != "false"
+    return columns, header
+
+
+def render_csv(data: Dict, columns: list, header: bool) -> bytes:
+    """Overpass-style tab-separated output of a JSON response's elements."""
+    lines = ["\t".join(("@" + c[2:]) if c.startswith("::") else c for c in columns)] if header else []
+    for element in data.get("elements", []):
+        coords = element if element.get("type") == "node" else element.get("center", {})
+        meta = {"::type": element.get("type"), "::id": element.get("id"),
+                "::lat": coords.get("lat"), "::lon": coords.get("lon")}
+        tags = element.get("tags", {})
+        values = [meta.get(c) if c.startswith("::") else tags.get(c) for c in columns]
+        lines.append("\t".join("" if value is None else str(value) for value in values))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class MockState:
+    """Server config plus counters shared by the handler threads."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.counts: Dict[str, int] = {}
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.rng.random() < rate
+
+    def acquire_slot(self) -> bool:
+        with self.lock:
+            if self.args.slots and self.in_flight >= self.args.slots:
+                return False
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return True
+
+    def release_slot(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"counts": dict(self.counts), "in_flight": self.in_flight, "max_in_flight": self.max_in_flight}
+
+    def load_fixture(self, path: str) -> Optional[bytes]:
+        full = os.path.join(self.args.fixtures, path)
+        if os.path.exists(full):
+            with open(full, "rb") as f:
+                return f.read()
+        return None
+
+    def save_fixture(self, path: str, body: bytes):
+        full = os.path.join(self.args.fixtures, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        tmp = f"{full}.tmp{os.getpid()}"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, full)
+
+
+def _fetch_live(url: str, data: Optional[bytes] = None) -> bytes:
+    request = urllib.request.Request(url, data=data, headers={"User-Agent": "HoopRank-FixtureRecorder/1.0"})
+    with urllib.request.urlopen(request, timeout=600) as response:
+        return response.read()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState = None  # set by serve()
+
+    def log_message(self, fmt, *args):
+        if self.state.args.verbose:
+            super().log_message(fmt, *args)
+
+    # -- plumbing ----------------------------------------------------------
+
+    def _params(self) -> Tuple[str, Dict[str, str]]:
+        parsed = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        if self.command == "POST":
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode("utf-8")
+            params.update(urllib.parse.parse_qsl(body))
+        return parsed.path, params
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json",
+              headers: Optional[Dict[str, str]] = None):
+        args = self.state.args
+        truncate = status == 200 and len(body) > 1 and self.state.roll(args.truncate_rate)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if truncate:
+            # Declare the full length, send part of it and drop the connection
+            self.state.count("fault_truncated")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body[:random.randint(1, len(body) - 1)])
+            self.close_connection = True
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self):
+        args = self.state.args
+        if args.latency or args.jitter:
+            time.sleep(max(0.0, args.latency + random.uniform(-args.jitter, args.jitter)) / 1000)
+
+    def _injected_error(self) -> bool:
+        args = self.state.args
+        if self.state.roll(args.rate_429):
+            self.state.count("fault_429")
+            self._send(429, b"rate_limited", "text/plain", {"Retry-After": str(args.retry_after)})
+            return True
+        if self.state.roll(args.rate_504):
+            self.state.count("fault_504")
+            self._send(504, b"<html><body><h1>504 Gateway Time-out</h1></body></html>", "text/html")
+            return True
+        return False
+
+    # -- routes ------------------------------------------------------------
+
+    def do_GET(self):
+        self._route()
+
+    def do_POST(self):
+        self._route()
+
+    def _route(self):
+        path, params = self._params()
+        if path == "/__stats":
+            return self._send(200, json.dumps(self.state.stats()).encode())
+        if path == "/api/status":
+            return self._status()
+        if path == "/api/interpreter":
+            return self._overpass(params)
+        if path == "/reverse":
+            return self._nominatim(params)
+        self._send(404, b"not found", "text/plain")
+
+    def _status(self):
+        self.state.count("status")
+        slots = self.state.args.slots
+        stats = self.state.stats()
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        lines = ["Connected as: 2130706433", f"Current time: {now}", "Announced endpoint: none",
+                 f"Rate limit: {slots}"]
+        if slots:
+            free = max(0, slots - stats["in_flight"])
+            lines.append(f"{free} slots available now.")
+            retry_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + self.state.args.retry_after))
+            for _ in range(slots - free):
+                lines.append(f"Slot available after: {retry_at}, in {self.state.args.retry_after} seconds.")
+        lines.append("Currently running queries (pid, space limit, time limit, start time):")
+        self._send(200, ("\n".join(lines) + "\n").encode(), "text/plain")
+
+    def _overpass(self, params: Dict[str, str]):
+        self.state.count("overpass")
+        query = params.get("data", "")
+        if not self.state.acquire_slot():
+            self.state.count("fault_no_slot")
+            return self._send(429, b"rate_limited", "text/plain", {"Retry-After": str(self.state.args.retry_after)})
+        try:
+            self._delay()
+            if self._injected_error():
+                return
+            path = fixture_key("overpass", overpass_key(query))
+            body = self.state.load_fixture(path)
+            if body is None and self.state.args.record:
+                body = _fetch_live(self.state.args.live_overpass, urllib.parse.urlencode({"data": query}).encode())
+                self.state.save_fixture(path, body)
+                self.state.count("recorded")
+            if body is None:
+                self.state.count("synthetic")
+                body = json.dumps(synthetic_overpass(query, self.state.args.elements, self.state.args.density)).encode()
+            else:
+                self.state.count("fixture")
+            csv_spec = csv_format(query)
+            if csv_spec:
+                # Fixtures and synthetic data are JSON; project them like Overpass would
+                return self._send(200, render_csv(json.loads(body), *csv_spec), "text/csv")
+            if self.state.roll(self.state.args.remark_rate):
+                self.state.count("fault_remark")
+                data = json.loads(body)
+                data["elements"] = data.get("elements", [])[:len(data.get("elements", [])) // 2]
+                data["remark"] = "runtime error: Query ran out of memory in \"query\" at line 1. It would need more memory."
+                body = json.dumps(data).encode()
+            self._send(200, body)
+        finally:
+            self.state.release_slot()
+
+    def _nominatim(self, params: Dict[str, str]):
+        self.state.count("nominatim")
+        self._delay()
+        if self._injected_error():
+            return
+        path = fixture_key("nominatim", nominatim_key(params))
+        body = self.state.load_fixture(path)
+        if body is None and self.state.args.record:
+            body = _fetch_live(f"{self.state.args.live_nominatim}?{urllib.parse.urlencode(params)}")
+            self.state.save_fixture(path, body)
+            self.state.count("recorded")
+        if body is None:
+            self.state.count("synthetic")
+            body = json.dumps(synthetic_reverse_geocode(float(params.get("lat", 0)), float(params.get("lon", 0)))).encode()
+        else:
+            self.state.count("fixture")
+        self._send(200, body)
+
+
+def serve(args) -> ThreadingHTTPServer:
+    handler = type("MockHandler", (Handler,), {"state": MockState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Local Overpass/Nominatim stand-in for offline and load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="Directory of recorded responses")
+    parser.add_argument("--record", action="store_true", help="Fetch and save missing fixtures from the live APIs")
+    parser.add_argument("--live-overpass", default=LIVE_OVERPASS_URL, help="Overpass URL used by --record")
+    parser.add_argument("--live-nominatim", default=LIVE_NOMINATIM_URL, help="Nominatim URL used by --record")
+    parser.add_argument("--elements", type=int, default=200,
+                        help="Synthetic Overpass elements per tag combination in the query")
+    parser.add_argument("--density", type=float, default=0,
+                        help="Synthetic elements per square degree of the query bbox instead of --elements")
+    parser.add_argument("--latency", type=float, default=0, help="Added latency per request in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="Random +/- latency in ms")
+    parser.add_argument("--rate-429", type=float, default=0, help="Share of requests answered with 429")
+    parser.add_argument("--rate-504", type=float, default=0, help="Share of requests answered with 504")
+    parser.add_argument("--truncate-rate", type=float, default=0, help="Share of responses cut off mid-body")
+    parser.add_argument("--remark-rate", type=float, default=0, help="Share of Overpass responses returned partial with a remark")
+    parser.add_argument("--retry-after", type=int, default=2, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--slots", type=int, default=0, help="Concurrent Overpass queries allowed (0 = unlimited)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for fault injection")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    server = serve(args)
+    base = f"http://{args.host}:{server.server_address[1]}"
+    print(f"Mock Overpass/Nominatim listening on {base}")
+    print(f"  HOOPRANK_OVERPASS_URL={base}/api/interpreter")
+    print(f"  HOOPRANK_NOMINATIM_URL={base}/reverse")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.RequestHandlerClass.state.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,29 +8,101 @@ using reverse geocoding to derive neighborhood/street/park names from coordinate
 Usage:
   python name_courts.py --input mock_courts_data.dart --output named_courts_data.dart
   python name_courts.py --input mock_courts_data.dart --output named_courts_data.dart --limit 1000
+  python name_courts.py --input mock_courts_data.dart --output named_courts_data.dart --json-output courts_named.json
 """
 
 import argparse
+import hashlib
+import json
+import math
+import os
 import re
 import sys
 import time
-import random
-from typing import Optional, Dict, Tuple
+from collections import defaultdict
+from typing import Optional, Dict, List, Tuple
 import requests
 
-# Free geocoding API - Nominatim (OpenStreetMap)
-NOMINATIM_URL = "https://nominatim.openstreetmap.org/reverse"
+from dart_emitter import DART_STRING, dart_literal, dart_string, dart_unescape, is_dart_columns, read_dart_columns
+from geocode_cache import DEFAULT_CACHE_PATH, PLACE_RADIUS_M, REUSE_RADIUS_M, GeocodeCache
+from json_stream import JsonArrayWriter
+from pipeline_metrics import instrument, phase, record_counts
+from staged_output import replace_if_changed
+
+# Free geocoding API - Nominatim (OpenStreetMap); override with HOOPRANK_NOMINATIM_URL
+NOMINATIM_URL = os.environ.get("HOOPRANK_NOMINATIM_URL", "https://nominatim.openstreetmap.org/reverse")
 
 # Rate limiting for Nominatim (1 request per second)
 RATE_LIMIT_SECONDS = 1.1
 
-# Cache to avoid duplicate API calls for nearby coordinates
-coord_cache: Dict[Tuple[float, float], str] = {}
+# Courts within this many meters of a geocoded court share its name
+CLUSTER_RADIUS_M = 100
+
+# Suffixes to make names interesting (picked by pick_suffix)
+SUFFIXES = ["Court", "Hoops", "Courts", "Park Court", "Playground"]
+
+# Geocoded addresses, to avoid duplicate API calls for nearby coordinates
+coord_cache: Dict[Tuple[float, float], Dict] = {}
 
 def round_coords(lat: float, lng: float, precision: int = 3) -> Tuple[float, float]:
     """Round coordinates for caching (nearby courts get same name prefix)."""
     return (round(lat, precision), round(lng, precision))
 
+def haversine_distance(lat1, lng1, lat2, lng2):
+    """Calculate distance between two points in meters."""
+    R = 6371000  # Earth's radius in meters
+    
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lng = math.radians(lng2 - lng1)
+    
+    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lng/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    
+    return R * c
+
+def cluster_courts(courts: list, radius_m: float = CLUSTER_RADIUS_M) -> List[List[int]]:
+    """
+    Group courts into places before geocoding, so each place costs one
+    Nominatim call however its courts fall across rounding boundaries.
+    
+    Greedy, in input order: a court joins the first cluster whose
+    representative (its first court) is within radius_m, otherwise it
+    starts a new cluster. Every member is therefore within radius_m of the
+    point that gets geocoded. Returns lists of indexes into courts, the
+    representative first. radius_m <= 0 puts every court in its own cluster.
+    """
+    if radius_m <= 0:
+        return [[i] for i in range(len(courts))]
+    
+    # Grid of radius-sized cells holding cluster numbers; longitude cells
+    # shrink toward the poles, so search further east/west there
+    cell_deg = radius_m / 111_320
+    grid = defaultdict(list)
+    clusters: List[List[int]] = []
+    
+    for i, court in enumerate(courts):
+        lat, lng = court["lat"], court["lng"]
+        row, col = int(lat // cell_deg), int(lng // cell_deg)
+        span = math.ceil(1 / max(math.cos(math.radians(lat)), 0.01))
+        
+        found = None
+        for r in (row - 1, row, row + 1):
+            for c in range(col - span, col + span + 1):
+                for cluster_id in grid.get((r, c), ()):
+                    rep = courts[clusters[cluster_id][0]]
+                    if haversine_distance(lat, lng, rep["lat"], rep["lng"]) <= radius_m:
+                        if found is None or cluster_id < found:
+                            found = cluster_id
+        
+        if found is None:
+            grid[(row, col)].append(len(clusters))
+            clusters.append([i])
+        else:
+            clusters[found].append(i)
+    return clusters
+
 def reverse_geocode(lat: float, lng: float) -> Optional[Dict]:
     """
     Reverse geocode coordinates to get location info.
@@ -54,131 +126,178 @@ def reverse_geocode(lat: float, lng: float) -> Optional[Dict]:
         print(f"  [warn] Geocode failed for ({lat}, {lng}): {e}")
     return None
 
-def generate_court_name(lat: float, lng: float, original_name: str = "Basketball Court") -> str:
+def geocode_address(lat: float, lng: float, cache: Optional[GeocodeCache] = None) -> Optional[Dict]:
     """
-    Generate a meaningful court name from coordinates.
-    Returns names like "Mission District Court", "Oak Park Hoops", etc.
+    Nominatim address for coordinates (None if the lookup failed).
+    With a GeocodeCache, nearby cached responses are reused and new ones saved.
     """
     # Check cache first
     cache_key = round_coords(lat, lng)
     if cache_key in coord_cache:
         return coord_cache[cache_key]
     
-    # Rate limit
-    time.sleep(RATE_LIMIT_SECONDS)
-    
-    geo_data = reverse_geocode(lat, lng)
+    geo_data = cache.lookup(lat, lng) if cache is not None else None
+    if geo_data is None:
+        # Rate limit
+        with phase("rate_limit_sleep"):
+            time.sleep(RATE_LIMIT_SECONDS)
+        
+        with phase("geocode"):
+            geo_data = reverse_geocode(lat, lng)
+        if geo_data is not None and cache is not None:
+            cache.put(lat, lng, geo_data)
     if not geo_data or "address" not in geo_data:
-        return original_name
-    
-    addr = geo_data.get("address", {})
+        return None
     
+    coord_cache[cache_key] = geo_data.get("address", {})
+    return coord_cache[cache_key]
+
+
+def generate_court_name(lat: float, lng: float, original_name: str = "Basketball Court",
+                        cache: Optional[GeocodeCache] = None) -> str:
+    """
+    Generate a meaningful court name from coordinates.
+    Returns names like "Mission District Court", "Oak Park Hoops", etc.
+    """
+    addr = geocode_address(lat, lng, cache)
+    if addr is None:
+        return original_name
+    # None means no luck - keep original
+    return name_from_address(addr) or original_name
+
+
+def pick_suffix(*parts: str) -> str:
+    """
+    One of SUFFIXES, chosen by a hash of parts rather than at random, so the
+    same address always gets the same name and reruns change nothing.
+    """
+    digest = hashlib.sha1("|".join(parts).encode("utf-8")).digest()
+    return SUFFIXES[int.from_bytes(digest[:4], "big") % len(SUFFIXES)]
+
+
+def name_from_address(addr: Dict) -> Optional[str]:
+    """
+    Derive a court name from a Nominatim address (None if nothing usable).
+    A pure function of the address, which also picks the suffix: every court
+    geocoded to one place gets one name, whichever script named it.
+    """
+    place = json.dumps(addr, sort_keys=True)
     # Try to find a good name source in priority order
-    name_candidates = []
     
     # 1. Park or playground name (best source)
     if park := addr.get("park"):
-        name = f"{park} Court"
-        coord_cache[cache_key] = name
-        return name
+        return f"{park} Court"
     
     if playground := addr.get("playground"):
-        name = f"{playground} Court"
-        coord_cache[cache_key] = name
-        return name
+        return f"{playground} Court"
     
     # 2. Recreation ground or sports centre
     if rec := addr.get("recreation_ground"):
-        name = f"{rec} Court"
-        coord_cache[cache_key] = name
-        return name
+        return f"{rec} Court"
     
     # 3. School or university (for campus courts)
     if school := addr.get("school"):
-        name = f"{school} Basketball Court"
-        coord_cache[cache_key] = name
-        return name
+        return f"{school} Basketball Court"
     
     if university := addr.get("university"):
-        name = f"{university} Court"
-        coord_cache[cache_key] = name
-        return name
+        return f"{university} Court"
     
     # 4. Neighbourhood + descriptor
     neighbourhood = addr.get("neighbourhood") or addr.get("suburb") or addr.get("quarter")
     city = addr.get("city") or addr.get("town") or addr.get("village") or addr.get("municipality")
     road = addr.get("road")
     
-    # Suffixes to make names interesting
-    suffixes = ["Court", "Hoops", "Courts", "Park Court", "Playground"]
-    suffix = random.choice(suffixes)
-    
     if neighbourhood:
-        name = f"{neighbourhood} {suffix}"
-        coord_cache[cache_key] = name
-        return name
+        return f"{neighbourhood} {pick_suffix(place, neighbourhood)}"
     
     # 5. Road + descriptor
     if road:
         # Clean up road name
         road_clean = road.replace(" Street", " St").replace(" Avenue", " Ave").replace(" Boulevard", " Blvd")
-        name = f"{road_clean} {suffix}"
-        coord_cache[cache_key] = name
-        return name
+        return f"{road_clean} {pick_suffix(place, road_clean)}"
     
     # 6. City-level fallback
     if city:
-        name = f"{city} Public Court"
-        coord_cache[cache_key] = name
-        return name
+        return f"{city} Public Court"
     
-    # No luck - keep original
-    return original_name
+    return None
+
+
+# Keys parse_dart_courts adds to locate an entry in the file
+TEXT_KEYS = ("full_match", "start", "end")
+
+# Any Dart literal the emitter writes for an optional field (see dart_value)
+_DART_VALUE = r"(?:'(?:[^'\\\n]|\\.)*'|null|true|false|[\d.eE+-]+)"
+COURT_RE = re.compile(
+    r"\{\s*'id':\s*" + DART_STRING + r",\s*'name':\s*" + DART_STRING
+    + r",\s*'lat':\s*([\d.-]+),\s*'lng':\s*([\d.-]+),?"
+    + r"((?:\s*'[\w:]+':\s*" + _DART_VALUE + r",?)*)\s*\}"
+)
+FIELD_RE = re.compile(r"'([\w:]+)':\s*(" + _DART_VALUE + ")")
 
 
 def parse_dart_courts(content: str) -> list:
     """
     Parse Dart mock_courts_data.dart and extract court entries.
-    Returns list of dicts with id, name, lat, lng, and the original text block.
+    Returns list of dicts with id, name, lat, lng, the optional fields
+    (address, city, ...) and the original text block (TEXT_KEYS).
     
     Handles multi-line format like:
       {
         'id': 'osm_123',
-        'name': 'Basketball Court',
+        'name': 'St. Mary\\'s Court',
         'lat': 37.123,
         'lng': -122.456,
+        'city': 'San Francisco',
       },
     """
-    # Match each court entry block (multi-line, with optional fields)
-    pattern = r"\{\s*'id':\s*'([^']+)',\s*'name':\s*'([^']*)',\s*'lat':\s*([\d.-]+),\s*'lng':\s*([\d.-]+),?(?:\s*'[^']*':\s*'[^']*',?)*\s*\}"
-    
     courts = []
-    for match in re.finditer(pattern, content, re.DOTALL):
-        courts.append({
-            "id": match.group(1),
-            "name": match.group(2),
+    for match in COURT_RE.finditer(content):
+        court = {
+            "id": dart_unescape(match.group(1)),
+            "name": dart_unescape(match.group(2)),
             "lat": float(match.group(3)),
             "lng": float(match.group(4)),
-            "full_match": match.group(0),
-            "start": match.start(),
-            "end": match.end(),
-        })
+        }
+        for key, literal in FIELD_RE.findall(match.group(5)):
+            court[key] = dart_literal(literal)
+        court.update(full_match=match.group(0), start=match.start(), end=match.end())
+        courts.append(court)
     return courts
 
 
+@instrument("name_courts")
 def main():
+    global NOMINATIM_URL
     parser = argparse.ArgumentParser(description="Name generic basketball courts using reverse geocoding")
     parser.add_argument("--input", required=True, help="Input Dart file (mock_courts_data.dart)")
     parser.add_argument("--output", required=True, help="Output Dart file with named courts")
+    parser.add_argument("--json-output", help="Also write the named courts as a JSON array (courts_named.json)")
     parser.add_argument("--limit", type=int, default=0, help="Limit number of courts to process (0 = all)")
     parser.add_argument("--dry-run", action="store_true", help="Preview changes without writing")
+    parser.add_argument("--nominatim-url", default=NOMINATIM_URL, help="Reverse geocoding endpoint")
+    parser.add_argument("--cluster-radius", type=float, default=CLUSTER_RADIUS_M,
+                        help=f"Geocode one court per cluster of courts this many meters apart (default: {CLUSTER_RADIUS_M}, 0 = off)")
+    parser.add_argument("--geocode-cache", default=DEFAULT_CACHE_PATH,
+                        help="Persistent geocode cache (SQLite) reused across runs ('' = off)")
+    parser.add_argument("--cache-radius", type=float, default=REUSE_RADIUS_M,
+                        help=f"Reuse any cached geocode this many meters away (default: {REUSE_RADIUS_M})")
+    parser.add_argument("--place-radius", type=float, default=PLACE_RADIUS_M,
+                        help=f"Reuse a cached park/school geocode this many meters away (default: {PLACE_RADIUS_M})")
     args = parser.parse_args()
+    NOMINATIM_URL = args.nominatim_url
     
     print(f"Reading {args.input}..."); sys.stdout.flush()
-    with open(args.input, "r") as f:
-        content = f.read()
-    
-    courts = parse_dart_courts(content)
+    # fetch_osm_courts --columnar files are read as records and written back as columns
+    columnar = is_dart_columns(args.input)
+    with phase("parse"):
+        if columnar:
+            content = None
+            courts = read_dart_columns(args.input)
+        else:
+            with open(args.input, "r") as f:
+                content = f.read()
+            courts = parse_dart_courts(content)
     print(f"Found {len(courts):,} courts"); sys.stdout.flush()
     
     # Filter to only "Basketball Court" entries
@@ -189,28 +308,41 @@ def main():
         generic_courts = generic_courts[:args.limit]
         print(f"  - Processing first {args.limit} courts")
     
+    # Geocode one representative per place and fan its name out
+    with phase("cluster"):
+        clusters = cluster_courts(generic_courts, args.cluster_radius)
+    print(f"  - {len(clusters):,} places within {args.cluster_radius:g} m to geocode"); sys.stdout.flush()
+    
+    cache = GeocodeCache(args.geocode_cache, args.cache_radius, args.place_radius) if args.geocode_cache else None
+    
     # Generate names
     renamed = 0
-    replacements = []
+    new_names = {}
     
-    for i, court in enumerate(generic_courts):
+    for i, cluster in enumerate(clusters):
         if i % 100 == 0:
-            print(f"  Progress: {i:,}/{len(generic_courts):,} ({renamed} renamed)")
+            print(f"  Progress: {i:,}/{len(clusters):,} places ({renamed} renamed)")
             sys.stdout.flush()
         
-        new_name = generate_court_name(court["lat"], court["lng"], court["name"])
-        
-        if new_name != court["name"]:
+        rep = generic_courts[cluster[0]]
+        addr = geocode_address(rep["lat"], rep["lng"], cache)
+        new_name = name_from_address(addr) if addr is not None else None
+        if new_name is None:
+            continue
+        for index in cluster:
+            court = generic_courts[index]
             renamed += 1
-            old_entry = court["full_match"]
-            new_entry = old_entry.replace(f"'name': 'Basketball Court'", f"'name': '{new_name}'")
-            replacements.append((old_entry, new_entry))
+            new_names[court["id"]] = new_name
             
             if args.dry_run and renamed <= 10:
                 print(f"    [{court['id']}] ({court['lat']:.4f}, {court['lng']:.4f})")
                 print(f"      -> {new_name}")
     
     print(f"\nTotal renamed: {renamed:,}/{len(generic_courts):,}")
+    if cache is not None:
+        print(f"Geocode cache: {cache.describe()}")
+        cache.close()
+    record_counts(records_in=len(generic_courts), records_out=renamed)
     
     if args.dry_run:
         print("\n[DRY RUN] No files written.")
@@ -218,14 +350,36 @@ def main():
     
     # Apply replacements
     print(f"Writing to {args.output}...")
-    new_content = content
-    for old, new in replacements:
-        new_content = new_content.replace(old, new, 1)
-    
-    with open(args.output, "w") as f:
-        f.write(new_content)
+    if columnar:
+        from fetch_osm_courts import generate_dart_file
+        generate_dart_file([dict(c, name=new_names.get(c["id"], c["name"])) for c in courts],
+                           args.output, columnar=True)
+    else:
+        new_content = content
+        for court in courts:
+            if court["id"] in new_names:
+                old_entry = court["full_match"]
+                new_entry = old_entry.replace("'name': 'Basketball Court'",
+                                              f"'name': {dart_string(new_names[court['id']])}")
+                new_content = new_content.replace(old_entry, new_entry, 1)
+        
+        # Unchanged names leave the output untouched (same bytes and mtime)
+        tmp_path = f"{args.output}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            f.write(new_content)
+        
+        if replace_if_changed(tmp_path, args.output):
+            print(f"[done] Wrote {args.output}")
+        else:
+            print(f"[done] {args.output} unchanged")
     
-    print(f"[done] Wrote {args.output}")
+    if args.json_output:
+        with JsonArrayWriter(args.json_output) as writer:
+            for court in courts:
+                record = {k: v for k, v in court.items() if k not in TEXT_KEYS}
+                record["name"] = new_names.get(court["id"], court["name"])
+                writer.write(record)
+        print(f"[done] Wrote {args.json_output} ({len(courts):,} courts)")
 
 
 if __name__ == "__main__":
@@ -12,15 +12,19 @@ Usage:
 import argparse
 import json
 import os
-import re
 import sys
 import time
-import random
 from typing import Optional, Dict, Tuple
 import requests
 
-# Free geocoding API - Nominatim (OpenStreetMap)
-NOMINATIM_URL = "https://nominatim.openstreetmap.org/reverse"
+from dart_emitter import dart_string
+from geocode_cache import DEFAULT_CACHE_PATH, GeocodeCache
+from name_courts import name_from_address, parse_dart_courts
+from pipeline_metrics import instrument, phase, record_counts
+from staged_output import STATE_DIR
+
+# Free geocoding API - Nominatim (OpenStreetMap); override with HOOPRANK_NOMINATIM_URL
+NOMINATIM_URL = os.environ.get("HOOPRANK_NOMINATIM_URL", "https://nominatim.openstreetmap.org/reverse")
 
 # Rate limiting for Nominatim (1 request per second)
 RATE_LIMIT_SECONDS = 1.1
@@ -28,6 +32,9 @@ RATE_LIMIT_SECONDS = 1.1
 # Progress file to enable resuming
 PROGRESS_FILE = "/tmp/court_naming_progress.json"
 
+# Append-only log of {"id", "name"} per named court, tailed by apply_named_courts --incremental
+JOURNAL_FILE = os.path.join(STATE_DIR, "court_naming_journal.jsonl")
+
 def load_progress() -> Dict:
     """Load progress from file if it exists."""
     if os.path.exists(PROGRESS_FILE):
@@ -67,75 +74,57 @@ def reverse_geocode(lat: float, lng: float) -> Optional[Dict]:
         pass
     return None
 
-def generate_court_name(lat: float, lng: float, coord_cache: Dict) -> Optional[str]:
-    """Generate a meaningful court name from coordinates."""
+def generate_court_name(lat: float, lng: float, coord_cache: Dict,
+                        geocode_cache: Optional[GeocodeCache] = None) -> Optional[str]:
+    """
+    Generate a meaningful court name from coordinates. With a GeocodeCache,
+    nearby cached responses are reused and new ones saved.
+    """
     cache_key = f"{round(lat, 3)},{round(lng, 3)}"
     if cache_key in coord_cache:
         return coord_cache[cache_key]
     
-    time.sleep(RATE_LIMIT_SECONDS)
-    
-    geo_data = reverse_geocode(lat, lng)
+    geo_data = geocode_cache.lookup(lat, lng) if geocode_cache is not None else None
+    if geo_data is None:
+        with phase("rate_limit_sleep"):
+            time.sleep(RATE_LIMIT_SECONDS)
+        
+        with phase("geocode"):
+            geo_data = reverse_geocode(lat, lng)
+        if geo_data is not None and geocode_cache is not None:
+            geocode_cache.put(lat, lng, geo_data)
     if not geo_data or "address" not in geo_data:
         return None
     
-    addr = geo_data.get("address", {})
-    
-    # Priority order for name sources
-    if park := addr.get("park"):
-        name = f"{park} Court"
-    elif playground := addr.get("playground"):
-        name = f"{playground} Court"
-    elif rec := addr.get("recreation_ground"):
-        name = f"{rec} Court"
-    elif school := addr.get("school"):
-        name = f"{school} Basketball Court"
-    elif university := addr.get("university"):
-        name = f"{university} Court"
-    elif neighbourhood := (addr.get("neighbourhood") or addr.get("suburb") or addr.get("quarter")):
-        suffixes = ["Court", "Hoops", "Courts", "Park Court", "Playground"]
-        name = f"{neighbourhood} {random.choice(suffixes)}"
-    elif road := addr.get("road"):
-        road_clean = road.replace(" Street", " St").replace(" Avenue", " Ave").replace(" Boulevard", " Blvd")
-        suffixes = ["Court", "Hoops", "Courts", "Park Court", "Playground"]
-        name = f"{road_clean} {random.choice(suffixes)}"
-    elif city := (addr.get("city") or addr.get("town") or addr.get("village")):
-        name = f"{city} Public Court"
-    else:
-        return None
-    
-    coord_cache[cache_key] = name
+    # Names are kept per rounded cell (apply_named_courts reads them that
+    # way). The name depends only on the address, as in name_courts, so both
+    # scripts give a place the same name
+    name = name_from_address(geo_data.get("address", {}))
+    if name is not None:
+        coord_cache[cache_key] = name
     return name
 
 
-def parse_dart_courts(content: str) -> list:
-    """Parse Dart mock_courts_data.dart and extract court entries."""
-    pattern = r"\{\s*'id':\s*'([^']+)',\s*'name':\s*'([^']*)',\s*'lat':\s*([\d.-]+),\s*'lng':\s*([\d.-]+),?(?:\s*'[^']*':\s*'[^']*',?)*\s*\}"
-    
-    courts = []
-    for match in re.finditer(pattern, content, re.DOTALL):
-        courts.append({
-            "id": match.group(1),
-            "name": match.group(2),
-            "lat": float(match.group(3)),
-            "lng": float(match.group(4)),
-            "full_match": match.group(0),
-        })
-    return courts
-
-
+@instrument("name_courts_resumable")
 def main():
+    global NOMINATIM_URL
     parser = argparse.ArgumentParser(description="Name generic basketball courts (resumable)")
     parser.add_argument("--input", required=True, help="Input Dart file")
     parser.add_argument("--output", required=True, help="Output Dart file")
     parser.add_argument("--batch-size", type=int, default=500, help="Save progress every N courts")
     parser.add_argument("--reset", action="store_true", help="Reset progress and start fresh")
+    parser.add_argument("--nominatim-url", default=NOMINATIM_URL, help="Reverse geocoding endpoint")
+    parser.add_argument("--geocode-cache", default=DEFAULT_CACHE_PATH,
+                        help="Persistent geocode cache (SQLite) reused across runs ('' = off)")
     args = parser.parse_args()
+    NOMINATIM_URL = args.nominatim_url
     
     # Load or reset progress
     if args.reset and os.path.exists(PROGRESS_FILE):
         os.remove(PROGRESS_FILE)
         print("Progress reset.")
+    if args.reset and os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
     
     progress = load_progress()
     coord_cache = progress.get("completed", {})
@@ -145,7 +134,8 @@ def main():
     with open(args.input, "r") as f:
         content = f.read()
     
-    courts = parse_dart_courts(content)
+    with phase("parse"):
+        courts = parse_dart_courts(content)
     print(f"Found {len(courts):,} courts"); sys.stdout.flush()
     
     # Filter to only "Basketball Court" entries
@@ -155,9 +145,14 @@ def main():
     if start_index > 0:
         print(f"  - Resuming from index {start_index} ({len(coord_cache)} already named)"); sys.stdout.flush()
     
+    geocode_cache = GeocodeCache(args.geocode_cache) if args.geocode_cache else None
     renamed_count = len(coord_cache)
     replacements = []
     
+    # Line-buffered, so every name is visible to apply_named_courts right away
+    os.makedirs(os.path.dirname(JOURNAL_FILE), exist_ok=True)
+    journal = open(JOURNAL_FILE, "a", buffering=1)
+    
     # Generate names for remaining courts
     for i in range(start_index, len(generic_courts)):
         court = generic_courts[i]
@@ -172,11 +167,14 @@ def main():
             save_progress(progress)
             print(f"  [saved progress at {i}]"); sys.stdout.flush()
         
-        new_name = generate_court_name(court["lat"], court["lng"], coord_cache)
+        new_name = generate_court_name(court["lat"], court["lng"], coord_cache, geocode_cache)
         
         if new_name:
             renamed_count += 1
             replacements.append((court["id"], court["full_match"], new_name))
+            journal.write(json.dumps({"id": court["id"], "name": new_name}) + "\n")
+    
+    journal.close()
     
     # Final save
     progress["completed"] = coord_cache
@@ -184,12 +182,16 @@ def main():
     save_progress(progress)
     
     print(f"\nTotal renamed: {renamed_count:,}/{len(generic_courts):,}"); sys.stdout.flush()
+    if geocode_cache is not None:
+        print(f"Geocode cache: {geocode_cache.describe()}")
+        geocode_cache.close()
+    record_counts(records_in=len(generic_courts), records_out=renamed_count)
     
     # Apply replacements to content
     print(f"Writing to {args.output}..."); sys.stdout.flush()
     new_content = content
     for court_id, old_entry, new_name in replacements:
-        new_entry = old_entry.replace("'name': 'Basketball Court'", f"'name': '{new_name}'")
+        new_entry = old_entry.replace("'name': 'Basketball Court'", f"'name': {dart_string(new_name)}")
         new_content = new_content.replace(old_entry, new_entry, 1)
     
     with open(args.output, "w") as f:
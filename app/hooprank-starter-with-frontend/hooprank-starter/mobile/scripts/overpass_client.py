@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Shared Overpass HTTP client for the fetch scripts.
+
+The fetchers used to call bare `requests.post` per query: a new connection
+every time, no retry, a fixed sleep between queries, and any 429/504 came back
+as `[]`, silently dropping a whole region or venue type.
+
+OverpassClient keeps one pooled, gzip-enabled Session and:
+
+  - retries 429/5xx, connection errors, truncated bodies and partial results
+    (Overpass answers 200 with a "runtime error" remark on timeouts/OOM),
+    with exponential backoff plus jitter, honouring Retry-After
+  - paces queries from the server's /api/status: if a slot is free the next
+    query goes straight away, otherwise it waits until the announced time
+  - raises OverpassError once retries are exhausted, so callers can record
+    the unit as failed instead of treating it as empty
+  - query_elements() decodes the "elements" array straight off the socket
+    with json_stream and transforms each element as it arrives, so a
+    national response is never materialized as one big dict
+
+run_units() runs a list of units (regions, venue types, cities) through a
+fetch function, gives failed units a second pass after a cooldown, and
+records whatever still fails in .pipeline/failed_units/<stage>.json.
+"""
+
+import email.utils
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from json_stream import iter_json_array
+from staged_output import STATE_DIR, write_json_atomic
+
+DEFAULT_OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+
+# Public mirrors that overpass_scheduler.MirrorScheduler can spread load over
+OVERPASS_MIRRORS = [
+    "https://overpass-api.de/api/interpreter",
+    "https://overpass.kumi.systems/api/interpreter",
+    "https://overpass.openstreetmap.ru/api/interpreter",
+]
+# Set to use one endpoint only (e.g. a local mock_osm_server.py)
+if os.environ.get("HOOPRANK_OVERPASS_URL"):
+    OVERPASS_MIRRORS = [os.environ["HOOPRANK_OVERPASS_URL"]]
+USER_AGENT = "HoopRank-CourtFetcher/1.0 (brett@hooprank.app)"
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Response bytes read per step when streaming elements
+STREAM_CHUNK_SIZE = 1 << 16
+FAILED_UNITS_DIR = os.path.join(STATE_DIR, "failed_units")
+
+_SLOTS_FREE_RE = re.compile(r"^(\d+) slots? available now", re.MULTILINE)
+_SLOT_WAIT_RE = re.compile(r"in (-?\d+) seconds", re.MULTILINE)
+_RATE_LIMIT_RE = re.compile(r"^Rate limit: (\d+)", re.MULTILINE)
+
+
+class OverpassError(Exception):
+    """A query that still failed after all retries."""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        # HTTP status and Retry-After of the last attempt, if it got that far
+        self.status = status
+        self.retry_after = retry_after
+
+
+def default_overpass_url() -> str:
+    return os.environ.get("HOOPRANK_OVERPASS_URL", DEFAULT_OVERPASS_URL)
+
+
+def status_url(interpreter_url: str) -> str:
+    return interpreter_url.rsplit("/", 1)[0] + "/status"
+
+
+def parse_status(text: str) -> Dict:
+    """
+    Parse an Overpass /api/status page into
+    {"rate_limit": int, "free": int, "wait": seconds until the next slot frees}.
+    "free" is infinite when the server has no rate limit ("Rate limit: 0").
+    """
+    rate_limit = _RATE_LIMIT_RE.search(text)
+    rate_limit = int(rate_limit.group(1)) if rate_limit else None
+    free = _SLOTS_FREE_RE.search(text)
+    waits = [max(0, int(s)) for s in _SLOT_WAIT_RE.findall(text)]
+    if rate_limit == 0:
+        free_slots = float("inf")
+    else:
+        free_slots = int(free.group(1)) if free else 0
+    return {
+        "rate_limit": rate_limit,
+        "free": free_slots,
+        "wait": min(waits) if waits else 0,
+    }
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Retry-After header as seconds (it may be a delay or an HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def make_session(pool_size: int = 8) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"})
+    return session
+
+
+class OverpassClient:
+    """Pooled Overpass client with retries and slot-based pacing."""
+
+    def __init__(self, url: Optional[str] = None, max_retries: int = 5, backoff_base: float = 2.0,
+                 backoff_max: float = 120.0, min_delay: float = 0.0, fallback_delay: float = 2.0,
+                 session: Optional[requests.Session] = None, paced: bool = True):
+        self.url = url or default_overpass_url()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.min_delay = min_delay
+        # Used between queries when the server has no /api/status
+        self.fallback_delay = fallback_delay
+        self.session = session or make_session()
+        # Unpaced clients leave slot accounting to the caller (see overpass_scheduler)
+        self.paced = paced
+        self.has_status = True
+        self._last_query = 0.0
+
+    # -- pacing ------------------------------------------------------------
+
+    def slot_status(self) -> Optional[Dict]:
+        """The server's slot status, or None if it is unavailable right now."""
+        if not self.has_status:
+            return None
+        try:
+            response = self.session.get(status_url(self.url), timeout=15)
+        except requests.RequestException:
+            return None
+        if response.status_code == 404:
+            self.has_status = False
+        if response.status_code != 200 or _RATE_LIMIT_RE.search(response.text) is None:
+            return None
+        return parse_status(response.text)
+
+    def wait_for_slot(self, max_wait: float = 300.0):
+        """Block until the server reports a free query slot."""
+        since_last = time.time() - self._last_query
+        if since_last < self.min_delay:
+            time.sleep(self.min_delay - since_last)
+        if not self.paced:
+            return
+
+        waited = 0.0
+        while waited < max_wait:
+            status = self.slot_status()
+            if status is None:
+                # No status page: fall back to a fixed gap between queries
+                gap = self.fallback_delay - (time.time() - self._last_query)
+                if gap > 0:
+                    time.sleep(gap)
+                return
+            if status["free"] > 0:
+                return
+            delay = min(max(status["wait"], 1), max_wait - waited)
+            time.sleep(delay)
+            waited += delay
+
+    # -- querying ----------------------------------------------------------
+
+    def _backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max) + random.uniform(0, 1)
+        return min(self.backoff_base * (2 ** attempt), self.backoff_max) * random.uniform(0.5, 1.0)
+
+    def _post_once(self, query: str, timeout: float, stream: bool) -> Tuple[Optional[requests.Response], Dict]:
+        """
+        One POST attempt. Returns (response, {}) on success, or (None, failure)
+        for a transient failure, with "error", "status" and "retry_after" for
+        the caller's retry loop. Raises OverpassError on a non-retryable status.
+        """
+        self.wait_for_slot()
+        self._last_query = time.time()
+        try:
+            response = self.session.post(self.url, data={"data": query}, timeout=timeout, stream=stream)
+        except requests.RequestException as e:
+            return None, {"error": f"{type(e).__name__}: {e}"}
+
+        if response.status_code in RETRY_STATUSES:
+            response.close()
+            return None, {"error": f"HTTP {response.status_code}", "status": response.status_code,
+                          "retry_after": retry_after_seconds(response.headers.get("Retry-After"))}
+        if response.status_code != 200:
+            response.close()
+            raise OverpassError(f"HTTP {response.status_code} from {self.url}", status=response.status_code)
+        return response, {}
+
+    def _retry(self, query: str, timeout: float, stream: bool, decode: Optional[Callable] = None) -> Any:
+        """
+        POST a query until it succeeds, with one budget of max_retries retries
+        for every kind of failure. With `decode`, run decode(response) ->
+        (result, remark) and also retry bodies cut off mid-transfer, HTML
+        error pages and partial results; without it, return the response.
+        """
+        failure: Dict = {}
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                wait = self._backoff(attempt - 1, failure.get("retry_after"))
+                print(f"    [retry {attempt}/{self.max_retries}] {failure['error']}; waiting {wait:.0f}s")
+                time.sleep(wait)
+            response, failure = self._post_once(query, timeout, stream)
+            if response is None:
+                continue
+            if decode is None:
+                return response
+            try:
+                result, remark = decode(response)
+            except (requests.RequestException, ValueError) as e:
+                failure = {"error": f"bad response body: {type(e).__name__}"}
+                continue
+            finally:
+                response.close()
+            if "runtime error" in (remark or ""):
+                failure = {"error": f"partial result ({remark[:80]})"}
+                continue
+            return result
+        raise OverpassError(f"Gave up after {self.max_retries + 1} attempts: {failure['error']}",
+                            status=failure.get("status"), retry_after=failure.get("retry_after"))
+
+    def post(self, query: str, timeout: float = 600, stream: bool = False) -> requests.Response:
+        """
+        POST a query, retrying transient failures. Returns the successful
+        response; raises OverpassError when retries run out.
+        """
+        return self._retry(query, timeout, stream)
+
+    def query(self, query: str, timeout: float = 600) -> Dict:
+        """Run a query and return the decoded JSON, retrying partial results too."""
+        def decode(response):
+            data = response.json()
+            return data, data.get("remark")
+
+        return self._retry(query, timeout, False, decode)
+
+    def query_elements(self, query: str, transform: Optional[Callable] = None, timeout: float = 600,
+                       chunk_size: int = STREAM_CHUNK_SIZE) -> Tuple[List, int]:
+        """
+        Stream the "elements" of a query's response and apply transform to
+        each one as it is decoded, keeping only non-None results. The raw
+        payload is never held in memory; a failed or partial stream is
+        discarded and retried as a whole. Returns (results, raw element count).
+        """
+        def decode(response):
+            results = []
+            count = 0
+            trailer: Dict = {}
+            body = response.iter_content(chunk_size=chunk_size)
+            for element in iter_json_array(body, key="elements", trailer=trailer):
+                count += 1
+                item = transform(element) if transform else element
+                if item is not None:
+                    results.append(item)
+            return (results, count), trailer.get("remark")
+
+        return self._retry(query, timeout, True, decode)
+
+    def query_csv(self, query: str, transform: Optional[Callable] = None, timeout: float = 600,
+                  chunk_size: int = STREAM_CHUNK_SIZE) -> Tuple[List, int]:
+        """
+        Stream an `[out:csv(...)]` query (see csv_setting) line by line. Each
+        row is passed to transform as {column: value}, with metadata columns
+        named "::id", "::lat", ... and "" for missing tags, keeping non-None
+        results like query_elements. Returns (results, row count).
+        """
+        def decode(response):
+            # text/csv defaults to ISO-8859-1 in requests; Overpass sends UTF-8
+            response.encoding = "utf-8"
+            lines = response.iter_lines(chunk_size=chunk_size, decode_unicode=True)
+            # The header names metadata columns "@id", "@lat", ...
+            columns = ["::" + c[1:] if c.startswith("@") else c for c in next(lines, "").split(CSV_SEPARATOR)]
+            results = []
+            count = 0
+            remark = None
+            for line in lines:
+                if not line:
+                    continue
+                if line.startswith("runtime "):
+                    remark = line
+                    continue
+                count += 1
+                row = dict(zip(columns, line.split(CSV_SEPARATOR)))
+                item = transform(row) if transform else row
+                if item is not None:
+                    results.append(item)
+            return (results, count), remark
+
+        return self._retry(query, timeout, True, decode)
+
+
+CSV_SEPARATOR = "\t"
+
+
+def csv_setting(columns: Iterable[str]) -> str:
+    """
+    The `[out:csv(...)]` setting projecting only `columns` ("::type", "::id",
+    "::lat", "::lon" for metadata, plain names for tags), with a header row.
+    Overpass separates columns with tabs by default, so commas in names survive.
+    """
+    fields = ",".join(column if column.startswith("::") else f'"{column}"' for column in columns)
+    return f"[out:csv({fields};true)]"
+
+
+def failed_units_path(stage: str) -> str:
+    return os.path.join(FAILED_UNITS_DIR, f"{stage}.json")
+
+
+def load_failed_units(stage: str) -> List[str]:
+    try:
+        with open(failed_units_path(stage), "r") as f:
+            return [entry["unit"] for entry in json.load(f)["failed"]]
+    except (FileNotFoundError, ValueError, KeyError):
+        return []
+
+
+def record_failed_units(stage: str, failures: List[Tuple[str, str]]):
+    """Persist failed units for a later retry pass; clears the file when none failed."""
+    path = failed_units_path(stage)
+    if not failures:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    write_json_atomic(path, {
+        "stage": stage,
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "failed": [{"unit": unit, "error": error} for unit, error in failures],
+    })
+
+
+def run_units(stage: str, units: Iterable, fetch: Callable, label: Callable = str,
+              retry_passes: int = 1, cooldown: float = 60.0) -> Tuple[Dict, List[Tuple[str, str]]]:
+    """
+    Call fetch(unit) for every unit. Units that raise OverpassError get
+    `retry_passes` more tries after `cooldown` seconds. Returns
+    ({unit: result}, [(unit label, error)] for units that never succeeded);
+    the failures are also written to .pipeline/failed_units/<stage>.json.
+    """
+    results: Dict = {}
+    pending = list(units)
+    failures: List[Tuple] = []
+    for pass_number in range(retry_passes + 1):
+        if pass_number:
+            print(f"\n  Retry pass {pass_number}: {len(pending)} failed unit(s) after {cooldown:.0f}s cooldown")
+            time.sleep(cooldown)
+        failures = []
+        for unit in pending:
+            try:
+                results[unit] = fetch(unit)
+            except OverpassError as e:
+                print(f"    FAILED {label(unit)}: {e}")
+                failures.append((unit, str(e)))
+        pending = [unit for unit, _ in failures]
+        if not pending:
+            break
+
+    failed = [(label(unit), error) for unit, error in failures]
+    record_failed_units(stage, failed)
+    return results, failed
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Slot-aware Overpass scheduler that spreads queued jobs over several mirrors.
+
+Each public Overpass instance gives a client a handful of query slots and
+publishes how many are free on /api/status. Using one mirror at a time caps
+throughput at that mirror's slots no matter how many mirrors exist.
+
+MirrorScheduler keeps a queue of jobs (regions, venue types, cities) and,
+for every mirror, polls its slot status and keeps as many jobs in flight as
+it has free slots. Whenever a mirror frees a slot the next queued job goes
+to the first mirror (in list order) with room. A failed job goes back on the
+queue so another mirror can pick it up.
+
+A mirror leaves the rotation for a while when it fails several jobs in a
+row, or when its average latency degrades well past the fastest mirror's.
+It is put back on probation after `bench_seconds`.
+
+Usage:
+    scheduler = MirrorScheduler(OVERPASS_MIRRORS)
+    results, failed = scheduler.run_units("fetch_indoor_gyms", VENUE_TYPES,
+                                          lambda client, vt: fetch_venues_batch(client, region, vt))
+
+The fetch callback gets an OverpassClient bound to the chosen mirror, so the
+same functions work with a single client (overpass_client.run_units) or here.
+"""
+
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from overpass_client import OverpassClient, OverpassError, record_failed_units
+
+# Weight of the newest sample in a mirror's latency average
+LATENCY_EWMA_ALPHA = 0.3
+
+# 429s a job may hit before they start counting as failed attempts
+MAX_BUSY_BOUNCES = 10
+
+
+class Mirror:
+    """Slot and health bookkeeping for one Overpass endpoint."""
+
+    def __init__(self, url: str, min_delay: float = 0.0):
+        self.url = url
+        # Retries are the scheduler's job: one attempt per dispatch
+        self.client = OverpassClient(url, max_retries=0, min_delay=min_delay, paced=False)
+        self.active = 0
+        self.capacity = 1
+        self.next_poll = 0.0
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.benched_until = 0.0
+        self.completed = 0
+        self.failed = 0
+
+    def record_success(self, seconds: float):
+        self.completed += 1
+        self.failures = 0
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = LATENCY_EWMA_ALPHA * seconds + (1 - LATENCY_EWMA_ALPHA) * self.latency
+
+    def describe(self) -> str:
+        latency = f"{self.latency:.1f}s" if self.latency is not None else "n/a"
+        return f"{self.url}: {self.completed} ok, {self.failed} failed, avg latency {latency}"
+
+
+class MirrorScheduler:
+    """Route queued Overpass jobs to whichever mirror has a free slot."""
+
+    def __init__(self, urls: List[str], max_attempts: int = 4, max_slots: int = 4,
+                 poll_interval: float = 5.0, latency_factor: float = 3.0,
+                 min_degraded_latency: float = 10.0, max_failures: int = 3,
+                 bench_seconds: float = 300.0, min_delay: float = 0.0):
+        if not urls:
+            raise ValueError("MirrorScheduler needs at least one Overpass URL")
+        self.mirrors = [Mirror(url, min_delay) for url in urls]
+        self.max_attempts = max_attempts
+        # Upper bound on concurrent queries per mirror, whatever its status says
+        self.max_slots = max_slots
+        self.poll_interval = poll_interval
+        self.latency_factor = latency_factor
+        self.min_degraded_latency = min_degraded_latency
+        self.max_failures = max_failures
+        self.bench_seconds = bench_seconds
+
+    # -- mirror state ------------------------------------------------------
+
+    def refresh(self, mirror: Mirror, now: float):
+        """Re-read a mirror's free slots and set how many jobs it may run."""
+        status = mirror.client.slot_status()
+        if status is None:
+            # No status page: one query at a time
+            mirror.capacity = 1
+            mirror.next_poll = now + self.poll_interval
+            return
+        mirror.capacity = min(mirror.active + status["free"], self.max_slots)
+        if status["free"] > 0:
+            mirror.next_poll = now + self.poll_interval
+        else:
+            mirror.next_poll = now + max(status["wait"], 1)
+
+    def in_rotation(self, mirror: Mirror, now: float) -> bool:
+        if mirror.benched_until > now:
+            return False
+        if mirror.benched_until:
+            print(f"  [mirror] {mirror.url} back in rotation")
+            mirror.benched_until = 0.0
+            mirror.failures = 0
+            mirror.latency = None
+        return True
+
+    def bench(self, mirror: Mirror, now: float, reason: str):
+        # Never bench the last mirror in rotation; backoff alone has to do
+        if all(m.benched_until > now for m in self.mirrors if m is not mirror):
+            return
+        print(f"  [mirror] taking {mirror.url} out of rotation for {self.bench_seconds:.0f}s: {reason}")
+        mirror.benched_until = now + self.bench_seconds
+
+    def check_latency(self, mirror: Mirror, now: float):
+        if mirror.benched_until > now:
+            return
+        peers = [m.latency for m in self.mirrors
+                 if m is not mirror and m.latency is not None and m.benched_until <= now]
+        if mirror.latency is None or not peers:
+            return
+        threshold = max(self.min_degraded_latency, self.latency_factor * min(peers))
+        if mirror.latency > threshold:
+            self.bench(mirror, now, f"latency {mirror.latency:.1f}s vs best {min(peers):.1f}s")
+
+    def record_busy(self, mirror: Mirror, error: OverpassError, now: float):
+        """A 429: the status page was stale, so stop sending until the slot frees."""
+        mirror.capacity = mirror.active
+        mirror.next_poll = now + (error.retry_after if error.retry_after is not None else 1)
+
+    def record_failure(self, mirror: Mirror, error: OverpassError, now: float):
+        mirror.failed += 1
+        mirror.failures += 1
+        # Don't hand this mirror more work until it says it has room again
+        mirror.capacity = 0
+        backoff = min(2 ** mirror.failures, 60)
+        mirror.next_poll = now + (error.retry_after if error.retry_after is not None else backoff)
+        if mirror.failures >= self.max_failures:
+            self.bench(mirror, now, f"{mirror.failures} failures in a row")
+
+    # -- running -----------------------------------------------------------
+
+    def run_units(self, stage: str, units: Iterable, fetch: Callable, label: Callable = str,
+                  on_done: Optional[Callable] = None) -> Tuple[Dict, List[Tuple[str, str]]]:
+        """
+        Call fetch(client, unit) for every unit, spread over the mirrors.
+        Returns ({unit: result}, [(unit label, error)]) like
+        overpass_client.run_units, and records failures the same way.
+        """
+        queue = deque((unit, 0) for unit in units)
+        results: Dict = {}
+        failures: List[Tuple[str, str]] = []
+        inflight: Dict = {}
+        bounces: Dict = {}
+
+        with ThreadPoolExecutor(max_workers=len(self.mirrors) * self.max_slots) as pool:
+            while queue or inflight:
+                now = time.time()
+                for mirror in self.mirrors:
+                    if not queue:
+                        break
+                    if not self.in_rotation(mirror, now):
+                        continue
+                    if now >= mirror.next_poll:
+                        self.refresh(mirror, now)
+                    while queue and mirror.active < mirror.capacity:
+                        unit, attempt = queue.popleft()
+                        mirror.active += 1
+                        future = pool.submit(fetch, mirror.client, unit)
+                        inflight[future] = (mirror, unit, attempt, time.time())
+
+                if not inflight:
+                    # Every mirror is out of slots; sleep until the next one is due
+                    due = min(max(m.next_poll, m.benched_until) for m in self.mirrors)
+                    time.sleep(min(max(due - time.time(), 0.05), self.poll_interval))
+                    continue
+
+                done, _ = wait(list(inflight), timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    mirror, unit, attempt, started = inflight.pop(future)
+                    mirror.active -= 1
+                    now = time.time()
+                    try:
+                        results[unit] = future.result()
+                    except OverpassError as e:
+                        if e.status == 429 and bounces.get(unit, 0) < MAX_BUSY_BOUNCES:
+                            # Not the job's fault; requeue without using up an attempt
+                            bounces[unit] = bounces.get(unit, 0) + 1
+                            self.record_busy(mirror, e, now)
+                            queue.appendleft((unit, attempt))
+                            continue
+                        print(f"    [{mirror.url}] {label(unit)} failed (attempt {attempt + 1}): {e}")
+                        self.record_failure(mirror, e, now)
+                        if attempt + 1 < self.max_attempts:
+                            queue.append((unit, attempt + 1))
+                            continue
+                        failures.append((label(unit), str(e)))
+                    else:
+                        mirror.record_success(now - started)
+                        self.check_latency(mirror, now)
+                        # A slot just freed up; re-read the status before reusing it
+                        mirror.next_poll = now
+                    if on_done:
+                        on_done(unit)
+
+        print("  Mirror summary:")
+        for mirror in self.mirrors:
+            print(f"    {mirror.describe()}")
+        record_failed_units(stage, failures)
+        return results, failures
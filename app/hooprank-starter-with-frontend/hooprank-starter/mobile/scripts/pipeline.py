@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Incremental runner for the court data pipeline.
+
+Each script is declared below as a node with its inputs, outputs and
+parameters. A node's key is the hash of its script (plus the helper modules it
+imports), its arguments and the contents of its inputs. A node is skipped when
+its key matches the last successful run and its outputs still hash to what
+that run produced, so only the part of the graph downstream of a real change
+is rebuilt. If a rebuilt node writes byte-identical outputs, its dependents
+stay skipped.
+
+Nodes whose dependencies are done run in parallel subprocesses, so the indoor
+branch (fetch -> filter -> dedupe) and the outdoor branch (fetch -> name) run
+at the same time; both then feed the cross-source and outdoor dedupe passes.
+Every file is written by exactly one node and the graph has no cycles
+(dependencies() checks both), so a build right after another one runs nothing.
+Hashes are cached by size/mtime, so a no-op rebuild doesn't re-read any data
+and finishes in well under a second.
+
+Intermediate files go to .pipeline/work/; final outputs are the files the app
+ships (lib/services/indoor_gyms_data.dart, assets/data/courts*.json and the
+map's precomputed marker clusters, assets/data/court_clusters.bin). The
+vector tile archive for static tile hosting goes to .pipeline/court_tiles.mbtiles.
+Network fetches have no inputs, so they only rerun when forced.
+
+Usage:
+  python pipeline.py                       # bring everything up to date
+  python pipeline.py dedupe_indoor         # just that node and what it needs
+  python pipeline.py --force fetch_indoor  # refetch, then rebuild downstream
+  python pipeline.py --list                # show the graph and what is stale
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from staged_output import STATE_DIR, file_digest, write_json_atomic
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+MOBILE_DIR = os.path.dirname(SCRIPTS_DIR)
+WORK_DIR = os.path.join(STATE_DIR, "work")
+LOG_DIR = os.path.join(STATE_DIR, "logs")
+STATE_FILE = os.path.join(STATE_DIR, "pipeline.json")
+
+INDOOR_GYMS_FILE = os.path.join(MOBILE_DIR, "lib", "services", "indoor_gyms_data.dart")
+MOCK_COURTS_FILE = os.path.join(MOBILE_DIR, "lib", "services", "mock_courts_data.dart")
+OUTDOOR_COURTS_FILE = os.path.join(MOBILE_DIR, "assets", "data", "courts_named.json")
+COURTS_FILE = os.path.join(MOBILE_DIR, "assets", "data", "courts.json")
+CLUSTERS_FILE = os.path.join(MOBILE_DIR, "assets", "data", "court_clusters.bin")
+TILES_FILE = os.path.join(STATE_DIR, "court_tiles.mbtiles")
+
+
+def work(name: str) -> str:
+    return os.path.join(WORK_DIR, name)
+
+
+@dataclass
+class Node:
+    name: str
+    script: str
+    args: List[str]
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    # Scripts that do their own up-to-date check get --force passed through
+    accepts_force: bool = False
+
+
+def build_graph(indoor_region: str = "usa", outdoor_region: str = "bay_area") -> List[Node]:
+    raw_gyms = work("indoor_gyms_raw.dart")
+    filtered_gyms = work("indoor_gyms_filtered.dart")
+    deduped_gyms = work("indoor_gyms_deduped.dart")
+    raw_courts = work("courts_raw.dart")
+    named_courts = work("courts_named.json")
+    return [
+        # Indoor branch
+        Node("fetch_indoor", "fetch_indoor_gyms.py",
+             ["--region", indoor_region, "--output", raw_gyms],
+             outputs=[raw_gyms, raw_gyms.replace(".dart", ".json")]),
+        Node("filter_indoor", "filter_false_positives.py",
+             ["--input", raw_gyms, "--output", filtered_gyms],
+             inputs=[raw_gyms], outputs=[filtered_gyms], accepts_force=True),
+        Node("dedupe_indoor", "deduplicate_indoor_gyms.py",
+             ["--input", filtered_gyms, "--output", deduped_gyms],
+             inputs=[filtered_gyms], outputs=[deduped_gyms], accepts_force=True),
+        # Outdoor branch
+        Node("fetch_outdoor", "fetch_osm_courts.py",
+             ["--region", outdoor_region, "--output", raw_courts],
+             outputs=[raw_courts]),
+        # Writes the app's Dart courts file and the JSON the dedupe passes read
+        Node("name_outdoor", "name_courts.py",
+             ["--input", raw_courts, "--output", MOCK_COURTS_FILE, "--json-output", named_courts],
+             inputs=[raw_courts], outputs=[MOCK_COURTS_FILE, named_courts]),
+        # Join: indoor gyms vs the named outdoor courts, then outdoor courts
+        # vs the remaining gyms. Both read the named courts before the outdoor
+        # dedupe, which writes courts_named.json from them.
+        Node("cross_source", "cross_source_dedupe.py",
+             ["--outdoor", named_courts, "--indoor", deduped_gyms, "--output", INDOOR_GYMS_FILE],
+             inputs=[named_courts, deduped_gyms], outputs=[INDOOR_GYMS_FILE], accepts_force=True),
+        Node("dedupe_outdoor", "comprehensive_dedupe.py",
+             ["--input", named_courts, "--outdoor", OUTDOOR_COURTS_FILE, "--courts", COURTS_FILE,
+              "--indoor", INDOOR_GYMS_FILE],
+             inputs=[named_courts, INDOOR_GYMS_FILE], outputs=[OUTDOOR_COURTS_FILE, COURTS_FILE],
+             accepts_force=True),
+        Node("cluster_outdoor", "build_court_clusters.py",
+             ["--input", OUTDOOR_COURTS_FILE, "--output", CLUSTERS_FILE],
+             inputs=[OUTDOOR_COURTS_FILE], outputs=[CLUSTERS_FILE], accepts_force=True),
+        Node("export_tiles", "export_court_tiles.py",
+             ["--outdoor", OUTDOOR_COURTS_FILE, "--indoor", INDOOR_GYMS_FILE, "--output", TILES_FILE],
+             inputs=[OUTDOOR_COURTS_FILE, INDOOR_GYMS_FILE], outputs=[TILES_FILE], accepts_force=True),
+    ]
+
+
+def dependencies(graph: List[Node]) -> Dict[str, List[str]]:
+    """
+    Node name -> names of the nodes that write one of its inputs. Raises
+    ValueError if two nodes write the same file or the nodes form a cycle;
+    either would make every build rerun part of the graph.
+    """
+    writers = {}
+    for node in graph:
+        for path in node.outputs:
+            if path in writers:
+                raise ValueError(f"{path} is written by both {writers[path]} and {node.name}")
+            writers[path] = node.name
+    deps = {
+        node.name: sorted({writers[p] for p in node.inputs if p in writers} - {node.name})
+        for node in graph
+    }
+
+    # Depth-first search; a node reached again while still on the path closes a cycle
+    visiting, visited = [], set()
+
+    def visit(name: str):
+        if name in visiting:
+            cycle = visiting[visiting.index(name):] + [name]
+            raise ValueError(f"Dependency cycle: {' -> '.join(reversed(cycle))}")
+        if name in visited:
+            return
+        visiting.append(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.pop()
+        visited.add(name)
+
+    for node in graph:
+        visit(node.name)
+    return deps
+
+
+def select(graph: List[Node], targets: List[str]) -> List[Node]:
+    """`targets` plus everything they depend on, in graph order."""
+    if not targets:
+        return graph
+    names = {n.name for n in graph}
+    unknown = [t for t in targets if t not in names]
+    if unknown:
+        raise SystemExit(f"Unknown node(s): {', '.join(unknown)} (see --list)")
+    deps = dependencies(graph)
+    wanted = set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name not in wanted:
+            wanted.add(name)
+            stack.extend(deps[name])
+    return [n for n in graph if n.name in wanted]
+
+
+_IMPORT_RE = re.compile(r"^(?:from|import)\s+(\w+)", re.MULTILINE)
+
+
+def script_files(script: str) -> List[str]:
+    """The script plus the local helper modules it imports, transitively."""
+    seen = []
+    stack = [os.path.join(SCRIPTS_DIR, script)]
+    while stack:
+        path = stack.pop()
+        if path in seen or not os.path.exists(path):
+            continue
+        seen.append(path)
+        with open(path, "r") as f:
+            for module in _IMPORT_RE.findall(f.read()):
+                stack.append(os.path.join(SCRIPTS_DIR, module + ".py"))
+    return sorted(seen)
+
+
+def node_key(node: Node, cache: Dict) -> str:
+    """
+    Hash of everything that determines the node's outputs. Files the node
+    rewrites in place are left out; they are checked as outputs instead.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([node.script, node.args]).encode())
+    for path in script_files(node.script):
+        h.update(f"{os.path.basename(path)}:{file_digest(path, cache)}\n".encode())
+    for path in node.inputs:
+        if path not in node.outputs:
+            h.update(f"{path}:{file_digest(path, cache)}\n".encode())
+    return h.hexdigest()
+
+
+def is_up_to_date(node: Node, key: str, state: Dict, cache: Dict) -> bool:
+    last = state["nodes"].get(node.name)
+    if not last or last["key"] != key:
+        return False
+    return all(file_digest(path, cache) == last["outputs"].get(path) for path in node.outputs)
+
+
+def load_state() -> Dict:
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"nodes": {}, "stat_cache": {}}
+
+
+def run_node(node: Node, force: bool) -> tuple:
+    """Run one script as a subprocess; returns (returncode, seconds, log path)."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    for path in node.outputs:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    log_path = os.path.join(LOG_DIR, f"{node.name}.log")
+    cmd = [sys.executable, node.script] + node.args
+    if force and node.accepts_force:
+        cmd.append("--force")
+    start = time.time()
+    with open(log_path, "w") as log:
+        log.write("$ " + " ".join(cmd) + "\n")
+        log.flush()
+        proc = subprocess.run(cmd, cwd=SCRIPTS_DIR, stdout=log, stderr=subprocess.STDOUT)
+    return proc.returncode, time.time() - start, log_path
+
+
+def tail(path: str, lines: int = 15) -> str:
+    with open(path, "r", errors="replace") as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def run(graph: List[Node], forced: List[str], force_all: bool = False, jobs: int = 4,
+        dry_run: bool = False) -> bool:
+    """Bring `graph` up to date. Returns False if any node failed."""
+    state = load_state()
+    cache = state.setdefault("stat_cache", {})
+    deps = dependencies(graph)
+    names = {n.name for n in graph}
+    pending = {n.name: n for n in graph}
+    done, failed, stale = set(), set(), set()
+    ran = 0
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while pending or running:
+            # Start every node whose dependencies have finished
+            for name, node in list(pending.items()):
+                node_deps = [d for d in deps[name] if d in names]
+                if any(d in failed for d in node_deps):
+                    print(f"  [skip]  {name} (upstream failed)")
+                    failed.add(name)
+                    del pending[name]
+                    continue
+                if not all(d in done for d in node_deps):
+                    continue
+                del pending[name]
+
+                force = force_all or name in forced
+                if dry_run and (force or any(d in stale for d in node_deps)):
+                    print(f"  [stale] {name}")
+                    stale.add(name)
+                    done.add(name)
+                    continue
+                missing = [p for p in node.inputs if not os.path.exists(p)]
+                if missing:
+                    print(f"  [fail]  {name}: missing input {missing[0]}")
+                    failed.add(name)
+                    continue
+                key = node_key(node, cache)
+                if not force and is_up_to_date(node, key, state, cache):
+                    print(f"  [ok]    {name}")
+                    done.add(name)
+                    continue
+                if dry_run:
+                    print(f"  [stale] {name}")
+                    stale.add(name)
+                    done.add(name)
+                    continue
+                print(f"  [run]   {name}: {node.script} {' '.join(node.args)}")
+                running[pool.submit(run_node, node, force)] = (node, key)
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node, key = running.pop(future)
+                returncode, seconds, log_path = future.result()
+                ran += 1
+                if returncode != 0:
+                    print(f"  [fail]  {node.name} (exit {returncode}, {seconds:.1f}s), log: {log_path}")
+                    print(tail(log_path))
+                    failed.add(node.name)
+                    continue
+                absent = [p for p in node.outputs if not os.path.exists(p)]
+                if absent:
+                    print(f"  [fail]  {node.name} finished but did not write {absent[0]}, log: {log_path}")
+                    failed.add(node.name)
+                    continue
+                state["nodes"][node.name] = {
+                    "key": key,
+                    "outputs": {p: file_digest(p, cache) for p in node.outputs},
+                    "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "seconds": round(seconds, 1),
+                }
+                # Saved as we go so an interrupted run keeps what finished
+                write_json_atomic(STATE_FILE, state)
+                print(f"  [done]  {node.name} ({seconds:.1f}s)")
+                done.add(node.name)
+
+    if not dry_run:
+        # Persist the refreshed stat cache even when nothing ran
+        write_json_atomic(STATE_FILE, state)
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the court data pipeline, skipping unchanged steps")
+    parser.add_argument("targets", nargs="*", help="Nodes to bring up to date (default: all)")
+    parser.add_argument("--force", nargs="+", default=[], metavar="NODE", help="Rerun these nodes even if up to date")
+    parser.add_argument("--force-all", action="store_true", help="Rerun every selected node")
+    parser.add_argument("--jobs", type=int, default=4, help="Max nodes running at once (default: 4)")
+    parser.add_argument("--indoor-region", default="usa", help="Region for fetch_indoor_gyms.py (default: usa)")
+    parser.add_argument("--outdoor-region", default="bay_area", help="Region for fetch_osm_courts.py (default: bay_area)")
+    parser.add_argument("--list", action="store_true", help="Show the graph and which nodes are stale")
+    args = parser.parse_args()
+
+    graph = build_graph(args.indoor_region, args.outdoor_region)
+    start = time.time()
+
+    if args.list:
+        deps = dependencies(graph)
+        for node in graph:
+            after = f" (after {', '.join(deps[node.name])})" if deps[node.name] else ""
+            print(f"  {node.name}: {node.script}{after}")
+        print()
+        run(select(graph, args.targets), args.force, args.force_all, dry_run=True)
+        return
+
+    ok = run(select(graph, args.targets), args.force, args.force_all, args.jobs)
+    print(f"\n{'Pipeline up to date' if ok else 'Pipeline FAILED'} in {time.time() - start:.2f}s")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
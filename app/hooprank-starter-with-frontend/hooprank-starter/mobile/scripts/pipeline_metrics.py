@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Per-stage metrics for the court pipeline scripts.
+
+Wrap a script's main() with @instrument("stage_name") and every run records:
+
+  - wall time, CPU time and peak RSS
+  - records in / out (reported by the script via record_counts())
+  - time spent in named phases (`with phase("parse"):`)
+  - HTTP request counts by host and status, response bytes and a latency
+    histogram, captured from every `requests` call made during the run
+
+At exit the run is written as a JSON summary (.pipeline/metrics/<stage>.json,
+plus a timestamped copy under history/) and as a Prometheus textfile
+(<stage>.prom) that node_exporter's textfile collector can pick up. Set
+HOOPRANK_METRICS_DIR to write them somewhere else.
+
+Profiling is opt-in: HOOPRANK_PROFILE=cprofile saves a .prof file (and the top
+functions in the JSON summary); HOOPRANK_PROFILE=pyinstrument saves an HTML
+report if pyinstrument is installed.
+
+Usage:
+  from pipeline_metrics import instrument, phase, record_counts
+
+  @instrument("filter_false_positives")
+  def main():
+      with phase("parse"):
+          entries = parse_indoor_gyms(input_file)
+      ...
+      record_counts(records_in=len(entries), records_out=len(valid_entries))
+"""
+
+import functools
+import io
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from staged_output import STATE_DIR
+
+METRICS_DIR = os.environ.get("HOOPRANK_METRICS_DIR") or os.path.join(STATE_DIR, "metrics")
+
+# Upper bounds (seconds) of the HTTP latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_active: Optional["StageMetrics"] = None
+
+
+class StageMetrics:
+    """Counters and timers for one run of one stage."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started_at = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_bytes = 0
+        self.records_in: Optional[int] = None
+        self.records_out: Optional[int] = None
+        self.phases: Dict[str, float] = {}
+        # host -> {"requests": {status: n}, "bytes": n, "buckets": [...], "sum": s, "count": n}
+        self.http: Dict[str, Dict] = {}
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.profile: Optional[Dict] = None
+
+    def observe_http(self, url: str, status, nbytes: int, seconds: float):
+        host = urlparse(url).netloc or url
+        entry = self.http.setdefault(host, {
+            "requests": {}, "bytes": 0, "buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0,
+        })
+        status = str(status)
+        entry["requests"][status] = entry["requests"].get(status, 0) + 1
+        entry["bytes"] += nbytes
+        entry["sum"] += seconds
+        entry["count"] += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                entry["buckets"][i] += 1
+
+    def observe_http_bytes(self, url: str, nbytes: int):
+        host = urlparse(url).netloc or url
+        if host in self.http:
+            self.http[host]["bytes"] += nbytes
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.wall_seconds = time.perf_counter() - self.wall_start
+        self.cpu_seconds = time.process_time() - self.cpu_start
+        self.peak_rss_bytes = _peak_rss_bytes()
+        if error is None:
+            self.status = "ok"
+        else:
+            self.status = "error"
+            self.error = f"{type(error).__name__}: {error}"
+
+    def summary(self) -> Dict:
+        return {
+            "stage": self.stage,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "status": self.status,
+            "error": self.error,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "records_in": self.records_in,
+            "records_out": self.records_out,
+            "phases": {k: round(v, 3) for k, v in self.phases.items()},
+            "http": {
+                host: dict(entry, sum=round(entry["sum"], 3), buckets=dict(zip(map(str, LATENCY_BUCKETS), entry["buckets"])))
+                for host, entry in self.http.items()
+            },
+            "profile": self.profile,
+        }
+
+    def prometheus(self) -> str:
+        """The run in Prometheus text exposition format."""
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join(f'{k}="{_label(v)}"' for k, v in [("stage", self.stage)] + labels)
+                lines.append(f"{name}{{{label_str}}} {value}")
+
+        metric("hooprank_stage_last_run_timestamp_seconds", "gauge", "Start time of the last run.",
+               [([], round(self.started_at, 3))])
+        metric("hooprank_stage_success", "gauge", "1 if the last run finished without an exception.",
+               [([], 1 if self.status == "ok" else 0)])
+        metric("hooprank_stage_wall_seconds", "gauge", "Wall-clock duration of the last run.",
+               [([], round(self.wall_seconds, 3))])
+        metric("hooprank_stage_cpu_seconds", "gauge", "CPU time of the last run.",
+               [([], round(self.cpu_seconds, 3))])
+        metric("hooprank_stage_peak_rss_bytes", "gauge", "Peak resident set size of the last run.",
+               [([], self.peak_rss_bytes)])
+        if self.records_in is not None:
+            metric("hooprank_stage_records_in", "gauge", "Records read by the last run.", [([], self.records_in)])
+        if self.records_out is not None:
+            metric("hooprank_stage_records_out", "gauge", "Records written by the last run.", [([], self.records_out)])
+        if self.phases:
+            metric("hooprank_stage_phase_seconds", "gauge", "Wall time per phase of the last run.",
+                   [([("phase", p)], round(s, 3)) for p, s in self.phases.items()])
+        if self.http:
+            metric("hooprank_http_requests_total", "counter", "HTTP requests by host and status.",
+                   [([("host", h), ("status", s)], n) for h, e in self.http.items() for s, n in e["requests"].items()])
+            metric("hooprank_http_response_bytes_total", "counter", "HTTP response bytes by host.",
+                   [([("host", h)], e["bytes"]) for h, e in self.http.items()])
+            samples = []
+            for host, e in self.http.items():
+                for bound, count in zip(LATENCY_BUCKETS, e["buckets"]):
+                    samples.append(([("host", host), ("le", str(bound))], count))
+                samples.append(([("host", host), ("le", "+Inf")], e["count"]))
+            lines.append("# HELP hooprank_http_request_duration_seconds HTTP request latency by host.")
+            lines.append("# TYPE hooprank_http_request_duration_seconds histogram")
+            for labels, value in samples:
+                label_str = ",".join(f'{k}="{_label(v)}"' for k, v in [("stage", self.stage)] + labels)
+                lines.append(f"hooprank_http_request_duration_seconds_bucket{{{label_str}}} {value}")
+            for host, e in self.http.items():
+                label_str = f'stage="{_label(self.stage)}",host="{_label(host)}"'
+                lines.append(f"hooprank_http_request_duration_seconds_sum{{{label_str}}} {round(e['sum'], 3)}")
+                lines.append(f"hooprank_http_request_duration_seconds_count{{{label_str}}} {e['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str = METRICS_DIR):
+        os.makedirs(os.path.join(directory, "history"), exist_ok=True)
+        summary = self.summary()
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(self.started_at))
+        _write_atomic(os.path.join(directory, f"{self.stage}.json"), json.dumps(summary, indent=2))
+        _write_atomic(os.path.join(directory, "history", f"{self.stage}-{stamp}.json"), json.dumps(summary))
+        _write_atomic(os.path.join(directory, f"{self.stage}.prom"), self.prometheus())
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path: str, text: str):
+    # node_exporter may read the .prom file at any moment
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current() -> Optional[StageMetrics]:
+    """Metrics of the stage running in this process, if any."""
+    return _active
+
+
+def record_counts(records_in: Optional[int] = None, records_out: Optional[int] = None):
+    """Report how many records the stage read and wrote."""
+    if _active is None:
+        return
+    if records_in is not None:
+        _active.records_in = records_in
+    if records_out is not None:
+        _active.records_out = records_out
+
+
+@contextmanager
+def phase(name: str):
+    """Time a named part of the stage; repeated phases accumulate."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _active is not None:
+            _active.phases[name] = _active.phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def observe_http(url: str, status, nbytes: int, seconds: float):
+    if _active is not None:
+        _active.observe_http(url, status, nbytes, seconds)
+
+
+def observe_http_bytes(url: str, nbytes: int):
+    """Add body bytes to a request already counted by observe_http."""
+    if _active is not None:
+        _active.observe_http_bytes(url, nbytes)
+
+
+class _CountingRaw:
+    """
+    Stand-in for a streamed response's `raw` that reports the body bytes as
+    they are read (after decompression, like `len(response.content)`).
+    Content-Length can't be used: chunked responses don't send it and for
+    gzip it is the compressed size.
+    """
+
+    def __init__(self, raw, url: str):
+        self._raw = raw
+        self._url = url
+
+    def read(self, *args, **kwargs):
+        data = self._raw.read(*args, **kwargs)
+        observe_http_bytes(self._url, len(data or b""))
+        return data
+
+    def stream(self, *args, **kwargs):
+        # requests' iter_content/iter_lines read through here
+        for chunk in self._raw.stream(*args, **kwargs):
+            observe_http_bytes(self._url, len(chunk))
+            yield chunk
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def _patch_requests():
+    """
+    Route every `requests` call through observe_http. requests.get/post and
+    Session methods all end in Session.send, so patching it covers the bare
+    module-level calls the fetchers use. Returns an undo function.
+    """
+    requests = sys.modules.get("requests")
+    if requests is None:
+        return lambda: None
+    original = requests.Session.send
+
+    def send(session, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = original(session, request, **kwargs)
+        except Exception as e:
+            observe_http(request.url, type(e).__name__, 0, time.perf_counter() - start)
+            raise
+        if kwargs.get("stream"):
+            # The body hasn't been read yet; its bytes are added as it is
+            response.raw = _CountingRaw(response.raw, request.url)
+            nbytes = 0
+        else:
+            nbytes = len(response.content or b"")
+        observe_http(request.url, response.status_code, nbytes, time.perf_counter() - start)
+        return response
+
+    requests.Session.send = send
+
+    def undo():
+        requests.Session.send = original
+    return undo
+
+
+@contextmanager
+def _profiler(stage: str, metrics: StageMetrics):
+    mode = os.environ.get("HOOPRANK_PROFILE", "").lower()
+    if mode == "cprofile":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"{stage}.prof")
+            profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(20)
+            metrics.profile = {"mode": "cprofile", "path": path, "top": out.getvalue().splitlines()[-30:]}
+            print(f"[metrics] cProfile stats written to {path}", file=sys.stderr)
+    elif mode == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("[metrics] HOOPRANK_PROFILE=pyinstrument but pyinstrument is not installed", file=sys.stderr)
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"{stage}.html")
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+            metrics.profile = {"mode": "pyinstrument", "path": path}
+            print(f"[metrics] pyinstrument report written to {path}", file=sys.stderr)
+    else:
+        yield
+
+
+@contextmanager
+def stage_metrics(stage: str):
+    """Collect metrics for the enclosed block and write them on exit."""
+    global _active
+    metrics = StageMetrics(stage)
+    previous, _active = _active, metrics
+    undo = _patch_requests()
+    error = None
+    try:
+        with _profiler(stage, metrics):
+            yield metrics
+    except BaseException as e:
+        # SystemExit(0) from argparse --help etc. is not a failure
+        if not (isinstance(e, SystemExit) and not e.code):
+            error = e
+        raise
+    finally:
+        undo()
+        _active = previous
+        metrics.finish(error)
+        try:
+            metrics.write()
+        except OSError as e:
+            print(f"[metrics] could not write metrics for {stage}: {e}", file=sys.stderr)
+
+
+def instrument(stage: str):
+    """Decorator for a script's main(): run it inside stage_metrics(stage)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_metrics(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Adaptive quadtree partitioning of a bounding box into Overpass query tiles.
+
+Hand-drawn regions overlap (so the same elements download twice) and are
+badly unbalanced (sparse regions waste a query, dense ones time out). This
+module splits a bounding box into quadtree leaves so that each leaf is
+expected to hold at most `max_elements` elements:
+
+  - the estimate comes from a DensityGrid saved by the previous run (element
+    counts per grid cell), or, without one, from cheap Overpass `out count`
+    queries issued as the tree is built
+  - leaves never overlap: they tile the bounds, and leaf_owns() assigns an
+    element on a shared edge (or a way whose bbox spans two leaves) to
+    exactly one leaf using half-open intervals
+  - the leaf plan is cached as JSON and reused while the bounds and budget
+    are unchanged and no leaf came back over budget
+
+Usage:
+    plan = load_plan(path, bounds, max_elements)
+    if plan is None:
+        grid = DensityGrid.load(density_path)
+        count = grid.count if grid else count_fn
+        plan = build_plan(bounds, count, max_elements)
+        save_plan(path, plan)
+"""
+
+import json
+import math
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from staged_output import write_json_atomic
+
+Bbox = Tuple[float, float, float, float]  # (south, west, north, east)
+
+# Grid cell size (degrees) for density estimates saved between runs
+DENSITY_CELL_DEG = 0.25
+
+# Leaves are not split below this size even if still over budget
+MIN_LEAF_DEG = 0.25
+
+# A leaf that returns more than this share of the budget invalidates the plan
+OVER_BUDGET_FACTOR = 1.5
+
+
+def split_bbox(bbox: Bbox) -> List[Bbox]:
+    """Four quadrants of a bbox, in SW, SE, NW, NE order."""
+    south, west, north, east = bbox
+    mid_lat = round((south + north) / 2, 6)
+    mid_lng = round((west + east) / 2, 6)
+    return [
+        (south, west, mid_lat, mid_lng),
+        (south, mid_lng, mid_lat, east),
+        (mid_lat, west, north, mid_lng),
+        (mid_lat, mid_lng, north, east),
+    ]
+
+
+def leaf_owns(bbox: Bbox, bounds: Bbox, lat: float, lng: float) -> bool:
+    """
+    Whether a point belongs to this leaf. Leaves are half-open [south, north)
+    x [west, east), except along the outer north/east edge of the bounds, so
+    every point inside the bounds belongs to exactly one leaf.
+    """
+    south, west, north, east = bbox
+    in_lat = south <= lat < north or (lat == north == bounds[2])
+    in_lng = west <= lng < east or (lng == east == bounds[3])
+    return in_lat and in_lng
+
+
+class DensityGrid:
+    """Element counts per DENSITY_CELL_DEG cell, recorded during a fetch."""
+
+    def __init__(self, cell_deg: float = DENSITY_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.cells: Dict[Tuple[int, int], int] = {}
+
+    def add(self, lat: float, lng: float):
+        key = (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+        self.cells[key] = self.cells.get(key, 0) + 1
+
+    def merge(self, other: "DensityGrid"):
+        for key, count in other.cells.items():
+            self.cells[key] = self.cells.get(key, 0) + count
+
+    def count(self, bbox: Bbox) -> int:
+        """Estimated elements in bbox: cells whose center falls inside it."""
+        south, west, north, east = bbox
+        total = 0
+        for (row, col), count in self.cells.items():
+            lat = (row + 0.5) * self.cell_deg
+            lng = (col + 0.5) * self.cell_deg
+            if south <= lat < north and west <= lng < east:
+                total += count
+        return total
+
+    def save(self, path: str):
+        write_json_atomic(path, {
+            "cell_deg": self.cell_deg,
+            "cells": [[row, col, count] for (row, col), count in sorted(self.cells.items())],
+        })
+
+    @classmethod
+    def load(cls, path: str) -> Optional["DensityGrid"]:
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        grid = cls(data["cell_deg"])
+        grid.cells = {(row, col): count for row, col, count in data["cells"]}
+        return grid
+
+
+def build_plan(bounds: Bbox, count: Callable[[Bbox], int], max_elements: int,
+               min_leaf_deg: float = MIN_LEAF_DEG, source: str = "") -> Dict:
+    """
+    Split bounds into quadtree leaves holding at most max_elements each
+    (by the `count` estimate). Leaves are listed in depth-first SW, SE, NW,
+    NE order and named by their quadtree path ("q" + digits).
+    """
+    leaves = []
+    queries = 0
+
+    def visit(bbox: Bbox, path: str):
+        nonlocal queries
+        estimate = count(bbox)
+        queries += 1
+        south, west, north, east = bbox
+        too_small = min(north - south, east - west) / 2 < min_leaf_deg
+        if estimate <= max_elements or too_small:
+            # Empty leaves stay in the plan so the leaves always tile the bounds
+            leaves.append({"id": f"q{path}", "bbox": list(bbox), "estimate": estimate})
+            return
+        for index, child in enumerate(split_bbox(bbox)):
+            visit(child, path + str(index))
+
+    visit(tuple(bounds), "")
+    print(f"  Planned {len(leaves)} leaves from {queries} density estimates ({source or 'count'})")
+    return {
+        "bounds": list(bounds),
+        "max_elements": max_elements,
+        "source": source,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "leaves": leaves,
+    }
+
+
+def load_plan(path: str, bounds: Bbox, max_elements: int) -> Optional[Dict]:
+    """The cached plan, or None if missing, for other bounds/budget, or stale."""
+    try:
+        with open(path, "r") as f:
+            plan = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if plan.get("bounds") != list(bounds) or plan.get("max_elements") != max_elements:
+        return None
+    if plan.get("stale"):
+        return None
+    return plan
+
+
+def save_plan(path: str, plan: Dict):
+    write_json_atomic(path, plan)
+
+
+def record_leaf_counts(path: str, plan: Dict, counts: Dict[str, int]):
+    """
+    Store the element count each leaf actually returned. If any leaf came
+    back well over budget the plan is marked stale, so the next run replans
+    (from the density grid this run saved).
+    """
+    over = []
+    for leaf in plan["leaves"]:
+        if leaf["id"] in counts:
+            leaf["observed"] = counts[leaf["id"]]
+            if leaf["observed"] > plan["max_elements"] * OVER_BUDGET_FACTOR:
+                over.append(leaf["id"])
+    if over:
+        print(f"  {len(over)} leaves over budget ({', '.join(over[:5])}); replanning next run")
+        plan["stale"] = True
+    save_plan(path, plan)
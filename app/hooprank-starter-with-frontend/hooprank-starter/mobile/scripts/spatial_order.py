@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Hilbert-curve ordering for the court pipeline's outputs.
+
+Courts used to come out in Overpass response order, so neighbours ended up
+far apart in every file: grid-bucket dedupe loops jumped around memory,
+gzip found few repeats within its window, and refetching one city changed
+bytes all over the file. Writers that create a dataset (the fetchers)
+sort by spatial_key() instead:
+
+  - the Hilbert index of the point on a 2^HILBERT_ORDER grid per axis
+    (~300 m cells), so records close on the curve are close on the map
+  - then the id, so the order is total and doesn't depend on input order
+
+write_dart_list sorts by default. Stages that rewrite an existing dataset
+(the dedupe passes, dedupe_report undo) keep its order instead: their
+same-name rules keep whichever record comes first, so re-sorting their
+output would let a rerun on it remove different records. Their input is
+already in spatial_order when it comes from the fetchers.
+
+Usage:
+    courts = spatial_sort(courts)
+"""
+
+from typing import Dict, Iterable, List, Tuple
+
+HILBERT_ORDER = 16
+
+_CELLS = 1 << HILBERT_ORDER
+_LNG_SCALE = _CELLS / 360.0
+_LAT_SCALE = _CELLS / 180.0
+
+# Records without coordinates sort after every real point
+_NO_POINT = 1 << (2 * HILBERT_ORDER)
+
+
+def _build_table() -> List[Tuple[int, int]]:
+    """
+    Hilbert state machine over 4 bits of x and y at a time: index
+    state << 8 | x << 4 | y -> (8 bits of curve index, next state). The
+    state is the rotation so far: bit 0 = axes swapped, bit 1 = both flipped.
+    """
+    table = []
+    for state in range(4):
+        for xy in range(256):
+            x, y = xy >> 4, xy & 15
+            swap, flip = state & 1, state >> 1
+            d = 0
+            for shift in (3, 2, 1, 0):
+                rx, ry = (x >> shift) & 1, (y >> shift) & 1
+                if flip:
+                    rx, ry = rx ^ 1, ry ^ 1
+                if swap:
+                    rx, ry = ry, rx
+                d = (d << 2) | ((3 * rx) ^ ry)
+                if ry == 0:
+                    flip ^= rx
+                    swap ^= 1
+            table.append((d, swap | (flip << 1)))
+    return table
+
+
+_TABLE = _build_table()
+
+
+def hilbert_key(lat: float, lng: float) -> int:
+    """Position of a point along the Hilbert curve over the whole globe."""
+    x = int((lng + 180.0) * _LNG_SCALE)
+    y = int((lat + 90.0) * _LAT_SCALE)
+    if not (0 <= x < _CELLS and 0 <= y < _CELLS):
+        x = min(max(x, 0), _CELLS - 1)
+        y = min(max(y, 0), _CELLS - 1)
+    # Four 4-bit steps (HILBERT_ORDER = 16), unrolled
+    d1, state = _TABLE[((x >> 8) & 0xF0) | (y >> 12)]
+    d2, state = _TABLE[(state << 8) | ((x >> 4) & 0xF0) | ((y >> 8) & 15)]
+    d3, state = _TABLE[(state << 8) | (x & 0xF0) | ((y >> 4) & 15)]
+    d4, _ = _TABLE[(state << 8) | ((x << 4) & 0xF0) | (y & 15)]
+    return (d1 << 24) | (d2 << 16) | (d3 << 8) | d4
+
+
+def spatial_key(record: Dict) -> Tuple[int, str]:
+    """Sort key of a court/gym record: Hilbert index, then id."""
+    lat, lng = record.get('lat'), record.get('lng')
+    key = hilbert_key(lat, lng) if lat is not None and lng is not None else _NO_POINT
+    return key, str(record.get('id', ''))
+
+
+def spatial_sort(records: Iterable[Dict]) -> List[Dict]:
+    return sorted(records, key=spatial_key)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Staged, all-or-nothing output writes for the court pipeline.
+
+Several stages write more than one file (comprehensive_dedupe writes
+courts_named.json and courts.json) or rewrite their input in place
+(deduplicate_indoor_gyms, filter_false_positives and cross_source_dedupe
+rewrite indoor_gyms_data.dart). A crash part-way used to leave truncated or
+mismatched files behind.
+
+With StagedOutputs a stage writes every output to a temp file next to its
+final path. On commit the temps are fsynced, a commit journal listing the
+renames is written, and the temps are renamed over the finals. If the process
+dies during the renames, the next StagedOutputs for that stage (or
+`python staged_output.py recover`) replays the journal, so the set of outputs
+always moves forward together.
+
+Each committed stage also writes a manifest with the sha256 of every output and
+input, so a rerun can tell when its inputs haven't changed and skip the work.
+
+Usage:
+  with StagedOutputs('deduplicate_indoor_gyms', inputs=[gyms_file]) as stage:
+      if stage.up_to_date([gyms_file]):
+          return
+      generate_dart_file(gyms, stage.path(gyms_file))
+"""
+
+import filecmp
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterable, List, Optional
+
+# Manifests, commit journals and dedupe reports live here (not next to the
+# data, since assets/data/ is bundled into the app as-is).
+STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pipeline")
+
+HASH_CHUNK = 1 << 20
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def fsync_file(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def replace_if_changed(tmp_path: str, path: str, fsync: bool = True) -> bool:
+    """
+    Move `tmp_path` over `path` atomically unless the bytes are identical, in
+    which case the temp is dropped and `path` keeps its mtime. Returns True if
+    `path` changed.
+    """
+    if os.path.exists(path) and filecmp.cmp(tmp_path, path, shallow=False):
+        os.remove(tmp_path)
+        return False
+    if fsync:
+        fsync_file(tmp_path)
+    os.replace(tmp_path, path)
+    if fsync:
+        _fsync_dir(os.path.dirname(os.path.abspath(path)))
+    return True
+
+
+def file_digest(path: str, cache: Optional[Dict] = None) -> Optional[str]:
+    """
+    sha256 of a file, or None if it doesn't exist.
+
+    `cache` maps path -> {size, mtime_ns, sha256}; when size and mtime match
+    the cached digest is reused so unchanged files aren't re-read.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if cache is not None:
+        hit = cache.get(path)
+        if hit and hit["size"] == st.st_size and hit["mtime_ns"] == st.st_mtime_ns:
+            return hit["sha256"]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    if cache is not None:
+        cache[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+    return digest
+
+
+def manifest_path(stage: str) -> str:
+    return os.path.join(STATE_DIR, f"{stage}.manifest.json")
+
+
+def journal_path(stage: str) -> str:
+    return os.path.join(STATE_DIR, f"{stage}.commit.json")
+
+
+def load_manifest(stage: str) -> Optional[Dict]:
+    try:
+        with open(manifest_path(stage), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_json_atomic(path: str, data: Dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def recover(stage: str) -> int:
+    """
+    Finish an interrupted commit for `stage`. Every temp listed in the journal
+    was fsynced before the journal was written, so rolling forward is safe.
+    Returns the number of renames replayed.
+    """
+    path = journal_path(stage)
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r") as f:
+        journal = json.load(f)
+    replayed = 0
+    for tmp, final in journal["renames"]:
+        if os.path.exists(tmp):
+            os.replace(tmp, final)
+            _fsync_dir(os.path.dirname(final))
+            replayed += 1
+    if journal.get("manifest"):
+        write_json_atomic(manifest_path(stage), journal["manifest"])
+    os.remove(path)
+    return replayed
+
+
+class StagedOutputs:
+    """Collects a stage's outputs and swaps them into place together."""
+
+    def __init__(self, stage: str, inputs: Iterable[str] = (), params: Optional[Dict] = None):
+        self.stage = stage
+        self.inputs = [os.path.abspath(p) for p in inputs]
+        self.params = params or {}
+        self.staged: Dict[str, str] = {}
+        self.changed: List[str] = []
+        replayed = recover(stage)
+        if replayed:
+            print(f"  [{stage}] finished {replayed} interrupted output rename(s) from the last run")
+
+    def path(self, final_path: str) -> str:
+        """Temp path to write `final_path` to; it is moved into place on commit."""
+        final_path = os.path.abspath(final_path)
+        tmp = self.staged.get(final_path)
+        if tmp is None:
+            tmp = f"{final_path}.staged{os.getpid()}"
+            self.staged[final_path] = tmp
+        return tmp
+
+    def up_to_date(self, outputs: Iterable[str]) -> bool:
+        """
+        True if the last commit of this stage produced `outputs` from the same
+        inputs and params, and none of them has changed since.
+
+        Paths that are both input and output (in-place stages) are compared
+        against the hash they had when this stage last wrote them.
+        """
+        manifest = load_manifest(self.stage)
+        if not manifest or manifest.get("params") != self.params:
+            return False
+        outputs = [os.path.abspath(p) for p in outputs]
+        recorded_outputs = manifest.get("outputs", {})
+        recorded_inputs = manifest.get("inputs", {})
+        cache = manifest.get("stat_cache", {})
+        for path in outputs:
+            if path not in recorded_outputs or file_digest(path, cache) != recorded_outputs[path]:
+                return False
+        for path in self.inputs:
+            if path in outputs:
+                continue
+            if path not in recorded_inputs or file_digest(path, cache) != recorded_inputs[path]:
+                return False
+        return True
+
+    def commit(self):
+        # 1. Make every staged file durable; drop the ones that didn't change
+        renames = []
+        for final, tmp in self.staged.items():
+            if not os.path.exists(tmp):
+                raise FileNotFoundError(f"Stage '{self.stage}' never wrote {final}")
+            if os.path.exists(final) and filecmp.cmp(tmp, final, shallow=False):
+                os.remove(tmp)
+                continue
+            fsync_file(tmp)
+            renames.append((tmp, final))
+
+        # 2. Manifest of what the outputs will hash to once in place
+        cache: Dict = {}
+        outputs = {final: file_digest(tmp if (tmp, final) in renames else final)
+                   for final, tmp in self.staged.items()}
+        inputs = {path: file_digest(path, cache) for path in self.inputs if path not in self.staged}
+        manifest = {
+            "stage": self.stage,
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params": self.params,
+            "inputs": inputs,
+            "outputs": outputs,
+        }
+
+        # 3. Journal, then the renames, then the manifest
+        write_json_atomic(journal_path(self.stage), {"renames": renames, "manifest": manifest})
+        for tmp, final in renames:
+            os.replace(tmp, final)
+        for directory in {os.path.dirname(final) for _, final in renames}:
+            _fsync_dir(directory)
+        manifest["stat_cache"] = {}
+        for final in self.staged:
+            file_digest(final, manifest["stat_cache"])
+        manifest["stat_cache"].update(cache)
+        write_json_atomic(manifest_path(self.stage), manifest)
+        os.remove(journal_path(self.stage))
+
+        self.changed = [final for _, final in renames]
+        self.staged = {}
+
+    def abort(self):
+        for tmp in self.staged.values():
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.staged = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.staged:
+            self.commit()
+        else:
+            self.abort()
+
+
+def main():
+    # python staged_output.py recover [stage ...]
+    if len(sys.argv) < 2 or sys.argv[1] != "recover":
+        print("Usage: python staged_output.py recover [stage ...]")
+        return
+    stages = sys.argv[2:] or [
+        os.path.basename(p)[:-len(".commit.json")] for p in glob.glob(os.path.join(STATE_DIR, "*.commit.json"))
+    ]
+    for stage in stages:
+        print(f"{stage}: replayed {recover(stage)} rename(s)")
+
+
+if __name__ == "__main__":
+    main()